@@ -2,91 +2,3565 @@ import sys
 import time
 from socket import AF_INET
 from socket import AF_INET6
+from socket import AF_UNIX
 from socket import SOCK_DGRAM
 from socket import SOCK_STREAM
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from itertools import count
+from socket import SOL_SOCKET
+from socket import SO_REUSEADDR
+from socket import socket
+from socket import gethostname
+from array import array
+from collections import namedtuple, deque
+import threading
+import concurrent.futures
 import psutil
 from psutil._common import bytes2human
 import argparse
 import subprocess
-from tabulate import tabulate
 import logging
+import logging.handlers
+import queue
+import gzip
+import atexit
 import os
-import schedule
+import re
+import heapq
+import bisect
+import shlex
+import signal
+import calendar
+import datetime
+import contextlib
+import csv
+import json
+import select
+import shutil
+import mmap
+import struct
+import zlib
+import ipaddress
+
+# matplotlib and tabulate are imported where they are used so the
+# one shot commands (-S, -K, -M ...) don't pay for loading a GUI stack
+
+# attributes psutil.Process.as_dict() understands, used to check --Fields
+psutil_attrs = {name for name in dir(psutil.Process) if not name.startswith('_')} - {
+    'as_dict', 'children', 'kill', 'oneshot', 'parent', 'parents', 'resume', 'send_signal', 'suspend',
+    'terminate', 'wait', 'is_running', 'pid', 'info'}
 
 # create log file
 log_file = "process_Log.txt"
 log_dir = "Process_log_directory"
+# sampled metrics are persisted here with -A
+metrics_dir = "Process_metrics_directory"
+# scheduled jobs are saved here
+jobs_file = "Process_jobs.json"
 file_path = os.path.join(log_dir, log_file)
 
-# check if logging directory already exists
-if not os.path.exists(log_dir):
-    os.mkdir(log_dir)
-    print('Have successfully created the logging directory')
 
-# create log options
-logging.basicConfig(filename=file_path, level=logging.INFO,
-                    format="%(asctime)s:%(filename)s:%(message)s")
+# one json object per log line for --LogFormat json
+class Json_Formatter(logging.Formatter):
+    def format(self, record) -> str:
+        line = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'file': record.filename,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            line['exception'] = self.formatException(record.exc_info)
+        return json.dumps(line)
+
+
+# logging calls only put the record on a bounded queue, so a slow or busy disk never holds up a scan
+# when the queue is full the record is dropped and counted instead of waiting
+class Queue_Handler(logging.handlers.QueueHandler):
+    def __init__(self, records) -> None:
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the messages are f-strings already, formatting is left to the writer thread
+        return record
+
+    def enqueue(self, record) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# drains the log queue in batches, writes each batch with one write and one flush,
+# and rolls the file over once it is too big or too old, gzipping the old one
+class Log_Writer(threading.Thread):
+    batch_size = 512
+    # both formats start every record with formatTime's local time
+    record_time = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d')
+
+    def __init__(self, records, handler, path=None, formatter=None, max_bytes=10 * 1024 ** 2,
+                 rotate_after=86400.0, backups=5) -> None:
+        super().__init__(daemon=True, name='log-writer')
+        self.records = records
+        self.handler = handler
+        self.path = path or file_path
+        self.formatter = formatter or logging.Formatter("%(asctime)s:%(filename)s:%(message)s")
+        self.max_bytes = max_bytes
+        self.rotate_after = rotate_after
+        self.backups = backups
+        self.stream = None
+        self.opened = 0.0  # when the current file got its first record
+        self.written = 0
+        self.batches = 0
+
+    def open(self) -> None:
+        # the directory is only made once there is something to write
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.stream = open(self.path, 'a', encoding='utf-8')
+        self.opened = self.first_record()
+
+    def first_record(self) -> float:
+        # most runs are one shot commands, so the age for rotate_after has to come from the file
+        # and not from when this writer started
+        try:
+            with open(self.path, encoding='utf-8', errors='replace') as log:
+                first = log.readline(4096)
+            found = self.record_time.search(first)
+            if found:
+                return time.mktime(time.strptime(found.group(), '%Y-%m-%d %H:%M:%S'))
+            # a file that doesn't start with a record, the last write is as old as we can tell
+            return os.stat(self.path).st_mtime if first else time.time()
+        except (OSError, ValueError, OverflowError):
+            return time.time()
+
+    def rotate(self) -> None:
+        self.stream.close()
+        self.stream = None
+        now = time.time()
+        # microseconds too so two rollovers in one second don't clash and names still sort by age
+        rotated = f'{self.path}.{time.strftime("%Y%m%d-%H%M%S", time.localtime(now))}-{int(now * 1e6) % 1000000:06d}'
+        os.replace(self.path, rotated)
+        with open(rotated, 'rb') as source, gzip.open(f'{rotated}.gz', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(rotated)
+        # keep the newest backups, the timestamp in the name sorts by age
+        directory, name = os.path.split(self.path)
+        old = sorted(entry for entry in os.listdir(directory or '.')
+                     if entry.startswith(f'{name}.') and entry.endswith('.gz'))
+        for entry in old[:max(0, len(old) - self.backups)]:
+            os.remove(os.path.join(directory, entry))
+
+    def write(self, batch) -> None:
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.formatter.format(record) + '\n')
+            except (TypeError, ValueError) as e:
+                lines.append(f'could not format log record {record.msg!r}: {e}\n')
+        if self.handler.dropped:
+            lines.append(f'{self.handler.dropped} log records were dropped while the log queue was full\n')
+            self.handler.dropped = 0
+        if self.stream is None:
+            self.open()
+        self.stream.write(''.join(lines))
+        self.stream.flush()
+        self.written += len(batch)
+        self.batches += 1
+        if self.stream.tell() >= self.max_bytes or time.time() - self.opened >= self.rotate_after:
+            self.rotate()
+
+    def run(self) -> None:
+        while True:
+            batch = [self.records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            # None is the stop marker, it is always the last thing put on the queue
+            stopping = batch[-1] is None
+            if stopping:
+                batch.pop()
+            if batch:
+                try:
+                    self.write(batch)
+                except OSError as e:
+                    print(f'could not write to the log {self.path}: {e}', file=sys.stderr)
+            if stopping:
+                break
+        if self.stream is not None:
+            self.stream.close()
+
+    def stop(self) -> None:
+        if self.is_alive():
+            self.records.put(None)
+            self.join()
+
+
+log_writer = None
+
+
+def setup_logging(log_format='text', max_bytes=10 * 1024 ** 2, rotate_after=86400.0, backups=5) -> None:
+    # records go through a queue to a background writer, see Log_Writer
+    global log_writer
+    if log_writer is not None:
+        return
+    records = queue.Queue(maxsize=10000)
+    handler = Queue_Handler(records)
+    formatter = Json_Formatter() if log_format == 'json' else None
+    log_writer = Log_Writer(records, handler, file_path, formatter, max_bytes, rotate_after, backups)
+    log_writer.start()
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    # whatever is still queued gets written before the interpreter goes away
+    atexit.register(log_writer.stop)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    # create options to use
+    parse = argparse.ArgumentParser(description='A simple process monitoring tool')
+
+    # various arguments that can be used
+    parse.add_argument('-K', '--Kill', type=str, help='Select the process you want to kill')
+    parse.add_argument('-S', '--Search', type=str, help='search for a given process')
+    parse.add_argument('-MT', '--Match', type=str, default='name',
+                       choices=['name', 'cmdline', 'regex', 'user', 'tree'],
+                       help='how -S and -K match: exact name, cmdline substring, cmdline regex, '
+                            'user, or a whole process tree given a pid or name')
+    parse.add_argument('-KT', '--KillTimeout', type=float, default=3.0,
+                       help='seconds to wait after SIGTERM before sending SIGKILL')
+    parse.add_argument('-St', '--Start', type=str,
+                       help='start a program without a shell and watch it until it exits, '
+                            'e.g "python worker.py" or a -SV spec')
+    parse.add_argument('-SV', '--Supervise', type=str, action='append',
+                       help='program to start and keep running, e.g "name=web;cmd=python worker.py;count=4;'
+                            'restart=on-failure;backoff=1s;max_backoff=1m;keep=200;output=logs;max_size=10M;backups=3"')
+    parse.add_argument('-L', '--List', help='list all currently running process ', action='store_true')
+    parse.add_argument('-WK', '--Workers', type=int, default=1,
+                       help='read process attributes on this many workers, useful with thousands of processes')
+    parse.add_argument('-PL', '--Pool', type=str, default='thread', choices=['thread', 'process'],
+                       help='run the -WK workers as threads or as separate processes')
+    parse.add_argument('-O', '--Output', '--output', type=str, choices=Record_Writer.formats,
+                       help='stream -L, -F, -N and -DI results as json, ndjson or csv instead of a table')
+    parse.add_argument('-FD', '--Fields', '--fields', type=str,
+                       help='comma separated fields for -O, e.g "pid,name,rss,cpu,username,num_threads", '
+                            'only these get read from each process')
+    parse.add_argument('-AL', '--Alert', type=str, action='append',
+                       help='alert rule, can be given more than once e.g "rss>500M;for=30s", "cpu>80;avg=1m", '
+                            '"zombies>5", "disk>90;clear=85", "memory>95;rate=2" or "cpu>50;match=name~^java"')
+    parse.add_argument('-AO', '--AlertOutput', type=str, action='append',
+                       help='where alerts go: stdout (default), file:<path> or command:<command>, can be repeated')
+    parse.add_argument('-AG', '--Agent', type=str,
+                       help='stream this host\'s processes to a collector every --Refresh seconds, '
+                            'e.g host:9120, tcp:host:9120 or unix:/tmp/collector.sock')
+    parse.add_argument('-AN', '--AgentName', type=str, help='name the agent reports, the hostname by default')
+    parse.add_argument('-CO', '--Collector', type=str,
+                       help='listen for agents on this address and merge them into one fleet wide view, '
+                            'works with -L, -F, -O and -RU user, shows the agents on its own')
+    parse.add_argument('-RC', '--Record', '--record', type=str,
+                       help='record every sampler tick (-D sets the interval) to this file for --Replay, '
+                            'works alongside -L, -MON, -F and the rest')
+    parse.add_argument('-RP', '--Replay', '--replay', type=str,
+                       help='play a recording back into -L, -F, -C and -O instead of reading this host, '
+                            'on its own it describes the recording')
+    parse.add_argument('-RF', '--ReplayFrom', type=str,
+                       help='where the replay starts: epoch seconds, "YYYY-MM-DD HH:MM[:SS]" or +90s/+5m from the start')
+    parse.add_argument('-SP', '--Speed', type=float, default=1.0, help='replay speed, 2 plays twice as fast')
+    parse.add_argument('-SC', '--Schedule', action='store_true',
+                       help='run the scheduled jobs from --JobsFile until ctrl+c')
+    parse.add_argument('-JA', '--AddJob', type=str,
+                       help='schedule a job e.g "name=disk;action=disk;every=daily;at=09:00;catch_up=once" '
+                            '(actions snapshot/filter/disk/memory/run_program/virus_updates, every '
+                            'daily/weekly/monthly/once or an interval like 5m, catch_up skip/once/all)')
+    parse.add_argument('-JR', '--RemoveJob', type=str, help='remove a scheduled job by name')
+    parse.add_argument('-JL', '--Jobs', action='store_true', help='list the scheduled jobs')
+    parse.add_argument('-JF', '--JobsFile', type=str, default=jobs_file, help='where scheduled jobs are saved')
+    parse.add_argument('-LF', '--LogFormat', type=str, choices=['text', 'json'], default='text',
+                       help='write the log as text or as one json object per line')
+    parse.add_argument('-LS', '--LogSize', type=str, default='10M',
+                       help='roll the log over and gzip it once it is this big, e.g 10M')
+    parse.add_argument('-LR', '--LogRotate', type=str, default='1d',
+                       help='roll the log over once it is this old, e.g 12h or 1d')
+    parse.add_argument('-LB', '--LogBackups', type=int, default=5, help='how many gzipped logs are kept')
+    parse.add_argument('-ST', '--Stats', '--stats', action='store_true',
+                       help='print how long each phase took, error counts and the monitor\'s own cpu/rss on exit')
+    parse.add_argument('-P', '--Profile', '--profile', type=str, nargs='?', const='process_monitor.prof',
+                       help='write a cProfile dump of the run to this file (default process_monitor.prof)')
+    parse.add_argument('-DT', '--Details', action='store_true',
+                       help='show uss, pss, fds and threads, read for the top and changed processes within a time budget')
+    parse.add_argument('-DK', '--DetailTop', type=int, default=10,
+                       help='how many of the top processes by rss and by cpu get details every round')
+    parse.add_argument('-DB', '--DetailBudget', type=float, default=50.0,
+                       help='milliseconds per tick spent reading details')
+    parse.add_argument('-DE', '--DetailEvery', type=float, default=10.0,
+                       help='seconds before a process is due for new details')
+    parse.add_argument('-CP', '--CpuCap', type=float, default=5.0,
+                       help='cpu percent the monitor aims to stay under, details and then ticks slow down above it')
+    parse.add_argument('-RR', '--Refresh', type=float, default=2.0,
+                       help='seconds between snapshots in the live process list, agent updates and the collector view')
+    parse.add_argument('-SO', '--Sort', type=str, default='pid', choices=['pid', 'memory', 'cpu', 'name'],
+                       help='column the live process list starts sorted by')
+    parse.add_argument('-F', '--Filter', type=str, help='filter out particular process, either one of the '
+                       'named filters or an expression e.g "status=sleeping,rss>50M,user=root,name~^py,age>1h,cpu>5"')
+    parse.add_argument('-RU', '--Rollup', type=str, choices=Process_Rollup.modes,
+                       help='sum cpu, memory, threads, fds and connections per process tree, user or cgroup, '
+                            'works with -L, -F (only matching processes count), -O and -E')
+    parse.add_argument('-RB', '--RollupRoot', type=str,
+                       help='drill down into one group: a pid for tree, a user name for user (grouped by name '
+                            'then) or a cgroup path like /system.slice for cgroup')
+    parse.add_argument('-N', '--Network', type=str, nargs='?', const='',
+                       help='show process network connections, optionally filtered '
+                            'e.g "proto=tcp,state=LISTEN,port=443,raddr=10.0.0.0/8"')
+    parse.add_argument('-DI', '--Disk', help='show disk usage per partition', action='store_true')
+    parse.add_argument('-IO', '--IO', type=float, nargs='?', const=1.0,
+                       help='disk throughput, iops and busy time per device and the top --Top processes by i/o, '
+                            'measured over this many seconds (default 1)')
+    parse.add_argument('-PT', '--ProbeTimeout', type=float, default=2.0,
+                       help='seconds to wait for a mountpoint before it is reported as timed out')
+    parse.add_argument('-M', '--Memory', help='check memory information', action='store_true')
+    parse.add_argument('-MON', '--Monitor', help='Display all methods continuously i.e enter monitor mode'
+                       , action='store_true')
+    parse.add_argument('-C', '--Graph', help='display cpu utilization in real time', action='store_true')
+    parse.add_argument('-D', '--Daemon', type=float, nargs='?', const=1.0,
+                       help='keep sampling system and process metrics in the background every N seconds '
+                            '(default 1), on its own or together with -MON and the other options')
+    parse.add_argument('-A', '--Archive', help='persist the sampled metrics to disk (starts -D if needed)',
+                       action='store_true')
+    parse.add_argument('-AD', '--ArchiveDir', type=str, default=metrics_dir,
+                       help='directory the archive is written to and queried from')
+    parse.add_argument('-R', '--Retention', type=str,
+                       help='days each archive tier is kept for, e.g "raw=1,1m=14,1h=365"')
+    parse.add_argument('-Q', '--Query', type=str,
+                       help='show the top memory users at a past time from the archive, '
+                            'e.g "2026-10-18 03:14" or epoch seconds')
+    parse.add_argument('-T', '--Top', type=int, default=10,
+                       help='how many processes -Q shows and the exporter gives their own series')
+    parse.add_argument('-E', '--Exporter', '--exporter', type=int, nargs='?', const=9110,
+                       help='serve OpenMetrics on this port (default 9110) for prometheus to scrape')
+    parse.add_argument('-EA', '--ExporterAddress', type=str, default='127.0.0.1',
+                       help='address the exporter listens on')
+    parse.add_argument('-MA', '--MaxAge', type=float, default=5.0,
+                       help='seconds a scrape is cached for before the exporter reads the system again')
+    parse.add_argument('-TB', '--TopBy', type=str, default='cpu', choices=['cpu', 'rss'],
+                       help='how the exporter picks the top processes')
+    parse.add_argument('-W', '--Window', type=int, default=60,
+                       help='how many samples the live graph keeps (one every 0.5s)')
+    parse.add_argument('-PC', '--PerCore', help='draw one cpu line per core in the live graph', action='store_true')
+    return parse
+
+
+def display_banner() -> None:
+    Banner = """
+   ╔═══════════════════════════════════════════════════════════════════╗
+   ║                                                                   ║
+   ║                                                                   ║
+   ║                                                                   ║   
+   ║    _____                __  __             _ _                    ║   
+   ║    |  __ \              |  \/  |           (_) |                  ║   
+   ║    | |__) | __ ___   ___| \  / | ___  _ __  _| |_ ___  _ __       ║   
+   ║    |  ___/ '__/ _ \ / __| |\/| |/ _ \| '_ \| | __/ _ \| '__|      ║   
+   ║    | |   | | | (_) | (__| |  | | (_) | | | | | || (_) | |         ║   
+   ║    |_|   |_|  \___/ \___|_|  |_|\___/|_| |_|_|\__\___/|_|         ║          
+   ║                                                                   ║   
+   ║                                                                   ║   
+   ║                                                                   ║    
+   ║     Process & Network Monitor - View processes and network        ║
+   ║                                 connections                       ║
+   ║                                                                   ║
+   ╚═══════════════════════════════════════════════════════════════════╝
+"""
+    print(Banner)
+
+
+# times the phases of each command (enumerate, fetch, filter, format, emit, render, log)
+# and counts processes visited and NoSuchProcess/AccessDenied hits for --stats
+# when it is off every phase() is the same shared no-op context so the hot paths stay cheap
+class Instrumentation:
+    null_phase = contextlib.nullcontext()
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.command = 'none'
+        self.phases = {}  # (command, phase) -> [seconds, calls]
+        self.counters = {}
+        self.started = time.monotonic()
+
+    def enable(self) -> None:
+        self.enabled = True
+        self.started = time.monotonic()
+        # time how long the log handlers keep us waiting as well
+        for handler in logging.getLogger().handlers:
+            handle = handler.handle
+
+            def timed_handle(record, handle=handle):
+                with self.phase('log'):
+                    return handle(record)
+            handler.handle = timed_handle
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            spent = self.phases.setdefault((self.command, name), [0.0, 0])
+            spent[0] += time.perf_counter() - start
+            spent[1] += 1
+
+    def phase(self, name):
+        return self.timed(name) if self.enabled else self.null_phase
+
+    def count(self, name, amount=1) -> None:
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def usage(self) -> list:
+        # what the monitor itself cost
+        me = psutil.Process()
+        wall = time.monotonic() - self.started
+        cpu = me.cpu_times()
+        rows = [['wall time', f'{wall:.3f}s'],
+                ['cpu user/system', f'{cpu.user:.3f}s / {cpu.system:.3f}s'],
+                ['cpu percent', f'{(cpu.user + cpu.system) / wall * 100 if wall else 0.0:.1f}%'],
+                ['rss', bytes2human(me.memory_info().rss)]]
+        try:
+            import resource
+            # kilobytes on linux
+            rows.append(['peak rss', bytes2human(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)])
+        except ImportError:
+            peak = getattr(me.memory_info(), 'peak_wset', None)
+            if peak is not None:
+                rows.append(['peak rss', bytes2human(peak)])
+        return rows
+
+    def summary(self) -> str:
+        phases = [[command, name, calls, f'{seconds * 1000:.2f}', f'{seconds * 1000 / calls:.3f}']
+                  for (command, name), (seconds, calls) in sorted(self.phases.items())]
+        counters = [[name, value] for name, value in sorted(self.counters.items())]
+        return '\n'.join([
+            Monitor.draw_table(phases, ['COMMAND', 'PHASE', 'CALLS', 'TOTAL (ms)', 'MEAN (ms)']),
+            Monitor.draw_table(counters, ['COUNTER', 'VALUE']),
+            Monitor.draw_table(self.usage(), ['SELF', 'VALUE']),
+        ])
+
+
+instrumentation = Instrumentation()
+
+
+# name, user and parent lookups kept up to date from the snapshot's new/exited pid diffs
+# so searching and killing never have to walk every process
+class Process_Index:
+    def __init__(self) -> None:
+        self.names = {}  # name -> set of pids
+        self.users = {}  # username -> set of pids
+        self.children = {}  # ppid -> set of pids
+
+    @staticmethod
+    def add_to(index, key, pid) -> None:
+        index.setdefault(key, set()).add(pid)
+
+    @staticmethod
+    def remove_from(index, key, pid) -> None:
+        pids = index.get(key)
+        if pids is not None:
+            pids.discard(pid)
+            if not pids:
+                del index[key]
+
+    def add(self, row) -> None:
+        self.add_to(self.names, row.get('name'), row['pid'])
+        self.add_to(self.users, row.get('username'), row['pid'])
+        self.add_to(self.children, row.get('ppid'), row['pid'])
+
+    def remove(self, row) -> None:
+        self.remove_from(self.names, row.get('name'), row['pid'])
+        self.remove_from(self.users, row.get('username'), row['pid'])
+        self.remove_from(self.children, row.get('ppid'), row['pid'])
+
+    def reparent(self, row, ppid) -> None:
+        # the row still holds the old ppid, the caller updates it afterwards
+        self.remove_from(self.children, row.get('ppid'), row['pid'])
+        self.add_to(self.children, ppid, row['pid'])
+
+    # the lookups hand back copies since the sampler thread may be updating the sets
+    def by_name(self, name) -> set:
+        return set(self.names.get(name, ()))
+
+    def by_user(self, user) -> set:
+        return set(self.users.get(user, ()))
+
+    def descendants(self, pid) -> list:
+        # breadth first walk down the tree, the root itself is not included
+        found = []
+        seen = {pid}
+        queue = deque([pid])
+        while queue:
+            for child in sorted(self.children.get(queue.popleft(), ())):
+                if child not in seen:
+                    seen.add(child)
+                    found.append(child)
+                    queue.append(child)
+        return found
+
+
+def read_fields(proc, fields) -> tuple:
+    # as_dict catches AccessDenied itself and puts ad_value in, so a sentinel is the only way to
+    # tell a refused field from one that is really None
+    # returns the values with None for the refused ones and whether any were refused
+    refused = object()
+    values = proc.as_dict(fields, ad_value=refused)
+    denied = False
+    for field, value in values.items():
+        if value is refused:
+            values[field] = None
+            denied = True
+    if denied:
+        # a zombie refuses most reads the same way without anyone being denied anything
+        try:
+            denied = proc.status() != psutil.STATUS_ZOMBIE
+        except psutil.Error:
+            pass
+    return values, denied
+
+
+def collect_shard(shard, static_fields, dynamic_fields) -> list:
+    # used by the process pool, so it has to live at module level to be picklable
+    # shard is a list of (pid, create_time) where create_time is None for pids the parent hasn't seen
+    results = []
+    for pid, create_time in shard:
+        try:
+            proc = psutil.Process(pid)
+            reused = create_time is not None and proc.create_time() != create_time
+            static, denied = None, False
+            if create_time is None or reused:
+                static, denied = read_fields(proc, static_fields)
+            dynamic, refused = read_fields(proc, dynamic_fields)
+            results.append((pid, None, static, dynamic, None, denied or refused))
+        except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
+            results.append((pid, None, None, None, type(e).__name__, False))
+    return results
+
+
+# keeps a pid keyed cache of psutil.Process objects so every tick only
+# reads what actually changed instead of rebuilding the whole table
+# with workers > 1 the pids are split into shards that are read on a thread or process pool
+class Process_Snapshot:
+    # fields that don't change for the lifetime of a pid
+    # these are read once when the pid first shows up
+    static_fields = ('name', 'exe', 'cmdline', 'username', 'create_time')
+    # fields that are read again on every tick
+    dynamic_fields = ('memory_info', 'status', 'cpu_percent')
+    # read every tick whatever the caller asks for, the kernel reparents a process when its parent exits
+    # and the tree lookups in the index have to follow that
+    parent_field = 'ppid'
+
+    def __init__(self, static_fields=None, dynamic_fields=None, workers=1, pool='thread') -> None:
+        if static_fields is not None:
+            self.static_fields = tuple(static_fields)
+        if dynamic_fields is not None:
+            self.dynamic_fields = tuple(dynamic_fields)
+        self.workers = max(1, workers or 1)
+        self.pool = pool
+        self.executor = None
+        # pid -> psutil.Process, with a process pool the objects live in the workers
+        # so this holds None until get_process() needs a local one
+        self.processes = {}
+        self.rows = {}  # pid -> dict of attributes, same shape as proc.info
+        self.cpu_times = {}  # pid -> (when, user + system), only used with a process pool
+        self.new_pids = set()
+        self.exited_pids = set()
+        self.last_refresh = 0.0
+        self.index = Process_Index()
+        # pids that vanished or refused us during the last refresh
+        self.error_counts = {'NoSuchProcess': 0, 'AccessDenied': 0}
+
+    def drop(self, pid) -> None:
+        self.processes.pop(pid, None)
+        self.cpu_times.pop(pid, None)
+        row = self.rows.pop(pid, None)
+        if row is not None:
+            self.index.remove(row)
+
+    def get_executor(self):
+        if self.executor is None:
+            if self.pool == 'process':
+                self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def collect_thread_shard(self, shard, fields) -> list:
+        # returns (pid, process, static fields or None, dynamic fields or None, error name,
+        # whether any field was refused)
+        results = []
+        for pid in shard:
+            proc = self.processes.get(pid)
+            try:
+                static, denied = None, False
+                # a pid that is still here might have been reused by a different process
+                if proc is None or not proc.is_running():
+                    proc = psutil.Process(pid)
+                    static, denied = read_fields(proc, self.static_fields)
+                # as_dict wraps the reads in oneshot()
+                dynamic, refused = read_fields(proc, fields)
+                results.append((pid, proc, static, dynamic, None, denied or refused))
+            except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
+                results.append((pid, None, None, None, type(e).__name__, False))
+        return results
+
+    def collect(self, pids, fields) -> list:
+        if self.pool == 'process':
+            # the workers can't keep cpu_percent state between ticks so ship cpu_times back instead
+            shard_fields = tuple('cpu_times' if field == 'cpu_percent' else field for field in fields)
+            items = [(pid, self.rows[pid].get('create_time') if pid in self.rows else None) for pid in pids]
+            shards = [items[i::self.workers] for i in range(self.workers)]
+            futures = [self.get_executor().submit(collect_shard, shard, self.static_fields, shard_fields)
+                       for shard in shards if shard]
+        elif self.workers > 1:
+            shards = [pids[i::self.workers] for i in range(self.workers)]
+            futures = [self.get_executor().submit(self.collect_thread_shard, shard, fields)
+                       for shard in shards if shard]
+        else:
+            return self.collect_thread_shard(pids, fields)
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def cpu_percent_from_times(self, pid, times) -> float:
+        now = time.monotonic()
+        total = times.user + times.system
+        previous = self.cpu_times.get(pid)
+        self.cpu_times[pid] = (now, total)
+        if previous is None or now <= previous[0]:
+            # like cpu_percent(), the first reading only primes it
+            return 0.0
+        return round((total - previous[1]) / (now - previous[0]) * 100, 1)
+
+    def refresh(self, dynamic_fields=None) -> list:
+        # diff the current pids against the cache to find new and exited processes
+        with instrumentation.phase('enumerate'):
+            current = set(psutil.pids())
+        instrumentation.count('processes visited', len(current))
+        known = set(self.processes)
+        self.exited_pids = known - current
+        self.new_pids = set()
+        self.error_counts = {'NoSuchProcess': 0, 'AccessDenied': 0}
+        for pid in self.exited_pids:
+            self.drop(pid)
+
+        # read the dynamic fields once per tick and the static ones only for new pids
+        fields = tuple(dynamic_fields) if dynamic_fields else self.dynamic_fields
+        if self.parent_field not in fields:
+            fields += (self.parent_field,)
+        # the workers only read, every change to the cache happens here on the calling thread
+        with instrumentation.phase('fetch'):
+            results = self.collect(sorted(current), fields)
+        for pid, proc, static, dynamic, error, denied in results:
+            if denied:
+                # still listed, with None for whatever it wouldn't let us read
+                self.error_counts['AccessDenied'] += 1
+            if error is not None:
+                # gone or not allowed, either way it drops out of this snapshot
+                self.error_counts[error] += 1
+                if pid in self.rows:
+                    self.drop(pid)
+                    self.exited_pids.add(pid)
+                continue
+            if static is not None:
+                if pid in self.rows:
+                    self.drop(pid)
+                static['pid'] = pid
+                self.processes[pid] = proc
+                self.rows[pid] = static
+                self.new_pids.add(pid)
+            if self.pool == 'process' and 'cpu_percent' in fields:
+                times = dynamic.get('cpu_times')
+                dynamic['cpu_percent'] = self.cpu_percent_from_times(pid, times) if times is not None else None
+            row = self.rows[pid]
+            if static is None and dynamic.get('ppid', row.get('ppid')) != row.get('ppid'):
+                self.index.reparent(row, dynamic['ppid'])
+            row.update(dynamic)
+            if static is not None:
+                self.index.add(row)
+        for error, hits in self.error_counts.items():
+            instrumentation.count(error, hits)
+        self.last_refresh = time.monotonic()
+        return self.get_rows()
+
+    def get_rows(self) -> list:
+        return [self.rows[pid] for pid in sorted(self.rows)]
+
+    def stream(self, attrs):
+        # one pass that yields each row as soon as it is read and keeps nothing,
+        # for one shot commands that don't need a cache between ticks
+        self.error_counts = {'NoSuchProcess': 0, 'AccessDenied': 0}
+        with instrumentation.phase('enumerate'):
+            pids = psutil.pids()
+        for pid in pids:
+            instrumentation.count('processes visited')
+            try:
+                with instrumentation.phase('fetch'):
+                    row, denied = read_fields(psutil.Process(pid), attrs)
+            except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
+                self.error_counts[type(e).__name__] += 1
+                instrumentation.count(type(e).__name__)
+                continue
+            if denied:
+                self.error_counts['AccessDenied'] += 1
+                instrumentation.count('AccessDenied')
+            row['pid'] = pid
+            yield row
+
+    def get_process(self, pid):
+        proc = self.processes.get(pid)
+        if proc is None and pid in self.rows:
+            try:
+                proc = psutil.Process(pid)
+            except psutil.NoSuchProcess:
+                return None
+            self.processes[pid] = proc
+        return proc
+
+
+# reads the fields that cost a lot per process (memory_full_info walks smaps, fd and thread counts)
+# for a few processes per tick instead of all of them: new ones, the top K by rss and cpu and the ones
+# whose rss moved, then whatever is oldest, until the tick's time budget is spent
+# values stay on the row with detail_time so the output can say how old they are
+# when the monitor itself goes over cpu_cap the budget shrinks and the cadence stretches,
+# and once the budget can't go lower the caller is asked to tick less often through scale
+class Detail_Sampler:
+    fields = ('memory_full_info', 'num_fds', 'num_threads')
+    # rss moving by more than this since the last read makes a process due straight away
+    change = 0.2
+    min_budget = 0.005
+    max_scale = 8
+
+    def __init__(self, snapshot, top=10, budget=0.05, every=10.0, cpu_cap=5.0) -> None:
+        self.snapshot = snapshot
+        self.top = top
+        self.base_budget = self.budget = budget
+        self.base_every = self.every = every
+        self.cpu_cap = cpu_cap
+        self.scale = 1.0  # how much slower than asked the caller should tick
+        self.last_usage = (time.monotonic(), time.process_time())
+        self.reads = 0
+
+    @staticmethod
+    def rss(row) -> int:
+        return row['memory_info'].rss if row.get('memory_info') is not None else 0
+
+    def due(self, row, now) -> bool:
+        return row.get('detail_time') is None or now - row['detail_time'] >= self.every
+
+    def changed(self, row) -> bool:
+        full = row.get('memory_full_info')
+        if full is None or row.get('memory_info') is None:
+            return False
+        return abs(row['memory_info'].rss - full.rss) > full.rss * self.change
+
+    def candidates(self, rows, now) -> list:
+        # in the order they get read, each pid once
+        top = heapq.nlargest(self.top, rows, key=self.rss)
+        top += heapq.nlargest(self.top, rows, key=lambda row: row.get('cpu_percent') or 0.0)
+        picked = [row for row in top if self.due(row, now) or self.changed(row)]
+        picked += [row for row in rows if row['pid'] in self.snapshot.new_pids and row.get('detail_time') is None]
+        picked += [row for row in rows if self.changed(row)]
+        # everything else gets its turn oldest first, never read comes before all of them
+        picked += sorted((row for row in rows if self.due(row, now)), key=lambda row: row.get('detail_time') or 0.0)
+        seen = set()
+        return [row for row in picked if not (row['pid'] in seen or seen.add(row['pid']))]
+
+    def sample(self, rows, now=None, complete=False) -> list:
+        # rows are the snapshot's own rows, updated in place
+        # complete reads every process whatever the budget, for one shot filters and records that need the values
+        now = now if now is not None else time.time()
+        # fields the snapshot already reads every tick (a rollup wants fds and threads) are left to it
+        fields = tuple(field for field in self.fields if field not in self.snapshot.dynamic_fields)
+        deadline = time.perf_counter() + self.budget
+        reads = 0
+        with instrumentation.phase('detail'):
+            for row in self.candidates(rows, now):
+                if reads and not complete and time.perf_counter() >= deadline:
+                    break
+                proc = self.snapshot.get_process(row['pid'])
+                if proc is None:
+                    continue
+                try:
+                    row.update(proc.as_dict(fields, ad_value=None))
+                except psutil.NoSuchProcess:
+                    continue
+                row['detail_time'] = now
+                reads += 1
+        self.reads += reads
+        instrumentation.count('detail reads', reads)
+        if not complete:
+            self.adapt()
+        return rows
+
+    def adapt(self) -> None:
+        # cpu the whole monitor used since the last tick, as a percent of one core
+        wall, cpu = time.monotonic(), time.process_time()
+        elapsed = wall - self.last_usage[0]
+        if elapsed <= 0:
+            return
+        used = (cpu - self.last_usage[1]) / elapsed * 100
+        self.last_usage = (wall, cpu)
+        if used > self.cpu_cap:
+            if self.budget > self.min_budget:
+                self.budget = max(self.min_budget, self.budget / 2)
+                self.every = min(self.base_every * self.max_scale, self.every * 2)
+            elif self.scale < self.max_scale:
+                self.scale = min(self.max_scale, self.scale * 2)
+                logging.info(f'monitor at {used:.1f}% cpu over the {self.cpu_cap:g}% cap, ticking {self.scale:g}x slower')
+        elif used < self.cpu_cap / 2:
+            # back off the slow down first, then give the budget back
+            if self.scale > 1.0:
+                self.scale = max(1.0, self.scale / 2)
+            else:
+                self.budget = min(self.base_budget, self.budget * 1.5)
+                self.every = max(self.base_every, self.every / 1.5)
+
+    @staticmethod
+    def age(row, now=None):
+        # seconds since the expensive fields were read, None when they never were
+        if row.get('detail_time') is None:
+            return None
+        return max(0.0, (now if now is not None else time.time()) - row['detail_time'])
+
+    @classmethod
+    def display(cls, value, row, now=None) -> str:
+        # the value with how stale it is, e.g "12.4M 8s"
+        age = cls.age(row, now)
+        if value is None or age is None:
+            return 'N/A'
+        return f'{value} {int(age)}s'
+
+
+# samples cpu usage for every process over one shared interval
+# instead of blocking for a whole interval on each process
+class Cpu_Sampler:
+    def __init__(self, snapshot, interval=1.0) -> None:
+        self.snapshot = snapshot
+        self.interval = interval
+
+    def sample(self, dynamic_fields=None) -> list:
+        # the first call to cpu_percent() on a process only primes it,
+        # so prime everything, wait once and then read all the deltas in one pass
+        self.snapshot.refresh(dynamic_fields=('cpu_percent',))
+        time.sleep(self.interval)
+        rows = self.snapshot.refresh(dynamic_fields=dynamic_fields)
+        # processes we could not read are treated as idle
+        return sorted(rows, key=lambda row: row['cpu_percent'] or 0.0, reverse=True)
+
+    def top(self, n) -> list:
+        return self.sample()[:n]
+
+    def over_threshold(self, threshold) -> list:
+        # rows come back sorted so we can stop at the first one below the threshold
+        result = []
+        for row in self.sample():
+            if (row['cpu_percent'] or 0.0) <= threshold:
+                break
+            result.append(row)
+        return result
+
+
+# writes records as json, ndjson or csv one at a time as they come in
+# instead of building a table, so memory stays flat no matter how many rows there are
+class Record_Writer:
+    formats = ('json', 'ndjson', 'csv')
+
+    def __init__(self, fmt, fields, stream=None) -> None:
+        self.fmt = fmt
+        self.fields = list(fields)
+        self.stream = stream if stream is not None else sys.stdout
+        self.count = 0
+        self.csv_writer = None
+
+    @staticmethod
+    def value(value, flat=False):
+        # psutil addresses become "ip:port", csv cells can't hold lists
+        if hasattr(value, 'ip') and hasattr(value, 'port'):
+            return f'{value.ip}:{value.port}'
+        if isinstance(value, (list, tuple)) and flat:
+            return ' '.join(str(item) for item in value)
+        return value
+
+    def write(self, record) -> None:
+        with instrumentation.phase('emit'):
+            self.write_record(record)
+
+    def write_record(self, record) -> None:
+        if self.fmt == 'csv':
+            if self.csv_writer is None:
+                self.csv_writer = csv.writer(self.stream)
+                self.csv_writer.writerow(self.fields)
+            self.csv_writer.writerow([self.value(record.get(field), flat=True) for field in self.fields])
+        else:
+            line = json.dumps({field: self.value(record.get(field)) for field in self.fields}, default=str)
+            if self.fmt == 'json':
+                line = ('[\n' if self.count == 0 else ',\n') + line
+            else:
+                line += '\n'
+            self.stream.write(line)
+        self.count += 1
+
+    def close(self) -> None:
+        if self.fmt == 'json':
+            self.stream.write('[]\n' if self.count == 0 else '\n]\n')
+        self.stream.flush()
+
+
+# compiles a filter expression such as "status=running,rss>100M,name~^py" into
+# a list of predicates that are all checked in one pass over a snapshot
+# terms are separated by commas and all of them have to match
+class Process_Filter:
+    # operators are checked in this order so >= is not read as >
+    operators = ('>=', '<=', '!=', '~', '>', '<', '=')
+    # field -> dynamic snapshot fields it needs, static fields are always there
+    fields = {
+        'status': ('status',),
+        'rss': ('memory_info',),
+        'cpu': ('cpu_percent',),
+        'user': (),
+        'name': (),
+        'age': (),
+        'uss': ('memory_full_info',),
+        'pss': ('memory_full_info',),
+        'fds': ('num_fds',),
+        'threads': ('num_threads',),
+    }
+    # static snapshot fields each filter field needs, for callers that don't read them all
+    static_attrs = {'user': ('username',), 'age': ('create_time',), 'name': ('name',)}
+    headers = {
+        'status': 'STATUS',
+        'rss': 'MEMORY USAGE',
+        'cpu': 'CPU_PERCENT(%)',
+        'user': 'USER',
+        'name': 'NAME',
+        'age': 'AGE(s)',
+        'uss': 'USS',
+        'pss': 'PSS',
+        'fds': 'FDS',
+        'threads': 'THREADS',
+    }
+    # read by the detail sampler, so shown with how old they are
+    detail_fields = ('uss', 'pss', 'fds', 'threads')
+    size_units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    time_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+    def __init__(self, expression) -> None:
+        self.expression = expression
+        self.predicates = []
+        self.columns = []
+        dynamic_fields = set()
+        static_fields = set()
+        for term in expression.split(','):
+            term = term.strip()
+            if not term:
+                continue
+            field, op, value = self.split_term(term)
+            if field not in self.fields:
+                raise ValueError(f'unknown field {field}, use one of {", ".join(self.fields)}')
+            dynamic_fields.update(self.fields[field])
+            static_fields.update(self.static_attrs.get(field, ()))
+            if field not in self.columns and field != 'name':
+                self.columns.append(field)
+            self.predicates.append(self.compile_term(field, op, value))
+        if not self.predicates:
+            raise ValueError('empty filter expression')
+        # status is always read so the snapshot has something to refresh
+        self.dynamic_fields = tuple(sorted(dynamic_fields)) or ('status',)
+        self.static_fields = tuple(sorted(static_fields))
+
+    def split_term(self, term) -> tuple:
+        for op in self.operators:
+            field, found, value = term.partition(op)
+            if found:
+                return field.strip().lower(), op, value.strip()
+        raise ValueError(f'no operator in {term}')
+
+    @classmethod
+    def parse_number(cls, field, value) -> float:
+        units = cls.size_units if field in ('rss', 'uss', 'pss') else cls.time_units if field == 'age' else {}
+        scale = 1
+        if value and value[-1] in units:
+            scale = units[value[-1]]
+            value = value[:-1]
+        try:
+            return float(value) * scale
+        except ValueError:
+            raise ValueError(f'{field} needs a number, got {value}') from None
+
+    @staticmethod
+    def value(field, row):
+        # pull the value of a field out of a snapshot row, None when it could not be read
+        if field == 'rss':
+            return row['memory_info'].rss if row.get('memory_info') is not None else None
+        if field == 'cpu':
+            return row.get('cpu_percent')
+        if field == 'user':
+            return row.get('username')
+        if field == 'age':
+            return time.time() - row['create_time'] if row.get('create_time') is not None else None
+        if field in ('uss', 'pss'):
+            return getattr(row.get('memory_full_info'), field, None)
+        if field == 'fds':
+            return row.get('num_fds')
+        if field == 'threads':
+            return row.get('num_threads')
+        return row.get(field)
+
+    def compile_term(self, field, op, value):
+        if field in ('rss', 'cpu', 'age', 'uss', 'pss', 'fds', 'threads'):
+            number = self.parse_number(field, value)
+            compare = {
+                '>': lambda got: got > number,
+                '<': lambda got: got < number,
+                '>=': lambda got: got >= number,
+                '<=': lambda got: got <= number,
+                '=': lambda got: got == number,
+                '!=': lambda got: got != number,
+            }.get(op)
+        elif op == '~':
+            try:
+                pattern = re.compile(value)
+            except re.error as e:
+                raise ValueError(f'bad regex {value}: {e}') from None
+            compare = lambda got: pattern.search(got) is not None
+        else:
+            compare = {
+                '=': lambda got: got == value,
+                '!=': lambda got: got != value,
+            }.get(op)
+        if compare is None:
+            raise ValueError(f'operator {op} can not be used with {field}')
+
+        def predicate(row):
+            got = self.value(field, row)
+            # unreadable values never match
+            return got is not None and compare(got)
+        return predicate
+
+    def match(self, row) -> bool:
+        return all(predicate(row) for predicate in self.predicates)
+
+    def apply(self, rows):
+        # generator so callers can stream the matches
+        for row in rows:
+            if self.match(row):
+                yield row
+
+    @classmethod
+    def display(cls, field, row):
+        got = cls.value(field, row)
+        if got is None:
+            return 'N/A'
+        if field in ('rss', 'uss', 'pss'):
+            got = bytes2human(got)
+        elif field == 'age':
+            return int(got)
+        if field in cls.detail_fields and row.get('detail_time') is not None:
+            return Detail_Sampler.display(got, row)
+        return got
+
+
+# filter for the connection table, same comma separated style as Process_Filter
+# e.g "proto=tcp,state=ESTABLISHED,port=443,raddr=10.0.0.0/8"
+class Connection_Filter:
+    # create protocol map to make the protocol being returned by
+    # connection type and connect family to be readable
+    proto_map = {
+        (AF_INET, SOCK_STREAM): 'TCP',
+        (AF_INET, SOCK_DGRAM): 'UDP',
+        (AF_INET6, SOCK_STREAM): 'TCP6',
+        (AF_INET6, SOCK_DGRAM): 'UDP6'
+    }
+    # protocols psutil can narrow the kernel read down to
+    kinds = ('inet', 'inet4', 'inet6', 'tcp', 'tcp4', 'tcp6', 'udp', 'udp4', 'udp6', 'unix', 'all')
+    fields = ('proto', 'state', 'port', 'lport', 'rport', 'raddr')
+    # same fields as psutil.net_connections() rows, used when we have to ask each process
+    connection = namedtuple('connection', ['fd', 'family', 'type', 'laddr', 'raddr', 'status', 'pid'])
+
+    def __init__(self, expression) -> None:
+        self.expression = expression
+        self.kind = 'inet'
+        self.predicates = []
+        for term in expression.split(','):
+            term = term.strip()
+            if not term:
+                continue
+            field, found, value = term.partition('=')
+            field, value = field.strip().lower(), value.strip()
+            if not found or not value:
+                raise ValueError(f'{term} should look like field=value')
+            if field not in self.fields:
+                raise ValueError(f'unknown field {field}, use one of {", ".join(self.fields)}')
+            self.predicates.append(self.compile_term(field, value))
+
+    def compile_term(self, field, value):
+        if field == 'proto':
+            value = value.lower()
+            if value not in self.kinds:
+                raise ValueError(f'unknown protocol {value}, use one of {", ".join(self.kinds)}')
+            # let psutil only parse the tables we asked for
+            self.kind = value
+            return lambda connection: True
+        if field == 'state':
+            value = value.upper()
+            return lambda connection: connection.status == value
+        if field == 'raddr':
+            try:
+                network = ipaddress.ip_network(value, strict=False)
+            except ValueError as e:
+                raise ValueError(f'bad address range {value}: {e}') from None
+            return lambda connection: self.in_network(connection.raddr, network)
+        if not value.isdigit():
+            raise ValueError(f'{field} needs a port number, got {value}')
+        port = int(value)
+        if field == 'lport':
+            return lambda connection: self.port_of(connection.laddr) == port
+        if field == 'rport':
+            return lambda connection: self.port_of(connection.raddr) == port
+        return lambda connection: port in (self.port_of(connection.laddr), self.port_of(connection.raddr))
+
+    @staticmethod
+    def port_of(addr):
+        # unix sockets have a path instead of an (ip, port) pair
+        return getattr(addr, 'port', None)
+
+    @staticmethod
+    def in_network(addr, network) -> bool:
+        if not getattr(addr, 'ip', None):
+            return False
+        try:
+            return ipaddress.ip_address(addr.ip.split('%')[0]) in network
+        except ValueError:
+            return False
+
+    @classmethod
+    def protocol(cls, connection) -> str:
+        if connection.family == AF_UNIX:
+            return 'UNIX'
+        # anything we don't have a name for (raw sockets etc.) gets its enum names
+        return cls.proto_map.get((connection.family, connection.type),
+                                 f'{getattr(connection.family, "name", connection.family)}/'
+                                 f'{getattr(connection.type, "name", connection.type)}')
+
+    def match(self, connection) -> bool:
+        return all(predicate(connection) for predicate in self.predicates)
+
+
+# sums cpu, rss, threads, fds and connections per process tree, user or cgroup from one snapshot
+# every row is visited once: tree roots are memoized along each parent chain and cgroup paths
+# are read once per pid, so building a rollup is linear in the number of processes
+# root drills down: a pid for trees, a user name, or a cgroup path
+class Process_Rollup:
+    modes = ('tree', 'user', 'cgroup')
+    dynamic_fields = ('memory_info', 'status', 'cpu_percent', 'num_threads') + (
+        ('num_fds',) if hasattr(psutil.Process, 'num_fds') else ())
+    fields = ['group', 'processes', 'cpu', 'rss', 'threads', 'fds', 'connections']
+    headers = {'tree': 'TREE', 'user': 'USER', 'cgroup': 'CGROUP'}
+    # --Sort -> (group key, biggest first), pid orders trees by their root pid and the rest by name
+    sorts = {
+        'pid': (lambda group: Process_Rollup.group_order(group), False),
+        'name': (lambda group: str(group['group']).lower(), False),
+        'memory': (lambda group: group['rss'], True),
+        'cpu': (lambda group: group['cpu'], True),
+    }
+
+    def __init__(self) -> None:
+        self.cgroups = {}  # (pid, create_time) -> cgroup path
+
+    @staticmethod
+    def group_order(group) -> tuple:
+        # tree groups are "pid name", numbers first in numeric order
+        value = str(group['group'])
+        head = value.split(' ', 1)[0]
+        return (0, int(head), '') if head.isdigit() else (1, 0, value.lower())
+
+    def cgroup(self, row) -> str:
+        key = (row['pid'], row.get('create_time'))
+        path = self.cgroups.get(key)
+        if path is None:
+            path = 'N/A'
+            try:
+                with open(f'/proc/{row["pid"]}/cgroup') as cgroup:
+                    lines = cgroup.read().splitlines()
+                # cgroup v2 is the single "0::" line, with v1 the systemd hierarchy names the service
+                paths = dict(line.split(':', 2)[1:] for line in lines if line.count(':') >= 2)
+                path = paths.get('', paths.get('name=systemd', next(iter(paths.values()), 'N/A')))
+            except OSError:
+                pass
+            self.cgroups[key] = path
+        return path
+
+    def forget(self, pids) -> None:
+        if pids:
+            self.cgroups = {key: path for key, path in self.cgroups.items() if key[0] not in pids}
+
+    @staticmethod
+    def connection_counts() -> dict:
+        # one system wide call, counted per pid
+        counts = {}
+        try:
+            for connection in psutil.net_connections(kind='inet'):
+                if connection.pid is not None:
+                    counts[connection.pid] = counts.get(connection.pid, 0) + 1
+        except psutil.AccessDenied as e:
+            logging.error(f'could not read the connection table for the rollup {e}')
+            return None
+        return counts
+
+    @staticmethod
+    def tree_groups(rows, root) -> dict:
+        # pid -> the child of root whose subtree it is in, root itself for root,
+        # the topmost ancestor for processes outside of root when root is the default
+        parents = {row['pid']: row.get('ppid') for row in rows}
+        groups = {root: root} if root in parents else {}
+        for pid in parents:
+            path = []
+            visited = set()
+            current = pid
+            while current not in groups:
+                parent = parents.get(current)
+                visited.add(current)
+                if parent == root:
+                    groups[current] = current
+                elif parent is None or parent not in parents or parent in visited:
+                    # a parent seen earlier on this walk is a cycle from a stale ppid and a reused pid,
+                    # the walk stops there as if it had reached the top
+                    groups[current] = current if root == 1 else None
+                else:
+                    path.append(current)
+                    current = parent
+            for node in path:
+                groups[node] = groups[current]
+        return groups
+
+    def group_key(self, mode, root, row, tree):
+        if mode == 'tree':
+            return tree.get(row['pid'])
+        if mode == 'user':
+            if root is None:
+                return row.get('username') or 'N/A'
+            return row.get('name') if row.get('username') == root else None
+        path = self.cgroup(row)
+        prefix = (root or '/').rstrip('/')
+        if path == (prefix or '/'):
+            return path
+        if not path.startswith(prefix + '/'):
+            return None
+        # one level below the root
+        return prefix + '/' + path[len(prefix) + 1:].split('/')[0]
+
+    def build(self, rows, mode, root=None, connections=None, process_filter=None) -> list:
+        # the tree is built from every row, process_filter only picks which rows are summed
+        if mode == 'tree':
+            root = int(root) if root is not None else 1
+            tree = self.tree_groups(rows, root)
+            names = {row['pid']: row.get('name') for row in rows}
+        else:
+            tree = names = None
+        groups = {}
+        for row in rows:
+            if process_filter is not None and not process_filter.match(row):
+                continue
+            key = self.group_key(mode, root, row, tree)
+            if key is None:
+                continue
+            total = groups.get(key)
+            if total is None:
+                label = f'{key} {names.get(key) or ""}'.strip() if mode == 'tree' else key
+                # rows from a collector don't carry threads or fds
+                total = groups[key] = {'group': label, 'processes': 0, 'cpu': 0.0, 'rss': 0,
+                                       'threads': 0 if 'num_threads' in row else None,
+                                       'fds': 0 if 'num_fds' in row else None,
+                                       'connections': 0 if connections is not None else None}
+            total['processes'] += 1
+            total['cpu'] += row.get('cpu_percent') or 0.0
+            if row.get('memory_info') is not None:
+                total['rss'] += row['memory_info'].rss
+            if total['threads'] is not None:
+                total['threads'] += row.get('num_threads') or 0
+            if total['fds'] is not None:
+                total['fds'] += row.get('num_fds') or 0
+            if connections is not None:
+                total['connections'] += connections.get(row['pid'], 0)
+        for total in groups.values():
+            total['cpu'] = round(total['cpu'], 1)
+        return list(groups.values())
+
+
+# partitions and their usage without letting one hung mount (nfs, fuse ...) block everything
+# the partition list is kept until the mount table changes: on linux the kernel flags
+# /proc/self/mounts through poll() when something is mounted or unmounted, elsewhere it is
+# read again every ttl seconds. every mountpoint is probed on its own daemon thread and
+# whatever hasn't answered within the timeout is reported as timed out
+class Disk_Probe:
+    mounts_file = '/proc/self/mounts'
+    ttl = 30.0
+
+    def __init__(self, timeout=2.0) -> None:
+        self.timeout = timeout
+        self.cached = None
+        self.read_at = 0.0
+        self.pending = {}  # mountpoint -> probe thread that hasn't come back yet
+        # opened on the first partitions() call, so commands that never look at disks don't hold it
+        self.mounts = None
+        self.poller = None
+
+    def watch_mounts(self) -> None:
+        if hasattr(select, 'poll') and os.path.exists(self.mounts_file):
+            self.mounts = open(self.mounts_file)
+            self.poller = select.poll()
+            self.poller.register(self.mounts, select.POLLPRI | select.POLLERR)
+
+    def close(self) -> None:
+        if self.mounts is not None:
+            self.mounts.close()
+            self.mounts = None
+            self.poller = None
+
+    def mounts_changed(self) -> bool:
+        if self.poller is None:
+            return time.monotonic() - self.read_at > self.ttl
+        if not self.poller.poll(0):
+            return False
+        # reading the file again clears the flag
+        self.mounts.seek(0)
+        self.mounts.read()
+        return True
+
+    def partitions(self) -> list:
+        if self.cached is None:
+            self.watch_mounts()
+        if self.cached is None or self.mounts_changed():
+            self.cached = psutil.disk_partitions(all=False)
+            self.read_at = time.monotonic()
+        return self.cached
+
+    def usage_all(self) -> list:
+        # (partition, usage or None, error or None) for every partition, all probed at once
+        results = {}
+
+        def probe(mountpoint):
+            try:
+                results[mountpoint] = (psutil.disk_usage(mountpoint), None)
+            except OSError as e:
+                results[mountpoint] = (None, str(e))
+
+        threads = {}
+        for part in self.partitions():
+            stuck = self.pending.get(part.mountpoint)
+            if stuck is not None and stuck.is_alive():
+                # still hung from an earlier call, don't pile up threads behind it
+                continue
+            thread = threading.Thread(target=probe, args=(part.mountpoint,), daemon=True)
+            thread.start()
+            threads[part.mountpoint] = thread
+        deadline = time.monotonic() + self.timeout
+        for mountpoint, thread in threads.items():
+            thread.join(max(0.0, deadline - time.monotonic()))
+            if thread.is_alive():
+                self.pending[mountpoint] = thread
+            else:
+                self.pending.pop(mountpoint, None)
+        usages = []
+        for part in self.partitions():
+            usage, error = results.get(part.mountpoint, (None, f'timed out after {self.timeout}s'))
+            if error is not None:
+                logging.error(f'could not read disk usage of {part.mountpoint} {error}')
+            usages.append((part, usage, error))
+        return usages
+
+
+# read/write throughput, iops and busy time per disk and the processes doing the most i/o,
+# worked out from two counter readings interval seconds apart
+class Io_Rates:
+    def __init__(self, snapshot, interval=1.0) -> None:
+        self.snapshot = snapshot
+        self.interval = interval
+
+    @staticmethod
+    def process_counters(rows) -> dict:
+        return {row['pid']: row['io_counters'] for row in rows if row.get('io_counters') is not None}
+
+    def sample(self) -> tuple:
+        # (device rows, process rows sorted by total bytes a second)
+        disks_before = psutil.disk_io_counters(perdisk=True) or {}
+        processes_before = self.process_counters(self.snapshot.refresh(dynamic_fields=('io_counters',)))
+        started = time.monotonic()
+        time.sleep(self.interval)
+        disks_after = psutil.disk_io_counters(perdisk=True) or {}
+        rows = self.snapshot.refresh(dynamic_fields=('io_counters',))
+        elapsed = time.monotonic() - started
+        devices = []
+        for name, after in sorted(disks_after.items()):
+            before = disks_before.get(name)
+            # devices that have never been used (unattached loop devices ...) are left out
+            if before is None or after.read_count + after.write_count == 0:
+                continue
+            busy = None
+            if hasattr(after, 'busy_time'):
+                # busy_time is in milliseconds
+                busy = min(100.0, (after.busy_time - before.busy_time) / (elapsed * 10))
+            devices.append({
+                'name': name,
+                'read_bytes': (after.read_bytes - before.read_bytes) / elapsed,
+                'write_bytes': (after.write_bytes - before.write_bytes) / elapsed,
+                'read_iops': (after.read_count - before.read_count) / elapsed,
+                'write_iops': (after.write_count - before.write_count) / elapsed,
+                'busy_percent': busy,
+            })
+        processes = []
+        for row in rows:
+            before = processes_before.get(row['pid'])
+            after = row.get('io_counters')
+            # only processes that did some i/o in the interval
+            if before is None or after is None or after == before:
+                continue
+            processes.append({
+                'pid': row['pid'],
+                'name': row.get('name'),
+                'read_bytes': (after.read_bytes - before.read_bytes) / elapsed,
+                'write_bytes': (after.write_bytes - before.write_bytes) / elapsed,
+                'read_iops': (after.read_count - before.read_count) / elapsed,
+                'write_iops': (after.write_count - before.write_count) / elapsed,
+            })
+        processes.sort(key=lambda process: (process['read_bytes'] + process['write_bytes'],
+                                            process['read_iops'] + process['write_iops']), reverse=True)
+        return devices, processes
+
+
+# preallocated array backed ring buffer for one metric series
+# there is only ever one writer (the sampling thread), the writer fills the slot
+# before bumping count and readers check count again after copying, so no lock is needed
+class Ring_Buffer:
+    def __init__(self, capacity, typecode='d') -> None:
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array(typecode, [0]) * capacity
+        self.count = 0  # total number of samples ever written
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, value) -> None:
+        index = self.count % self.capacity
+        self.times[index] = timestamp
+        self.values[index] = value
+        # publish the sample last
+        self.count += 1
+
+    def history(self, n=None) -> tuple:
+        # returns (times, values) oldest first, at most the last n samples
+        count = self.count
+        size = min(count, self.capacity, n or self.capacity)
+        start = (count - size) % self.capacity
+        if start + size <= self.capacity:
+            times = self.times[start:start + size].tolist()
+            values = self.values[start:start + size].tolist()
+        else:
+            wrap = start + size - self.capacity
+            times = self.times[start:].tolist() + self.times[:wrap].tolist()
+            values = self.values[start:].tolist() + self.values[:wrap].tolist()
+        # anything the writer overwrote while we were copying is dropped
+        overwritten = self.count - count
+        if overwritten:
+            times, values = times[overwritten:], values[overwritten:]
+        return times, values
+
+    def latest(self):
+        count = self.count
+        if not count:
+            return None
+        index = (count - 1) % self.capacity
+        return self.times[index], self.values[index]
+
+
+# one ring buffer per metric series, e.g "system.cpu", "system.cpu.0",
+# "system.memory", "system.swap", "process.<pid>.rss", "process.<pid>.cpu"
+# plus the rows of the latest process snapshot so readers don't rescan /proc
+class Metrics_Store:
+    def __init__(self, capacity=3600, process_capacity=120) -> None:
+        self.capacity = capacity
+        # per process series are shorter and single precision since there can be thousands of them
+        self.process_capacity = process_capacity
+        self.series = {}
+        self.rows = []
+        self.rows_time = 0.0
+
+    def record(self, name, timestamp, value) -> None:
+        buffer = self.series.get(name)
+        if buffer is None:
+            if name.startswith('process.'):
+                buffer = Ring_Buffer(self.process_capacity, 'f')
+            else:
+                buffer = Ring_Buffer(self.capacity)
+            self.series[name] = buffer
+        buffer.append(timestamp, value)
+
+    def history(self, name, n=None) -> tuple:
+        buffer = self.series.get(name)
+        if buffer is None:
+            return [], []
+        return buffer.history(n)
+
+    def values(self, name, n=None) -> list:
+        return self.history(name, n)[1]
+
+    def latest(self, name):
+        buffer = self.series.get(name)
+        return buffer.latest() if buffer is not None else None
+
+    def drop_process(self, pid) -> None:
+        for metric in ('rss', 'cpu'):
+            self.series.pop(f'process.{pid}.{metric}', None)
+
+    def set_rows(self, rows, timestamp) -> None:
+        # swapping the reference is atomic so readers always see one whole tick
+        self.rows = rows
+        self.rows_time = timestamp
+
+    def get_rows(self) -> list:
+        return self.rows
+
+
+# one alert condition such as "rss>500M;for=30s;clear=400M" checked against every sample
+# process rules (rss, cpu) keep a state per pid, disk keeps one per mountpoint and the
+# system rules (memory, swap, zombies, processes) one in total
+# every state only holds a running sum over its window and when the breach started,
+# so each sample costs the same no matter how long the window is
+class Alert_Rule:
+    # metric -> what it is measured on
+    metrics = {
+        'rss': 'process',
+        'cpu': 'process',
+        'memory': 'system',
+        'swap': 'system',
+        'zombies': 'system',
+        'processes': 'system',
+        'disk': 'disk',
+    }
+    operators = ('>=', '<=', '>', '<')
+    options = ('for', 'avg', 'clear', 'rate', 'match', 'name')
+    # without clear= an alert only resolves once the value is this far back from the threshold
+    hysteresis = 0.1
+
+    def __init__(self, spec) -> None:
+        self.spec = spec
+        terms = [term.strip() for term in spec.split(';') if term.strip()]
+        if not terms:
+            raise ValueError('empty alert rule')
+        self.metric, self.op, value = self.split_condition(terms[0])
+        self.scope = self.metrics[self.metric]
+        self.threshold = self.parse_value(value)
+        self.sustain = 0.0
+        self.window = 0.0
+        self.clear = None
+        self.rate = 10
+        self.process_filter = None
+        self.name = terms[0]
+        for term in terms[1:]:
+            key, sep, value = term.partition('=')
+            key = key.strip().lower()
+            if not sep or key not in self.options:
+                raise ValueError(f'{term} should look like option=value with option one of {", ".join(self.options)}')
+            value = value.strip()
+            if key == 'for':
+                self.sustain = Task_Scheduler.parse_duration(value)
+            elif key == 'avg':
+                self.window = Task_Scheduler.parse_duration(value)
+            elif key == 'clear':
+                self.clear = self.parse_value(value)
+            elif key == 'rate':
+                # alerts per minute, e.g 5 or 5/m
+                try:
+                    self.rate = int(value.split('/')[0])
+                except ValueError:
+                    raise ValueError(f'rate needs a whole number of alerts a minute, got {value}') from None
+                if self.rate < 1:
+                    raise ValueError(f'rate has to be at least 1 alert a minute, got {value}')
+            elif key == 'match':
+                if self.scope != 'process':
+                    raise ValueError(f'match= only works with process rules, not {self.metric}')
+                self.process_filter = Process_Filter(value)
+            else:
+                self.name = value
+        if self.clear is None:
+            if self.threshold == 0:
+                # the band is a share of the threshold, so there would be none
+                raise ValueError(f'{terms[0]} has a threshold of 0, give it a clear= value to resolve at')
+            band = abs(self.threshold) * self.hysteresis
+            self.clear = self.threshold - band if self.op[0] == '>' else self.threshold + band
+        self.breached = {
+            '>': lambda value: value > self.threshold,
+            '>=': lambda value: value >= self.threshold,
+            '<': lambda value: value < self.threshold,
+            '<=': lambda value: value <= self.threshold,
+        }[self.op]
+        if self.op[0] == '>':
+            self.cleared = lambda value: not self.breached(value) and value <= self.clear
+        else:
+            self.cleared = lambda value: not self.breached(value) and value >= self.clear
+        # key -> [window of (time, value), running sum, breach start, firing, notified]
+        self.states = {}
+        self.tokens = float(self.rate)
+        self.last_refill = time.monotonic()
+        self.suppressed = 0
+
+    def split_condition(self, term) -> tuple:
+        for op in self.operators:
+            metric, found, value = term.partition(op)
+            if found:
+                metric = metric.strip().lower()
+                if metric not in self.metrics:
+                    raise ValueError(f'unknown metric {metric}, use one of {", ".join(self.metrics)}')
+                return metric, op, value.strip()
+        raise ValueError(f'no operator in {term}, use one of {", ".join(self.operators)}')
+
+    def parse_value(self, value) -> float:
+        if self.metric == 'rss':
+            return Process_Filter.parse_number('rss', value)
+        try:
+            return float(value.rstrip('%'))
+        except ValueError:
+            raise ValueError(f'{self.metric} needs a number, got {value}') from None
+
+    def display(self, value) -> str:
+        if self.metric == 'rss':
+            return bytes2human(value)
+        if self.metric in ('zombies', 'processes'):
+            return str(int(value))
+        return f'{value:.1f}%'
+
+    def observe(self, key, now, value):
+        # returns 'firing' or 'resolved' when the state of this key changes, otherwise None
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = [deque(), 0.0, None, False, False]
+        if self.window:
+            window = state[0]
+            window.append((now, value))
+            state[1] += value
+            while window[0][0] < now - self.window:
+                state[1] -= window.popleft()[1]
+            value = state[1] / len(window)
+        if not state[3]:
+            if not self.breached(value):
+                state[2] = None
+                return None, value
+            if state[2] is None:
+                state[2] = now
+            if now - state[2] < self.sustain:
+                return None, value
+            state[3] = True
+            state[4] = self.allow()
+            return ('firing' if state[4] else None), value
+        if not self.cleared(value):
+            return None, value
+        notified = state[4]
+        state[2], state[3], state[4] = None, False, False
+        # a recovery is only reported for an alert that was reported
+        return ('resolved' if notified else None), value
+
+    def forget(self, key):
+        # the process went away, report it as resolved if it was firing
+        state = self.states.pop(key, None)
+        return state is not None and state[3] and state[4]
+
+    def allow(self) -> bool:
+        # token bucket, rate alerts a minute per rule
+        now = time.monotonic()
+        self.tokens = min(float(self.rate), self.tokens + (now - self.last_refill) * self.rate / 60)
+        self.last_refill = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.suppressed += 1
+        return False
+
+
+# evaluates every alert rule against each sample from the Sampling_Daemon and sends
+# state changes (firing, resolved) to stdout, a file (one json object per line) or a command
+# alerts are only sent when a state changes, so a breach that lasts an hour is two lines, not thousands
+class Alert_Engine:
+    def __init__(self, rules, outputs=None, probe_timeout=2.0) -> None:
+        self.rules = [rule if isinstance(rule, Alert_Rule) else Alert_Rule(rule) for rule in rules]
+        self.outputs = []
+        for output in outputs or ['stdout']:
+            kind, _, target = output.partition(':')
+            if kind not in ('stdout', 'file', 'command') or (kind != 'stdout' and not target):
+                raise ValueError(f'unknown alert output {output}, use stdout, file:<path> or command:<command>')
+            self.outputs.append((kind, target))
+        self.files = {}
+        self.children = []
+        self.sent = 0
+        self.process_rules = [rule for rule in self.rules if rule.scope == 'process']
+        self.needs_disk = any(rule.scope == 'disk' for rule in self.rules)
+        self.disk_probe = Disk_Probe(probe_timeout) if self.needs_disk else None
+
+    def system_values(self, memory, swap, rows) -> dict:
+        values = {'memory': memory.percent, 'swap': swap.percent, 'processes': len(rows)}
+        if any(rule.metric == 'zombies' for rule in self.rules):
+            values['zombies'] = sum(1 for row in rows if row.get('status') == psutil.STATUS_ZOMBIE)
+        return values
+
+    def disk_values(self) -> dict:
+        return {part.mountpoint: usage.percent for part, usage, _ in self.disk_probe.usage_all() if usage is not None}
+
+    def evaluate(self, now, rows, memory, swap, exited_pids=()) -> None:
+        system = self.system_values(memory, swap, rows)
+        disks = self.disk_values() if self.needs_disk else {}
+        for rule in self.rules:
+            if rule.scope == 'system':
+                self.check(rule, 'system', now, system[rule.metric])
+            elif rule.scope == 'disk':
+                for mountpoint, percent in disks.items():
+                    self.check(rule, mountpoint, now, percent)
+        for rule in self.process_rules:
+            for pid in exited_pids:
+                if rule.forget(pid):
+                    self.send(rule, 'resolved', f'pid {pid}', None, now, 'process exited')
+            for row in rows:
+                if rule.process_filter is not None and not rule.process_filter.match(row):
+                    continue
+                value = Process_Filter.value(rule.metric, row)
+                if value is not None:
+                    self.check(rule, row['pid'], now, value, row)
+
+    def check(self, rule, key, now, value, row=None) -> None:
+        change, value = rule.observe(key, now, value)
+        if change is not None:
+            subject = f'pid {key} ({row["name"]})' if row is not None else key
+            self.send(rule, change, subject, value, now)
+
+    def send(self, rule, state, subject, value, now, note='') -> None:
+        alert = {
+            'time': now,
+            'rule': rule.name,
+            'state': state,
+            'subject': subject,
+            'value': value,
+            'threshold': rule.threshold,
+            'suppressed': rule.suppressed,
+        }
+        message = (f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))} {state.upper()} {rule.name} '
+                   f'{subject}' + (f' value {rule.display(value)}' if value is not None else '')
+                   + (f' {note}' if note else '')
+                   + (f' ({rule.suppressed} suppressed by rate limit)' if rule.suppressed else ''))
+        alert['message'] = message
+        rule.suppressed = 0
+        self.sent += 1
+        logging.info(f'alert {message}')
+        for kind, target in self.outputs:
+            try:
+                if kind == 'stdout':
+                    print(message, flush=True)
+                elif kind == 'file':
+                    handle = self.files.get(target)
+                    if handle is None:
+                        handle = self.files[target] = open(target, 'a')
+                    handle.write(json.dumps(alert) + '\n')
+                    handle.flush()
+                else:
+                    # the alert goes in the environment and nothing waits on the command
+                    env = dict(os.environ, ALERT_RULE=rule.name, ALERT_STATE=state, ALERT_SUBJECT=str(subject),
+                               ALERT_VALUE='' if value is None else str(value), ALERT_MESSAGE=message)
+                    self.children.append(subprocess.Popen(shlex.split(target), env=env))
+            except (OSError, ValueError) as e:
+                logging.error(f'could not send alert to {kind} {target}: {e}')
+        self.children = [child for child in self.children if child.poll() is None]
+
+    def close(self) -> None:
+        for handle in self.files.values():
+            handle.close()
+        self.files = {}
+        if self.disk_probe is not None:
+            self.disk_probe.close()
+
+
+# collects system and per process metrics at a fixed cadence into a Metrics_Store
+# so the listing, filters, graph and exports can share one collection cost
+class Sampling_Daemon(threading.Thread):
+    def __init__(self, store, snapshot=None, interval=1.0, collect_processes=True, archive=None,
+                 alerts=None, recorder=None, details=None) -> None:
+        super().__init__(daemon=True)
+        self.store = store
+        self.archive = archive
+        self.alerts = alerts
+        self.recorder = recorder
+        self.details = details
+        self.snapshot = snapshot if snapshot is not None else Process_Snapshot()
+        self.interval = interval
+        self.collect_processes = collect_processes
+        self.ticks = 0
+        self.stop_event = threading.Event()
+        self.first_tick = threading.Event()
+
+    def tick(self) -> None:
+        now = time.time()
+        # non blocking, cpu_percent compares against the previous call
+        per_core = psutil.cpu_percent(percpu=True)
+        self.store.record('system.cpu', now, sum(per_core) / len(per_core))
+        for core, value in enumerate(per_core):
+            self.store.record(f'system.cpu.{core}', now, value)
+        memory = psutil.virtual_memory()
+        swap_memory = psutil.swap_memory()
+        swap = swap_memory.used
+        self.store.record('system.memory', now, memory.used)
+        self.store.record('system.memory.percent', now, memory.percent)
+        self.store.record('system.swap', now, swap)
+        rows = []
+
+        if self.collect_processes:
+            rows = self.snapshot.refresh()
+            if self.details is not None:
+                self.details.sample(rows, now)
+            for pid in self.snapshot.exited_pids:
+                self.store.drop_process(pid)
+            for row in rows:
+                if row['memory_info'] is not None:
+                    self.store.record(f'process.{row["pid"]}.rss', now, row['memory_info'].rss)
+                if row['cpu_percent'] is not None:
+                    self.store.record(f'process.{row["pid"]}.cpu', now, row['cpu_percent'])
+            # copies, the snapshot keeps updating its own rows in place
+            self.store.set_rows([dict(row) for row in rows], now)
+        if self.archive is not None:
+            self.archive.append_tick(now, {'system.cpu': sum(per_core) / len(per_core),
+                                           'system.memory': memory.used, 'system.swap': swap}, rows)
+        if self.alerts is not None:
+            self.alerts.evaluate(now, rows, memory, swap_memory, self.snapshot.exited_pids)
+        if self.recorder is not None:
+            self.recorder.append(now, {'cpu': per_core, 'memory': memory.used, 'memory_percent': memory.percent,
+                                       'swap': swap}, rows)
+        self.ticks += 1
+        self.first_tick.set()
+
+    def run(self) -> None:
+        # the first cpu_percent call only primes the counters
+        psutil.cpu_percent(percpu=True)
+        next_tick = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                self.tick()
+            except (psutil.Error, OSError) as e:
+                # a full disk or a permission problem under the archive or the recording can clear up,
+                # so it costs this tick and the next one tries again
+                logging.error(f'sampling tick failed {e}')
+                # start_sampling waits on the first tick, a failed one still counts
+                self.first_tick.set()
+            except Exception:
+                # anything else would fail every tick, stopping leaves is_alive() False so the
+                # commands go back to reading processes themselves instead of serving a stale store
+                logging.exception('sampling tick failed, sampling was stopped')
+                print('sampling failed and was stopped, see the log', file=sys.stderr)
+                self.first_tick.set()
+                break
+            # keep a fixed cadence no matter how long the tick took,
+            # slower while the detail sampler says the monitor is over its cpu cap
+            next_tick += self.interval * (self.details.scale if self.details is not None else 1.0)
+            self.stop_event.wait(max(0.0, next_tick - time.monotonic()))
+        # the archive and alert files are only ever written from this thread so close them here too
+        if self.archive is not None:
+            self.archive.close()
+        if self.alerts is not None:
+            self.alerts.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+
+# append only on disk storage for sampled metrics
+# every tier (raw, 1m, 1h) keeps one file of fixed size binary records per utc day,
+# records are written in time order so a range query is a binary search over an mmap
+# raw keeps the system every tick but processes only as process_every second means, which is what
+# makes up most of the volume with thousands of pids
+# the open 1m/1h buckets are checkpointed to pending.json every checkpoint_every seconds so a crash
+# loses at most that much instead of the whole hour
+# process names go to names.tsv whenever a pid shows up or changes name
+class Metrics_Archive:
+    # time, pid (0 for the system), metric code, value as an integer (bytes, or cpu percent times scale)
+    record = struct.Struct('<dIBQ')
+    metrics = {'system.cpu': 0, 'system.memory': 1, 'system.swap': 2, 'process.rss': 3, 'process.cpu': 4}
+    metric_names = {code: name for name, code in metrics.items()}
+    # cpu keeps two decimals
+    scales = {0: 100, 4: 100}
+    # seconds per bucket, raw is whatever the sampling interval is
+    resolutions = {'raw': 0, '1m': 60, '1h': 3600}
+    # days each tier is kept for
+    default_retention = {'raw': 1, '1m': 14, '1h': 365}
+    process_every = 10
+    checkpoint_every = 60
+    # segments written with the float32 record were "yyyymmdd.bin", these can't be read as the new one
+    segment_suffix = '.v2.bin'
+
+    def __init__(self, directory=None, retention=None) -> None:
+        self.directory = directory or metrics_dir
+        self.retention = dict(self.default_retention)
+        self.retention.update(retention or {})
+        self.names_path = os.path.join(self.directory, 'names.tsv')
+        self.pending_path = os.path.join(self.directory, 'pending.json')
+        self.files = {}  # tier -> (day, open file)
+        # tier -> [bucket start, {(pid, code): [sum, count]}, last sample time]
+        # 'process' is the raw process bucket, written to the raw tier
+        self.buckets = {}
+        self.known_names = {}  # pid -> name already written to names.tsv
+        self.checkpointed = None
+
+    @staticmethod
+    def day_of(timestamp) -> str:
+        return time.strftime('%Y%m%d', time.gmtime(timestamp))
+
+    def segment_path(self, tier, day) -> str:
+        return os.path.join(self.directory, tier, f'{day}{self.segment_suffix}')
+
+    def segment(self, tier, timestamp):
+        # open the file for the day of this timestamp, rolling over at midnight utc
+        day = self.day_of(timestamp)
+        current = self.files.get(tier)
+        if current is not None and current[0] == day:
+            return current[1]
+        if current is not None:
+            current[1].close()
+        os.makedirs(os.path.join(self.directory, tier), exist_ok=True)
+        handle = open(self.segment_path(tier, day), 'ab')
+        self.files[tier] = (day, handle)
+        # a new day is a good time to drop what is past its retention
+        self.enforce_retention(timestamp)
+        return handle
+
+    def write(self, tier, records) -> None:
+        if not records:
+            return
+        handle = self.segment(tier, records[0][0])
+        handle.write(b''.join(self.record.pack(when, pid, code, round(value * self.scales.get(code, 1)))
+                              for when, pid, code, value in records))
+        handle.flush()
+
+    def write_names(self, timestamp, rows) -> None:
+        lines = []
+        for row in rows:
+            if self.known_names.get(row['pid']) != row['name']:
+                self.known_names[row['pid']] = row['name']
+                lines.append(f'{timestamp}\t{row["pid"]}\t{row["name"]}\n')
+        if lines:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.names_path, 'a') as names:
+                names.writelines(lines)
+
+    def append_tick(self, timestamp, system, rows) -> None:
+        # system is {'system.cpu': .., 'system.memory': .., 'system.swap': ..}
+        if self.checkpointed is None:
+            self.restore(timestamp)
+        records = [(timestamp, 0, self.metrics[name], value) for name, value in system.items()]
+        processes = []
+        for row in rows:
+            if row.get('memory_info') is not None:
+                processes.append((timestamp, row['pid'], self.metrics['process.rss'], row['memory_info'].rss))
+            if row.get('cpu_percent') is not None:
+                processes.append((timestamp, row['pid'], self.metrics['process.cpu'], row['cpu_percent']))
+        self.write_names(timestamp, rows)
+        # a closing process bucket is stamped with its last tick, so raw stays in time order
+        self.downsample('process', self.process_every, timestamp, processes)
+        self.write('raw', records)
+        for tier in ('1m', '1h'):
+            self.downsample(tier, self.resolutions[tier], timestamp, records + processes)
+        if timestamp - self.checkpointed >= self.checkpoint_every:
+            self.checkpoint(timestamp)
+
+    def downsample(self, tier, resolution, timestamp, records) -> None:
+        # keep a running sum per series for the current bucket and write the means once it closes
+        start = int(timestamp // resolution) * resolution
+        current = self.buckets.get(tier)
+        if current is not None and current[0] != start:
+            self.flush_bucket(tier)
+            current = None
+        if current is None:
+            current = [start, {}, timestamp]
+            self.buckets[tier] = current
+        current[2] = timestamp
+        sums = current[1]
+        for _, pid, code, value in records:
+            total = sums.get((pid, code))
+            if total is None:
+                sums[(pid, code)] = [value, 1]
+            else:
+                total[0] += value
+                total[1] += 1
+
+    def flush_bucket(self, tier) -> None:
+        current = self.buckets.pop(tier, None)
+        if current is None:
+            return
+        start, sums, last = current
+        if tier == 'process':
+            tier, start = 'raw', last
+        self.write(tier, [(start, pid, code, total / count) for (pid, code), (total, count) in sums.items()])
+
+    def checkpoint(self, timestamp) -> None:
+        # the open buckets as they are now, replaced atomically
+        state = {tier: [start, [[pid, code, total, count] for (pid, code), (total, count) in sums.items()], last]
+                 for tier, (start, sums, last) in self.buckets.items()}
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f'{self.pending_path}.tmp', 'w') as pending:
+            json.dump(state, pending)
+        os.replace(f'{self.pending_path}.tmp', self.pending_path)
+        self.checkpointed = timestamp
+
+    def restore(self, timestamp) -> None:
+        # picks up the buckets a run that didn't close cleanly left behind
+        self.checkpointed = timestamp
+        try:
+            with open(self.pending_path) as pending:
+                state = json.load(pending)
+        except (OSError, ValueError):
+            return
+        for tier, (start, sums, last) in state.items():
+            self.buckets[tier] = [start, {(pid, code): [total, count] for pid, code, total, count in sums}, last]
+        logging.info(f'restored {len(state)} unfinished archive buckets')
+
+    def close(self) -> None:
+        for tier in list(self.buckets):
+            self.flush_bucket(tier)
+        for _, handle in self.files.values():
+            handle.close()
+        self.files = {}
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.pending_path)
+
+    def enforce_retention(self, now) -> None:
+        for tier, days in self.retention.items():
+            oldest = self.day_of(now - days * 86400)
+            tier_dir = os.path.join(self.directory, tier)
+            if not os.path.isdir(tier_dir):
+                continue
+            for segment in os.listdir(tier_dir):
+                # file names start with yyyymmdd so they sort like dates
+                if segment.endswith('.bin') and segment[:8] < oldest:
+                    os.remove(os.path.join(tier_dir, segment))
+                    logging.info(f'removed {tier} segment {segment} past its retention of {days} days')
+        self.trim_names(now - max(self.retention.values()) * 86400)
+
+    def trim_names(self, oldest) -> None:
+        if not os.path.exists(self.names_path):
+            return
+        with open(self.names_path) as names:
+            lines = names.readlines()
+        # always keep the newest name of each pid so current processes stay resolvable
+        newest = {}
+        for line in lines:
+            newest[line.split('\t', 2)[1]] = line
+        keep = [line for line in lines if float(line.split('\t', 1)[0]) >= oldest or newest[line.split('\t', 2)[1]] is line]
+        if len(keep) != len(lines):
+            with open(self.names_path, 'w') as names:
+                names.writelines(keep)
+
+    def query(self, tier, start, end):
+        # yields (time, pid, metric code, value) for every record in [start, end]
+        size = self.record.size
+        day = start - start % 86400
+        while day <= end:
+            path = self.segment_path(tier, self.day_of(day))
+            day += 86400
+            if not os.path.exists(path) or os.path.getsize(path) < size:
+                continue
+            with open(path, 'rb') as segment, mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                count = len(view) // size
+                # binary search for the first record at or after start
+                low, high = 0, count
+                while low < high:
+                    middle = (low + high) // 2
+                    if self.record.unpack_from(view, middle * size)[0] < start:
+                        low = middle + 1
+                    else:
+                        high = middle
+                for index in range(low, count):
+                    when, pid, code, value = self.record.unpack_from(view, index * size)
+                    if when > end:
+                        break
+                    yield when, pid, code, value / self.scales.get(code, 1)
+
+    def names_at(self, timestamp) -> dict:
+        # the name each pid had at the given time
+        names = {}
+        if not os.path.exists(self.names_path):
+            return names
+        with open(self.names_path) as handle:
+            for line in handle:
+                when, pid, name = line.rstrip('\n').split('\t', 2)
+                if float(when) <= timestamp or int(pid) not in names:
+                    names[int(pid)] = name
+        return names
+
+    def snapshot_at(self, timestamp) -> tuple:
+        # find the finest tier that still has data around the given time and
+        # return (tier, {pid: {metric: value}}) for the sample closest to it
+        for tier, resolution in self.resolutions.items():
+            window = max(resolution, 60)
+            closest = {}
+            for when, pid, code, value in self.query(tier, timestamp - window, timestamp + window):
+                key = (pid, code)
+                if key not in closest or abs(when - timestamp) < abs(closest[key][0] - timestamp):
+                    closest[key] = (when, value)
+            if closest:
+                result = {}
+                for (pid, code), (_, value) in closest.items():
+                    result.setdefault(pid, {})[self.metric_names[code]] = value
+                return tier, result
+        return None, {}
+
+    @staticmethod
+    def parse_time(value) -> float:
+        # epoch seconds or a local "YYYY-MM-DD HH:MM[:SS]"
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+            try:
+                return time.mktime(time.strptime(value, fmt))
+            except ValueError:
+                continue
+        raise ValueError(f'could not read the time {value}, use epoch seconds or "YYYY-MM-DD HH:MM"')
+
+    @classmethod
+    def parse_retention(cls, value) -> dict:
+        # "raw=2,1m=30,1h=365" in days
+        retention = {}
+        for term in (value or '').split(','):
+            if not term.strip():
+                continue
+            tier, _, days = term.partition('=')
+            tier = tier.strip()
+            if tier not in cls.resolutions:
+                raise ValueError(f'unknown tier {tier}, use one of {", ".join(cls.resolutions)}')
+            retention[tier] = float(days)
+        return retention
+
+
+# top style live view, only the rows that fit on screen get formatted and only
+# the lines that changed since the last frame get written to the terminal
+class Live_View:
+    # header, width, how to get the value, how to sort by it
+    columns = [
+        ('PID', 7, lambda row: str(row['pid'])),
+        ('USER', 10, lambda row: row.get('username') or 'N/A'),
+        ('MEMORY', 9, lambda row: Monitor.rss_human(row)),
+        ('CPU%', 6, lambda row: f'{row.get("cpu_percent") or 0.0:.1f}'),
+        ('STATUS', 10, lambda row: row.get('status') or 'N/A'),
+        ('NAME', 0, lambda row: row.get('name') or 'N/A'),  # takes the rest of the line
+    ]
+    detail_columns = [
+        ('USS', 9, lambda row: bytes2human(row['memory_full_info'].uss) if row.get('memory_full_info') else 'N/A'),
+        ('FDS', 5, lambda row: str(row.get('num_fds') if row.get('num_fds') is not None else 'N/A')),
+        ('THR', 4, lambda row: str(row.get('num_threads') if row.get('num_threads') is not None else 'N/A')),
+        ('SEEN', 5, lambda row: f'{int(Detail_Sampler.age(row))}s' if row.get('detail_time') else '-'),
+    ]
+    sort_keys = {
+        'pid': lambda row: row['pid'],
+        'memory': lambda row: row['memory_info'].rss if row.get('memory_info') is not None else 0,
+        'cpu': lambda row: row.get('cpu_percent') or 0.0,
+        'name': lambda row: (row.get('name') or '').lower(),
+    }
+    # keys that pick the sort column
+    sort_bindings = {'p': 'pid', 'm': 'memory', 'c': 'cpu', 'N': 'name'}
+    help_line = 'q quit  n/b page  j/k line  p/m/c/N sort  r reverse  +/- refresh'
+
+    def __init__(self, monitor, refresh=2.0, sort='pid') -> None:
+        self.monitor = monitor
+        self.refresh = refresh
+        if monitor.fleet_collector is not None:
+            self.columns = [('HOST', 12, lambda row: row.get('host') or 'N/A')] + self.columns
+        if monitor.detail_sampler is not None:
+            # before NAME, which takes the rest of the line
+            self.columns = self.columns[:-1] + self.detail_columns + self.columns[-1:]
+        self.sort = sort if sort in self.sort_keys else 'pid'
+        # numbers read best biggest first, text and pids smallest first
+        self.reverse = self.sort in ('memory', 'cpu')
+        self.offset = 0
+        self.previous = []  # lines currently on screen
+        self.size = None
+
+    def format_row(self, values, width) -> str:
+        parts = []
+        for (_, column_width, _), value in zip(self.columns, values):
+            if column_width:
+                parts.append(value[:column_width].rjust(column_width) if value[:1].isdigit()
+                             else value[:column_width].ljust(column_width))
+            else:
+                parts.append(value)
+        return ' '.join(parts)[:width].ljust(width)
+
+    def frame(self, rows, width, height) -> list:
+        with instrumentation.phase('sort'):
+            rows = sorted(rows, key=self.sort_keys[self.sort], reverse=self.reverse)
+        body = max(1, height - 2)
+        self.offset = max(0, min(self.offset, len(rows) - body))
+        lines = [self.format_row([header for header, _, _ in self.columns], width)]
+        # only the visible slice gets formatted
+        for row in rows[self.offset:self.offset + body]:
+            lines.append(self.format_row([get(row) for _, _, get in self.columns], width))
+        lines.extend([' ' * width] * (body - (len(lines) - 1)))
+        status = (f'{len(rows)} processes  rows {self.offset + 1}-{min(self.offset + body, len(rows))}  '
+                  f'sort {self.sort}{" desc" if self.reverse else ""}  refresh {self.refresh:g}s  {self.help_line}')
+        if self.monitor.session_player is not None:
+            status = f'{self.monitor.session_player.status()}  {status}'
+        lines.append(status[:width].ljust(width))
+        return lines
+
+    def draw(self, lines) -> None:
+        with instrumentation.phase('render'):
+            self.draw_lines(lines)
+
+    def draw_lines(self, lines) -> None:
+        size = shutil.get_terminal_size()
+        out = []
+        if size != self.size:
+            # the old frame means nothing after a resize
+            self.size = size
+            self.previous = []
+            out.append('\033[2J')
+        for number, line in enumerate(lines):
+            if number >= len(self.previous) or self.previous[number] != line:
+                # move the cursor to the line and rewrite just that line
+                out.append(f'\033[{number + 1};1H{line}')
+        self.previous = lines
+        if out:
+            sys.stdout.write(''.join(out))
+            sys.stdout.flush()
+
+    def handle_key(self, key) -> bool:
+        # returns False when the view should close
+        page = max(1, shutil.get_terminal_size().lines - 2)
+        if key in ('q', '\x1b'):
+            return False
+        if key in ('n', ' ', '\x1b[6~'):
+            self.offset += page
+        elif key in ('b', '\x1b[5~'):
+            self.offset = max(0, self.offset - page)
+        elif key in ('j', '\x1b[B'):
+            self.offset += 1
+        elif key in ('k', '\x1b[A'):
+            self.offset = max(0, self.offset - 1)
+        elif key in self.sort_bindings:
+            self.sort = self.sort_bindings[key]
+            self.reverse = self.sort in ('memory', 'cpu')
+        elif key == 'r':
+            self.reverse = not self.reverse
+        elif key == '+':
+            self.refresh = max(0.2, self.refresh / 2)
+        elif key == '-':
+            self.refresh = min(60.0, self.refresh * 2)
+        elif self.monitor.session_player is not None:
+            self.monitor.session_player.handle_key(key)
+        return True
+
+    @staticmethod
+    def read_key(timeout):
+        # wait up to timeout seconds for a key press, None if nothing was pressed
+        if os.name == 'nt':
+            import msvcrt
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if msvcrt.kbhit():
+                    return msvcrt.getwch()
+                time.sleep(0.05)
+            return None
+        ready, _, _ = select.select([sys.stdin], [], [], timeout)
+        if not ready:
+            return None
+        # arrow and page keys come in as short escape sequences
+        return os.read(sys.stdin.fileno(), 8).decode(errors='ignore')
+
+    def run(self) -> None:
+        settings = None
+        if os.name != 'nt':
+            import termios
+            import tty
+            settings = termios.tcgetattr(sys.stdin)
+            tty.setcbreak(sys.stdin.fileno())
+        # alternate screen and hidden cursor, put back in the finally below
+        sys.stdout.write('\033[?1049h\033[?25l')
+        try:
+            running = True
+            while running:
+                size = shutil.get_terminal_size()
+                rows = self.monitor.current_rows()
+                self.draw(self.frame(rows, size.columns, size.lines))
+                # keys only redraw from the rows we already have, a new snapshot waits for the refresh
+                deadline = time.monotonic() + self.refresh
+                while running:
+                    key = self.read_key(max(0.0, deadline - time.monotonic()))
+                    if key is None:
+                        break
+                    running = self.handle_key(key)
+                    if running:
+                        if self.monitor.session_player is not None:
+                            # a jump in the recording shows up straight away
+                            rows = self.monitor.current_rows()
+                        size = shutil.get_terminal_size()
+                        self.draw(self.frame(rows, size.columns, size.lines))
+        finally:
+            sys.stdout.write('\033[?25h\033[?1049l')
+            sys.stdout.flush()
+            if settings is not None:
+                termios.tcsetattr(sys.stdin, termios.TCSADRAIN, settings)
+
+
+# serves system and per process metrics in the OpenMetrics text format
+# every scrape inside max_age seconds gets the same cached payload, so any number of
+# scrapers cause at most one /proc walk per interval (none at all when -D is sampling)
+class Metrics_Exporter:
+    content_type = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+    prefix = 'process_monitor'
+
+    def __init__(self, monitor, max_age=5.0, top=10, top_by='cpu') -> None:
+        self.monitor = monitor
+        self.max_age = max_age
+        # only the top N processes get their own series to keep label cardinality bounded
+        self.top = top
+        self.top_by = top_by
+        self.lock = threading.Lock()
+        self.payload = None
+        self.built_at = 0.0
+
+    @staticmethod
+    def label(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def family(self, lines, name, kind, help_text, samples) -> None:
+        # samples are (labels dict, value)
+        lines.append(f'# TYPE {self.prefix}_{name} {kind}')
+        lines.append(f'# HELP {self.prefix}_{name} {help_text}')
+        for labels, value in samples:
+            if labels:
+                rendered = ','.join(f'{key}="{self.label(val)}"' for key, val in labels.items())
+                lines.append(f'{self.prefix}_{name}{{{rendered}}} {value}')
+            else:
+                lines.append(f'{self.prefix}_{name} {value}')
+
+    def system_cpu(self) -> list:
+        # reuse the sampler's last reading when there is one
+        daemon = self.monitor.sampling_daemon
+        if daemon is not None and daemon.is_alive():
+            cores = []
+            for core in range(psutil.cpu_count() or 1):
+                latest = daemon.store.latest(f'system.cpu.{core}')
+                cores.append(latest[1] if latest else 0.0)
+            return cores
+        # non blocking, compares against the previous scrape
+        return psutil.cpu_percent(percpu=True)
+
+    def build(self) -> str:
+        lines = []
+        cores = self.system_cpu()
+        self.family(lines, 'cpu_percent', 'gauge', 'System wide cpu utilization.',
+                    [({}, round(sum(cores) / len(cores), 2))])
+        self.family(lines, 'cpu_core_percent', 'gauge', 'Cpu utilization per core.',
+                    [({'core': core}, value) for core, value in enumerate(cores)])
+        memory = psutil.virtual_memory()
+        self.family(lines, 'memory_bytes', 'gauge', 'Virtual memory.',
+                    [({'type': field}, getattr(memory, field)) for field in ('total', 'available', 'used', 'free')])
+        swap = psutil.swap_memory()
+        self.family(lines, 'swap_bytes', 'gauge', 'Swap memory.',
+                    [({'type': field}, getattr(swap, field)) for field in ('total', 'used', 'free')])
+        disks = []
+        for part, usage, _ in self.monitor.disk_probe.usage_all():
+            if usage is None:
+                continue
+            for field in ('total', 'used', 'free'):
+                disks.append(({'device': part.device, 'mountpoint': part.mountpoint, 'type': field},
+                              getattr(usage, field)))
+        self.family(lines, 'disk_bytes', 'gauge', 'Disk usage per partition.', disks)
+
+        rows = self.monitor.current_rows()
+        statuses = {}
+        for row in rows:
+            statuses[row.get('status')] = statuses.get(row.get('status'), 0) + 1
+        self.family(lines, 'processes', 'gauge', 'Number of processes per status.',
+                    [({'status': status}, count) for status, count in sorted(statuses.items(), key=str)])
+        key = Live_View.sort_keys['memory' if self.top_by == 'rss' else 'cpu']
+        top = sorted(rows, key=key, reverse=True)[:self.top]
+        self.family(lines, 'process_cpu_percent', 'gauge', f'Cpu utilization of the top {self.top} processes.',
+                    [({'pid': row['pid'], 'name': row.get('name')}, row.get('cpu_percent') or 0.0) for row in top])
+        self.family(lines, 'process_resident_memory_bytes', 'gauge',
+                    f'Resident memory of the top {self.top} processes.',
+                    [({'pid': row['pid'], 'name': row.get('name')}, Live_View.sort_keys['memory'](row))
+                     for row in top])
+        if self.monitor.process_rollup is not None:
+            # the same rows, the snapshot already reads the rollup fields when -RU is set
+            self.rollup_families(lines, rows)
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def rollup_families(self, lines, rows) -> None:
+        mode = self.monitor.args.Rollup
+        groups = self.monitor.rollup_rows(mode, self.monitor.args.RollupRoot, rows=rows)
+        for field, name, help_text in (
+                ('processes', 'rollup_processes', 'Number of processes'),
+                ('cpu', 'rollup_cpu_percent', 'Summed cpu utilization'),
+                ('rss', 'rollup_resident_memory_bytes', 'Summed resident memory'),
+                ('threads', 'rollup_threads', 'Summed threads'),
+                ('fds', 'rollup_open_fds', 'Summed open file descriptors'),
+                ('connections', 'rollup_connections', 'Summed inet connections')):
+            self.family(lines, name, 'gauge', f'{help_text} per {mode}.',
+                        [({mode: group['group']}, group[field]) for group in groups if group[field] is not None])
+
+    def prime(self) -> None:
+        # cpu_percent only has a value from its second reading, left to the first scrape every process
+        # would rank at 0.0 and the top N would just be whatever sorts first
+        self.monitor.current_rows()
+        psutil.cpu_percent(percpu=True)
+        # so even a scrape straight away compares over a real interval
+        time.sleep(min(self.max_age, 0.5))
+
+    def get_payload(self) -> bytes:
+        # scrapers that arrive while a build is running wait for it and reuse it
+        with self.lock:
+            if self.payload is None or time.monotonic() - self.built_at > self.max_age:
+                self.payload = self.build().encode()
+                self.built_at = time.monotonic()
+            return self.payload
+
+    def serve(self, address='127.0.0.1', port=9110) -> None:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        exporter = self
+        self.prime()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                payload = exporter.get_payload()
+                self.send_response(200)
+                self.send_header('Content-Type', exporter.content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                # scrapes every few seconds would flood the log
+                pass
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        print(f'serving metrics on http://{address}:{port}/metrics, press ctrl+c to stop')
+        logging.info(f'exporter started on {address}:{port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print('exporter was stopped')
+        finally:
+            server.server_close()
+            logging.info('exporter was stopped')
+
+
+# wire format shared by the agent and the collector: every message is a frame of
+# a 4 byte length, a 1 byte flag (1 when zlib compressed) and a json body
+class Fleet_Protocol:
+    header = struct.Struct('>IB')
+    # big messages (the first full snapshot) are worth compressing, deltas usually aren't
+    compress_over = 1024
+    # snapshot field -> short wire name, rss and cpu are pulled out of memory_info/cpu_percent
+    fields = ('name', 'username', 'ppid', 'create_time', 'status', 'rss', 'cpu')
+
+    @staticmethod
+    def parse_address(value) -> tuple:
+        # "unix:/path/agent.sock", "tcp:host:port" or just "host:port"
+        if value.startswith('unix:'):
+            return AF_UNIX, value[len('unix:'):]
+        if value.startswith('tcp:'):
+            value = value[len('tcp:'):]
+        host, _, port = value.rpartition(':')
+        if not port.isdigit():
+            raise ValueError(f'could not read the address {value}, use host:port, tcp:host:port or unix:/path')
+        return (AF_INET6 if ':' in host.strip('[]') else AF_INET), (host.strip('[]') or '0.0.0.0', int(port))
+
+    @classmethod
+    def encode(cls, message) -> bytes:
+        body = json.dumps(message, separators=(',', ':')).encode()
+        flag = 0
+        if len(body) > cls.compress_over:
+            body = zlib.compress(body, 1)
+            flag = 1
+        return cls.header.pack(len(body), flag) + body
+
+    @classmethod
+    def decode_frames(cls, buffer) -> list:
+        # pulls every complete frame off the front of the bytearray
+        messages = []
+        while len(buffer) >= cls.header.size:
+            length, flag = cls.header.unpack_from(buffer)
+            end = cls.header.size + length
+            if len(buffer) < end:
+                break
+            body = bytes(buffer[cls.header.size:end])
+            del buffer[:end]
+            messages.append(json.loads(zlib.decompress(body) if flag else body))
+        return messages
+
+    memory = namedtuple('memory', ['rss'])
+
+    @classmethod
+    def apply_fields(cls, row, fields) -> dict:
+        # wire fields back onto a row shaped like a snapshot row
+        for field, value in fields.items():
+            if field == 'rss':
+                row['memory_info'] = cls.memory(value) if value is not None else None
+            elif field == 'cpu':
+                row['cpu_percent'] = value
+            else:
+                row[field] = value
+        return row
+
+    @staticmethod
+    def diff(before, current) -> tuple:
+        # (new pids with all fields and changed pids with only what changed, exited pids)
+        changed = {}
+        for pid, row in current.items():
+            previous = before.get(pid)
+            if previous is None:
+                changed[str(pid)] = row
+                continue
+            difference = {field: value for field, value in row.items() if previous.get(field) != value}
+            if difference:
+                changed[str(pid)] = difference
+        return changed, [pid for pid in before if pid not in current]
+
+    @classmethod
+    def encode_row(cls, row) -> dict:
+        return {
+            'name': row.get('name'),
+            'username': row.get('username'),
+            'ppid': row.get('ppid'),
+            'create_time': row.get('create_time'),
+            'status': row.get('status'),
+            'rss': row['memory_info'].rss if row.get('memory_info') is not None else None,
+            'cpu': round(row['cpu_percent'], 1) if row.get('cpu_percent') is not None else None,
+        }
+
+
+# streams this host's snapshots to a collector: one full snapshot after connecting and
+# after that only the pids that appeared, exited or changed, and only the fields that changed
+class Fleet_Agent:
+    def __init__(self, monitor, address, name=None, interval=2.0) -> None:
+        self.monitor = monitor
+        self.family, self.address = Fleet_Protocol.parse_address(address)
+        self.name = name or gethostname()
+        self.interval = interval
+        self.sent = {}  # pid -> encoded row the collector has
+        self.system = {}
+        self.bytes_sent = 0
+        self.messages = 0
+
+    def system_values(self, rows) -> dict:
+        memory = psutil.virtual_memory()
+        return {
+            'cpu': psutil.cpu_percent(),
+            'memory_percent': memory.percent,
+            'memory_used': memory.used,
+            'swap_percent': psutil.swap_memory().percent,
+            'processes': len(rows),
+        }
+
+    def message(self, rows, full) -> dict:
+        current = {row['pid']: Fleet_Protocol.encode_row(row) for row in rows}
+        system = self.system_values(rows)
+        if full:
+            message = {'type': 'full', 'time': time.time(), 'system': system,
+                       'processes': {str(pid): row for pid, row in current.items()}}
+        else:
+            changed, exited = Fleet_Protocol.diff(self.sent, current)
+            message = {'type': 'delta', 'time': time.time(),
+                       'system': {key: value for key, value in system.items() if self.system.get(key) != value},
+                       'changed': changed, 'exited': exited}
+        self.sent = current
+        self.system = system
+        return message
+
+    def stream(self, connection) -> None:
+        connection.sendall(Fleet_Protocol.encode({'type': 'hello', 'host': self.name, 'interval': self.interval}))
+        full = True
+        next_tick = time.monotonic()
+        while True:
+            rows = self.monitor.current_rows()
+            frame = Fleet_Protocol.encode(self.message(rows, full))
+            connection.sendall(frame)
+            self.bytes_sent += len(frame)
+            self.messages += 1
+            full = False
+            next_tick += self.interval
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    def run(self) -> None:
+        print(f'streaming {self.name} to {self.address} every {self.interval}s, press ctrl+c to stop')
+        logging.info(f'agent {self.name} streaming to {self.address}')
+        backoff = 1.0
+        # the first reading primes cpu_percent
+        self.monitor.current_rows()
+        try:
+            while True:
+                try:
+                    with socket(self.family, SOCK_STREAM) as connection:
+                        connection.connect(self.address)
+                        backoff = 1.0
+                        self.stream(connection)
+                except OSError as e:
+                    # the collector went away or isn't up yet, start over with a full snapshot
+                    logging.error(f'agent lost the collector at {self.address}: {e}, retrying in {backoff:g}s')
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 30.0)
+        except KeyboardInterrupt:
+            print(f'agent was stopped after {self.messages} messages, {bytes2human(self.bytes_sent)} sent')
+        logging.info(f'agent {self.name} stopped after {self.messages} messages, {self.bytes_sent} bytes')
+
+
+# accepts any number of agents on one selector thread and merges what they send into
+# one fleet wide list of rows, each tagged with its host, that the listing, filters and -O read
+class Fleet_Collector(threading.Thread):
+    def __init__(self, address) -> None:
+        super().__init__(daemon=True)
+        self.family, self.address = Fleet_Protocol.parse_address(address)
+        self.hosts = {}  # host -> {'rows', 'system', 'connected', 'updated', 'bytes', 'messages'}
+        self.connections = {}  # socket -> [buffer, host]
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.listener = None
+
+    def row(self, host, pid, fields) -> dict:
+        return Fleet_Protocol.apply_fields({'host': host, 'pid': pid}, fields)
+
+    def apply(self, connection, message) -> None:
+        state = self.connections[connection]
+        if message['type'] == 'hello':
+            state[1] = message['host']
+            # an agent that reconnects under the same name takes over from its old connection
+            with self.lock:
+                self.hosts[message['host']] = {'rows': {}, 'system': {}, 'connected': True, 'updated': time.time(),
+                                               'bytes': 0, 'messages': 0, 'connection': connection}
+            logging.info(f'agent {message["host"]} connected')
+            return
+        host = state[1]
+        if host is None:
+            raise ValueError('an agent sent data before saying hello')
+        with self.lock:
+            entry = self.hosts[host]
+            if entry['connection'] is not connection:
+                raise ValueError(f'a newer connection from {host} took over')
+            if message['type'] == 'full':
+                entry['rows'] = {int(pid): self.row(host, int(pid), fields)
+                                 for pid, fields in message['processes'].items()}
+                entry['system'] = message['system']
+            else:
+                rows = entry['rows']
+                for pid in message['exited']:
+                    rows.pop(pid, None)
+                for pid, fields in message['changed'].items():
+                    row = rows.get(int(pid))
+                    if row is None:
+                        rows[int(pid)] = self.row(host, int(pid), fields)
+                    else:
+                        Fleet_Protocol.apply_fields(row, fields)
+                entry['system'].update(message['system'])
+            entry['updated'] = message['time']
+            entry['messages'] += 1
+
+    def drop(self, selector, connection) -> None:
+        selector.unregister(connection)
+        connection.close()
+        host = self.connections.pop(connection)[1]
+        if host is not None and self.hosts[host]['connection'] is connection:
+            with self.lock:
+                # the rows would only go stale, they come back with the next full snapshot
+                self.hosts[host]['rows'] = {}
+                self.hosts[host]['connected'] = False
+            logging.info(f'agent {host} disconnected')
+
+    def run(self) -> None:
+        import selectors
+        selector = selectors.DefaultSelector()
+        selector.register(self.listener, selectors.EVENT_READ)
+        while not self.stop_event.is_set():
+            for key, _ in selector.select(timeout=0.5):
+                if key.fileobj is self.listener:
+                    connection, _ = self.listener.accept()
+                    connection.setblocking(False)
+                    self.connections[connection] = [bytearray(), None]
+                    selector.register(connection, selectors.EVENT_READ)
+                    continue
+                connection = key.fileobj
+                try:
+                    data = connection.recv(1 << 16)
+                except OSError:
+                    data = b''
+                if not data:
+                    self.drop(selector, connection)
+                    continue
+                state = self.connections[connection]
+                state[0] += data
+                try:
+                    for message in Fleet_Protocol.decode_frames(state[0]):
+                        self.apply(connection, message)
+                except (ValueError, KeyError, zlib.error) as e:
+                    logging.error(f'dropping agent {state[1]}: bad message {e}')
+                    self.drop(selector, connection)
+                    continue
+                if state[1] is not None and self.hosts[state[1]]['connection'] is connection:
+                    with self.lock:
+                        self.hosts[state[1]]['bytes'] += len(data)
+        for connection in list(self.connections):
+            self.drop(selector, connection)
+        selector.close()
+        self.listener.close()
+
+    def start(self) -> None:
+        self.listener = socket(self.family, SOCK_STREAM)
+        if self.family == AF_UNIX:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.address)
+        else:
+            self.listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen(128)
+        self.listener.setblocking(False)
+        super().start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def get_rows(self) -> list:
+        # copies so callers can sort and read them while agents keep updating
+        with self.lock:
+            return [dict(row) for entry in self.hosts.values() for row in entry['rows'].values()]
 
-# create options to use
-parse = argparse.ArgumentParser(description='A simple process monitoring tool')
+    def summary(self) -> list:
+        with self.lock:
+            return [[host, 'yes' if entry['connected'] else 'no', len(entry['rows']),
+                     entry['system'].get('cpu', 'N/A'), entry['system'].get('memory_percent', 'N/A'),
+                     time.strftime('%H:%M:%S', time.localtime(entry['updated'])), entry['messages'],
+                     bytes2human(entry['bytes'])]
+                    for host, entry in sorted(self.hosts.items())]
 
-# various arguments that can be used
-parse.add_argument('-K', '--Kill', type=str, help='Select the process you want to kill')
-parse.add_argument('-S', '--Search', type=str, help='search for a given process')
-parse.add_argument('-St', '--Start', type=str, help='start a given process')
-parse.add_argument('-L', '--List', help='list all currently running process ', action='store_true')
-parse.add_argument('-F', '--Filter', type=str, help='filter out particular process')
-parse.add_argument('-M', '--Memory', help='check memory information', action='store_true')
-parse.add_argument('-MON', '--Monitor', help='Display all methods continuously i.e enter monitor mode'
-                   , action='store_true')
-parse.add_argument('-C', '--Graph', help='display cpu utilization in real time', action='store_true')
-# parse the arguments
-args = parse.parse_args()
 
+# writes every sampler tick to a session file that --Replay can play back later
+# the file is a run of Fleet_Protocol frames: a keyframe with every process every keyframe_every
+# ticks and deltas in between, so a tick costs about as much as what changed in it.
+# FILE.idx holds (time, offset) of every keyframe so a replay can jump straight to any time
+class Session_Recorder:
+    index_record = struct.Struct('<dQ')
+    keyframe_every = 60
 
-def display_banner() -> None:
-    Banner = """
-   ╔═══════════════════════════════════════════════════════════════════╗
-   ║                                                                   ║
-   ║                                                                   ║
-   ║                                                                   ║   
-   ║    _____                __  __             _ _                    ║   
-   ║    |  __ \              |  \/  |           (_) |                  ║   
-   ║    | |__) | __ ___   ___| \  / | ___  _ __  _| |_ ___  _ __       ║   
-   ║    |  ___/ '__/ _ \ / __| |\/| |/ _ \| '_ \| | __/ _ \| '__|      ║   
-   ║    | |   | | | (_) | (__| |  | | (_) | | | | | || (_) | |         ║   
-   ║    |_|   |_|  \___/ \___|_|  |_|\___/|_| |_|_|\__\___/|_|         ║          
-   ║                                                                   ║   
-   ║                                                                   ║   
-   ║                                                                   ║    
-   ║     Process & Network Monitor - View processes and network        ║
-   ║                                 connections                       ║
-   ║                                                                   ║
-   ╚═══════════════════════════════════════════════════════════════════╝
-"""
-    print(Banner)
+    def __init__(self, path, interval=1.0) -> None:
+        self.path = path
+        self.interval = interval
+        self.stream = None
+        self.index = None
+        self.sent = {}
+        self.ticks = 0
+        self.bytes_written = 0
+
+    def open(self) -> None:
+        self.stream = open(self.path, 'ab')
+        self.index = open(f'{self.path}.idx', 'ab')
+        # every session in the file starts with a header, a new one can be appended later
+        self.write({'type': 'session', 'time': time.time(), 'host': gethostname(), 'interval': self.interval})
+
+    def write(self, message) -> None:
+        frame = Fleet_Protocol.encode(message)
+        self.stream.write(frame)
+        self.stream.flush()
+        self.bytes_written += len(frame)
+
+    def append(self, now, system, rows) -> None:
+        if self.stream is None:
+            self.open()
+        current = {row['pid']: Fleet_Protocol.encode_row(row) for row in rows}
+        if self.ticks % self.keyframe_every == 0:
+            self.index.write(self.index_record.pack(now, self.stream.tell()))
+            self.index.flush()
+            message = {'type': 'full', 'time': now, 'system': system,
+                       'processes': {str(pid): row for pid, row in current.items()}}
+        else:
+            changed, exited = Fleet_Protocol.diff(self.sent, current)
+            message = {'type': 'delta', 'time': now, 'system': system, 'changed': changed, 'exited': exited}
+        self.write(message)
+        self.sent = current
+        self.ticks += 1
+
+    def close(self) -> None:
+        if self.stream is not None:
+            self.stream.close()
+            self.index.close()
+            self.stream = None
+            logging.info(f'recorded {self.ticks} ticks to {self.path}, {self.bytes_written} bytes')
+
+
+# plays a recorded session back into a Metrics_Store at the recorded pace (times speed),
+# so it stands in for the Sampling_Daemon and the listing, filters and graphs work unchanged
+# seeking goes through the keyframe index and only decodes from the keyframe before the target
+class Session_Player(threading.Thread):
+    # key -> seconds to jump, used by the live list
+    jumps = {'[': -60, ']': 60, '{': -600, '}': 600}
+
+    def __init__(self, path, speed=1.0, start=None) -> None:
+        super().__init__(daemon=True)
+        self.path = path
+        self.stream = open(path, 'rb')
+        header = self.read_message()
+        if header is None or header.get('type') != 'session':
+            raise ValueError(f'{path} is not a recorded session')
+        self.interval = header['interval']
+        self.host = header['host']
+        self.keyframes = []  # (time, offset)
+        with open(f'{path}.idx', 'rb') as index:
+            data = index.read()
+        usable = len(data) - len(data) % Session_Recorder.index_record.size
+        self.keyframes = list(Session_Recorder.index_record.iter_unpack(data[:usable]))
+        if not self.keyframes:
+            raise ValueError(f'{path} has no keyframes yet')
+        self.speed = speed
+        self.start_time = start
+        self.store = Metrics_Store()
+        self.rows = {}
+        self.position = self.keyframes[0][0]
+        self.pending = None  # the next message, read ahead while waiting for its time
+        # (monotonic, recording time) the playback clock counts from
+        self.anchor = (time.monotonic(), self.position)
+        self.paused = False
+        self.finished = False
+        self.ticks = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self.first_tick = threading.Event()
+
+    def read_message(self, stream=None):
+        stream = stream or self.stream
+        start = stream.tell()
+        header = stream.read(Fleet_Protocol.header.size)
+        if len(header) == Fleet_Protocol.header.size:
+            length, flag = Fleet_Protocol.header.unpack(header)
+            body = stream.read(length)
+            if len(body) == length:
+                return json.loads(zlib.decompress(body) if flag else body)
+        # the recorder is part way through writing this frame, read it whole next time
+        stream.seek(start)
+        return None
+
+    def next_message(self, stream=None):
+        while True:
+            message = self.read_message(stream)
+            if message is None or message['type'] != 'session':
+                return message
+
+    def apply(self, message) -> None:
+        if message['type'] == 'full':
+            self.rows = {int(pid): Fleet_Protocol.apply_fields({'pid': int(pid)}, fields)
+                         for pid, fields in message['processes'].items()}
+        else:
+            for pid in message['exited']:
+                self.rows.pop(pid, None)
+                self.store.drop_process(pid)
+            for pid, fields in message['changed'].items():
+                row = self.rows.get(int(pid))
+                if row is None:
+                    self.rows[int(pid)] = Fleet_Protocol.apply_fields({'pid': int(pid)}, fields)
+                else:
+                    Fleet_Protocol.apply_fields(row, fields)
+        now = message['time']
+        system = message['system']
+        cores = system['cpu']
+        self.store.record('system.cpu', now, sum(cores) / len(cores))
+        for core, value in enumerate(cores):
+            self.store.record(f'system.cpu.{core}', now, value)
+        self.store.record('system.memory', now, system['memory'])
+        self.store.record('system.memory.percent', now, system['memory_percent'])
+        self.store.record('system.swap', now, system['swap'])
+        for pid, row in self.rows.items():
+            if row.get('memory_info') is not None:
+                self.store.record(f'process.{pid}.rss', now, row['memory_info'].rss)
+            if row.get('cpu_percent') is not None:
+                self.store.record(f'process.{pid}.cpu', now, row['cpu_percent'])
+        # copies, later deltas update the rows in place
+        self.store.set_rows([dict(row) for row in self.rows.values()], now)
+        self.position = now
+        self.ticks += 1
+
+    def seek(self, when) -> None:
+        # start from the last keyframe at or before the target and decode forward to it
+        with self.lock:
+            when = min(max(when, self.keyframes[0][0]), self.keyframes[-1][0] + self.keyframe_span())
+            position = max(0, bisect.bisect_right(self.keyframes, (when, float('inf'))) - 1)
+            self.stream.seek(self.keyframes[position][1])
+            self.store = Metrics_Store()
+            self.rows = {}
+            self.pending = None
+            self.finished = False
+            applied = False
+            while True:
+                message = self.next_message()
+                if message is None:
+                    break
+                if message['time'] > when and applied:
+                    self.pending = message
+                    break
+                self.apply(message)
+                applied = True
+            self.anchor = (time.monotonic(), self.position)
+            self.first_tick.set()
+        self.wake.set()
+
+    def keyframe_span(self) -> float:
+        return Session_Recorder.keyframe_every * self.interval
+
+    def clock(self) -> float:
+        # where playback is in the recording right now
+        started, position = self.anchor
+        return position + (time.monotonic() - started) * self.speed
+
+    def handle_key(self, key) -> bool:
+        # returns True when the key was a replay key
+        if key in self.jumps:
+            self.seek(self.position + self.jumps[key])
+            return True
+        with self.lock:
+            if key == '>':
+                self.speed = min(64.0, self.speed * 2)
+            elif key == '<':
+                self.speed = max(0.125, self.speed / 2)
+            elif key == 'P':
+                self.paused = not self.paused
+            else:
+                return False
+            # speed and pause count from the tick on screen
+            self.anchor = (time.monotonic(), self.position)
+        self.wake.set()
+        return True
+
+    def status(self) -> str:
+        state = 'paused' if self.paused else 'end' if self.finished else f'x{self.speed:g}'
+        return (f'replay {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.position))} {state}  '
+                f'[/] 1m {{/}} 10m  </> speed  P pause')
+
+    def run(self) -> None:
+        self.seek(self.start_time if self.start_time is not None else self.keyframes[0][0])
+        while not self.stop_event.is_set():
+            with self.lock:
+                message = self.pending
+                if message is None:
+                    message = self.next_message()
+                    self.pending = message
+                if message is None:
+                    # the end of the recording, stay on the last tick (a live recording may still grow)
+                    self.finished = True
+                    wait = self.interval
+                elif self.paused:
+                    wait = None
+                else:
+                    wait = (message['time'] - self.clock()) / self.speed
+                    if wait <= 0:
+                        self.apply(message)
+                        self.pending = None
+                        continue
+            self.wake.clear()
+            self.wake.wait(wait)
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.wake.set()
+
+    def summary(self) -> list:
+        size = os.path.getsize(self.path)
+        first, last = self.keyframes[0][0], self.keyframes[-1][0]
+        ticks = 0
+        # its own handle, the player may be reading from self.stream at the same time
+        with open(self.path, 'rb') as stream:
+            while True:
+                message = self.next_message(stream)
+                if message is None:
+                    break
+                ticks += 1
+                last = message['time']
+        return [['host', self.host], ['interval', f'{self.interval:g}s'],
+                ['from', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(first))],
+                ['to', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last))],
+                ['ticks', ticks], ['keyframes', len(self.keyframes)], ['size', bytes2human(size)],
+                ['bytes per tick', bytes2human(size / ticks) if ticks else 'N/A']]
+
+
+# launches and babysits child programs, started from an argv without a shell
+# stdout and stderr of every child are read through one selector into bounded line buffers
+# (and size rotated files with output=), so a chatty child never blocks on a full pipe
+# exits come in through a pidfd where the kernel has them and restarts follow each program's
+# policy with exponential backoff, a child that stayed up for stable_after seconds starts over from the first delay
+class Process_Supervisor(threading.Thread):
+    restart_policies = ('never', 'on-failure', 'always')
+    keys = ('name', 'cmd', 'count', 'restart', 'backoff', 'max_backoff', 'keep', 'output', 'max_size', 'backups')
+    stable_after = 10.0
+    # a line longer than this is cut so one runaway line can't grow a buffer without bound
+    max_line = 64 * 1024
+
+    def __init__(self, stop_timeout=3.0) -> None:
+        super().__init__(daemon=True)
+        self.stop_timeout = stop_timeout
+        self.children = []  # one dict per copy of a program
+        self.lock = threading.Lock()
+        self.stopping = False
+        self.stop_deadline = None
+        self.selector = None
+        self.wake_read, self.wake_write = os.pipe()
+        self.wake = threading.Event()  # on windows, where pipes can't go in a selector
+        self.polling = set()  # running children with no pidfd, checked with poll() every round
+        self.prctl = None
+        if sys.platform.startswith('linux'):
+            # loaded here, the child can't import anything between fork and exec
+            try:
+                import ctypes
+                self.prctl = ctypes.CDLL(None, use_errno=True).prctl
+            except (ImportError, OSError, AttributeError):
+                pass
+
+    @classmethod
+    def parse_program(cls, spec) -> dict:
+        # "name=web;cmd=python worker.py;count=4;restart=on-failure;backoff=1s;max_backoff=1m;output=logs"
+        # anything that doesn't start with one of the keys is just the command, = and ; included
+        program = {'count': '1', 'restart': 'never', 'backoff': '1s', 'max_backoff': '1m', 'keep': '200',
+                   'output': '', 'max_size': '10M', 'backups': '3'}
+        if spec.partition('=')[0].strip().lower() not in cls.keys:
+            program['cmd'] = spec.strip()
+            terms = []
+        else:
+            terms = cls.split_terms(spec)
+        for term in terms:
+            if not term.strip():
+                continue
+            key, sep, value = term.partition('=')
+            key = key.strip().lower()
+            if not sep or key not in cls.keys:
+                raise ValueError(f'{term} should look like key=value with key one of {", ".join(cls.keys)}')
+            program[key] = value.strip()
+        if not program.get('cmd'):
+            raise ValueError('a program needs cmd=')
+        program['argv'] = shlex.split(program['cmd'])
+        program['name'] = program.get('name') or os.path.basename(program['argv'][0])
+        if program['restart'] not in cls.restart_policies:
+            raise ValueError(f'unknown restart policy {program["restart"]}, use one of {", ".join(cls.restart_policies)}')
+        for key in ('count', 'keep', 'backups'):
+            program[key] = int(program[key])
+        if program['count'] < 1:
+            raise ValueError('count has to be at least 1')
+        program['backoff'] = Task_Scheduler.parse_duration(program['backoff'])
+        program['max_backoff'] = Task_Scheduler.parse_duration(program['max_backoff'])
+        program['max_size'] = Process_Filter.parse_number('rss', program['max_size'])
+        return program
+
+    @staticmethod
+    def split_terms(spec) -> list:
+        # split on ; outside of quotes, so cmd=sh -c 'a; b' stays one term
+        terms = []
+        term = []
+        quote = None
+        for char in spec:
+            if quote:
+                if char == quote:
+                    quote = None
+            elif char in ('"', "'"):
+                quote = char
+            elif char == ';':
+                terms.append(''.join(term))
+                term = []
+                continue
+            term.append(char)
+        if quote:
+            raise ValueError(f'unterminated {quote} in {spec}')
+        terms.append(''.join(term))
+        return terms
+
+    def add_program(self, program) -> list:
+        # the copies start on the supervisor thread, returns their names
+        added = []
+        with self.lock:
+            for number in range(program['count']):
+                name = program['name'] if program['count'] == 1 else f'{program["name"]}.{number}'
+                self.children.append({'name': name, 'program': program, 'process': None, 'pid': None,
+                                      'state': 'starting', 'started': None, 'next_start': 0.0, 'runs': 0,
+                                      'restarts': 0, 'failures': 0, 'exit_code': None, 'pidfd': None,
+                                      'lines': deque(maxlen=program['keep']), 'bytes': 0, 'log': None,
+                                      'log_failed': False})
+                added.append(name)
+        self.notify()
+        return added
+
+    def notify(self) -> None:
+        if os.name == 'nt':
+            self.wake.set()
+        else:
+            os.write(self.wake_write, b'\0')
+
+    def spawn(self, child, now) -> None:
+        program = child['program']
+        try:
+            process = subprocess.Popen(program['argv'], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, start_new_session=os.name != 'nt',
+                                       preexec_fn=self.die_with_parent if self.prctl is not None else None)
+        except OSError as e:
+            print(f'unable to start {child["name"]} ({program["cmd"]}): {e}')
+            logging.error(f'unable to start {child["name"]} ({program["cmd"]}): {e}')
+            child['started'] = now
+            self.exited(child, None, now)
+            return
+        with self.lock:
+            if child['runs']:
+                child['restarts'] += 1
+            child.update(process=process, pid=process.pid, state='running', started=now, next_start=None,
+                         exit_code=None)
+            child['runs'] += 1
+        logging.info(f'started {child["name"]} ({program["cmd"]}) with PID:{process.pid}')
+        self.watch(child, process)
+
+    def die_with_parent(self) -> None:
+        # runs in the child between fork and exec
+        # the child is in its own session, so a SIGKILL of the monitor that no handler sees would
+        # otherwise leave it running, PR_SET_PDEATHSIG has the kernel send it SIGTERM instead
+        # it fires when the forking thread goes, which is this supervisor thread and outlives every child
+        self.prctl(1, signal.SIGTERM)  # PR_SET_PDEATHSIG
+
+    def watch(self, child, process) -> None:
+        if self.selector is None:
+            for stream, pipe in (('stdout', process.stdout), ('stderr', process.stderr)):
+                threading.Thread(target=self.read_blocking, args=(child, stream, pipe), daemon=True).start()
+            self.polling.add(id(child))
+            return
+        import selectors
+        for stream, pipe in (('stdout', process.stdout), ('stderr', process.stderr)):
+            os.set_blocking(pipe.fileno(), False)
+            self.selector.register(pipe, selectors.EVENT_READ, ['output', child, stream, bytearray()])
+        try:
+            child['pidfd'] = os.pidfd_open(process.pid)
+            self.selector.register(child['pidfd'], selectors.EVENT_READ, ['exit', child, process, None])
+        except (AttributeError, OSError):
+            # older kernels and other unixes, poll() it every round instead
+            self.polling.add(id(child))
+
+    def read_blocking(self, child, stream, pipe) -> None:
+        for line in iter(lambda: pipe.readline(self.max_line), b''):
+            self.output(child, stream, line)
+        pipe.close()
+
+    def read_output(self, key) -> bool:
+        # False once the pipe has nothing more right now
+        _, child, stream, partial = key.data
+        try:
+            data = os.read(key.fileobj.fileno(), 1 << 16)
+        except BlockingIOError:
+            return False
+        except OSError:
+            data = b''
+        if not data:
+            if partial:
+                self.output(child, stream, bytes(partial))
+            self.selector.unregister(key.fileobj)
+            key.fileobj.close()
+            return False
+        partial += data
+        lines = partial.split(b'\n')
+        for line in lines[:-1]:
+            self.output(child, stream, line)
+        partial[:] = lines[-1]
+        if len(partial) > self.max_line:
+            self.output(child, stream, bytes(partial))
+            partial.clear()
+        return True
+
+    def output(self, child, stream, line) -> None:
+        text = line.rstrip(b'\r\n')[:self.max_line].decode(errors='replace')
+        now = time.time()
+        with self.lock:
+            child['lines'].append((now, stream, text))
+            child['bytes'] += len(line)
+        if child['program']['output'] and not child['log_failed']:
+            self.write_log(child, f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))} {stream} {text}\n')
+
+    def write_log(self, child, line) -> None:
+        program = child['program']
+        path = os.path.join(program['output'], f'{child["name"]}.log')
+        try:
+            self.append_log(child, path, line)
+        except OSError as e:
+            # the lines still go to the in memory buffer, only the file is given up on
+            print(f'stopped writing the output of {child["name"]} to {path}: {e}')
+            logging.error(f'stopped writing the output of {child["name"]} to {path}: {e}')
+            if child['log'] is not None:
+                with contextlib.suppress(OSError):
+                    child['log'].close()
+            child['log'] = None
+            child['log_failed'] = True
+
+    def append_log(self, child, path, line) -> None:
+        program = child['program']
+        if child['log'] is None:
+            os.makedirs(program['output'], exist_ok=True)
+            child['log'] = open(path, 'a', encoding='utf-8')
+        child['log'].write(line)
+        child['log'].flush()
+        if child['log'].tell() >= program['max_size']:
+            # log.1 is the newest backup, anything past backups is dropped
+            child['log'].close()
+            child['log'] = None
+            for number in range(program['backups'] - 1, 0, -1):
+                if os.path.exists(f'{path}.{number}'):
+                    os.replace(f'{path}.{number}', f'{path}.{number + 1}')
+            if program['backups']:
+                os.replace(path, f'{path}.1')
+            else:
+                os.remove(path)
+
+    def reap(self, child) -> None:
+        process = child['process']
+        if process is None:
+            return
+        code = process.poll()
+        if code is None:
+            return
+        if child['pidfd'] is not None:
+            self.selector.unregister(child['pidfd'])
+            os.close(child['pidfd'])
+            child['pidfd'] = None
+        self.polling.discard(id(child))
+        self.exited(child, code, time.monotonic())
+
+    def exited(self, child, code, now) -> None:
+        program = child['program']
+        if now - child['started'] >= self.stable_after:
+            child['failures'] = 0
+        restart = not self.stopping and (program['restart'] == 'always' or
+                                         (program['restart'] == 'on-failure' and code != 0))
+        with self.lock:
+            child.update(process=None, pid=None, exit_code=code)
+            if restart:
+                delay = min(program['max_backoff'], program['backoff'] * 2 ** child['failures'])
+                child['failures'] += 1
+                child['state'] = 'backoff'
+                child['next_start'] = now + delay
+            else:
+                child['state'] = 'exited' if code == 0 else 'failed'
+        if restart:
+            print(f'{child["name"]} exited with {code}, restarting in {delay:g}s')
+            logging.warning(f'{child["name"]} exited with {code}, restarting in {delay:g}s')
+        else:
+            print(f'{child["name"]} exited with {code}')
+            logging.info(f'{child["name"]} exited with {code}')
+
+    def signal_children(self, kill=False) -> None:
+        for child in self.children:
+            process = child['process']
+            if process is None:
+                continue
+            with contextlib.suppress(ProcessLookupError, PermissionError):
+                if os.name == 'nt':
+                    process.kill() if kill else process.terminate()
+                else:
+                    # the whole session, so whatever the child started goes too
+                    os.killpg(process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+
+    def run(self) -> None:
+        if os.name != 'nt':
+            import selectors
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.wake_read, selectors.EVENT_READ, ['wake', None, None, None])
+        while True:
+            try:
+                if not self.round():
+                    break
+            except Exception as e:
+                # one child's bad luck must not leave the others undrained and unreaped
+                logging.exception(f'supervisor round failed: {e}')
+                time.sleep(0.1)
+        self.finish()
+
+    def round(self) -> bool:
+        # one pass of starting, reading and reaping, False once a stop has finished
+        now = time.monotonic()
+        if self.stopping:
+            if not any(child['process'] is not None for child in self.children):
+                return False
+            if now >= self.stop_deadline:
+                self.signal_children(kill=True)
+                self.stop_deadline = float('inf')
+        else:
+            for child in list(self.children):
+                if child['process'] is None and child['next_start'] is not None and child['next_start'] <= now:
+                    self.spawn(child, now)
+        timeout = 1.0 if self.polling else None
+        starts = [child['next_start'] - now for child in self.children
+                  if child['process'] is None and child['next_start'] is not None and not self.stopping]
+        if starts:
+            timeout = max(0.0, min(starts + ([timeout] if timeout is not None else [])))
+        if self.stopping:
+            timeout = 0.1
+        if self.selector is None:
+            self.wake.wait(timeout)
+            self.wake.clear()
+            events = []
+        else:
+            events = self.selector.select(timeout)
+        for key, _ in events:
+            kind, child = key.data[:2]
+            if kind == 'wake':
+                os.read(self.wake_read, 4096)
+            elif kind == 'exit':
+                self.reap(child)
+            else:
+                self.read_output(key)
+        for child in self.children:
+            if id(child) in self.polling:
+                self.reap(child)
+        return True
+
+    def finish(self) -> None:
+        if self.selector is not None:
+            # whatever is still buffered in the pipes is read before they are closed
+            for key in list(self.selector.get_map().values()):
+                if key.data[0] == 'output':
+                    while self.read_output(key):
+                        pass
+                    if key.fileobj in self.selector.get_map():
+                        self.selector.unregister(key.fileobj)
+                        key.fileobj.close()
+            self.selector.close()
+        for child in self.children:
+            if child['log'] is not None:
+                child['log'].close()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+
+    def stop(self) -> None:
+        # SIGTERM now, SIGKILL for whatever is left after stop_timeout
+        if self.stopping:
+            return
+        self.stopping = True
+        self.stop_deadline = time.monotonic() + self.stop_timeout
+        self.signal_children()
+        self.notify()
+
+    def active(self) -> bool:
+        with self.lock:
+            return any(child['state'] in ('starting', 'running', 'backoff') for child in self.children)
+
+    def summary(self, rows) -> list:
+        # rows are the monitor's own snapshot, so cpu and memory come from the same sampling as everything else
+        by_pid = {row['pid']: row for row in rows}
+        now = time.monotonic()
+        table = []
+        with self.lock:
+            for child in self.children:
+                row = by_pid.get(child['pid'], {})
+                uptime = int(now - child['started']) if child['pid'] is not None else 'N/A'
+                last = child['lines'][-1][2][:40] if child['lines'] else ''
+                table.append([child['name'], child['pid'] or 'N/A', child['state'], uptime, child['restarts'],
+                              child['exit_code'] if child['exit_code'] is not None else 'N/A',
+                              row.get('cpu_percent', 'N/A') if row else 'N/A', Monitor.rss_human(row) if row else 'N/A',
+                              bytes2human(child['bytes']), last])
+        return table
+
+    def tail(self, name, count=10) -> list:
+        with self.lock:
+            for child in self.children:
+                if child['name'] == name:
+                    return list(child['lines'])[-count:]
+        return []
 
 
 # create monitor class that takes arguments from args
 class Monitor:
-    plt.style.use('Solarize_Light2')
-
     def __init__(self, args) -> None:
         # set init variables for the arguments to the passed and
-        # for the plots
+        # for the plots, the figure itself is only made when a graph is shown
         self.args = args
-        self.fig, (self.ax_cpu, self.ax_memory) = plt.subplots(2, 1, figsize=(8, 8))
-        self.y_axis_cpu = []
-        self.x_axis_cpu = []
-        self.y_axis_memory = []
-        self.x_axis_memory = []
-        self.set_up_plot_cpu()
-        self.set_up_plot_memory_usage()
-        # do not know if this is doing anything
-        self.index = count()
+        self.fig = None
+        self.ax_cpu = None
+        self.ax_memory = None
+        # persistent line artists, updated in place on every frame
+        self.cpu_lines = []
+        self.memory_line = None
+        self.swap_line = None
+        # the background sampler and its store, only there in -D mode or while a graph is open
+        self.sampling_daemon = None
+        self.graph_daemon = None
+        # how many samples the graph keeps and whether cpu is drawn per core
+        self.window = getattr(args, 'Window', None) or 60
+        self.per_core = getattr(args, 'PerCore', False)
+        # every listing, filter and search reads from this one cache
+        self.snapshot = Process_Snapshot(workers=getattr(args, 'Workers', 1), pool=getattr(args, 'Pool', 'thread'))
+        self.cpu_sampler = Cpu_Sampler(self.snapshot)
+        # mounts that don't answer within --ProbeTimeout are reported instead of hanging a command
+        self.disk_probe = Disk_Probe(getattr(args, 'ProbeTimeout', None) or 2.0)
+        # rows from every agent instead of this host's when collecting
+        self.fleet_collector = None
+        # plays a --Replay recording in place of the sampler
+        self.session_player = None
+        # children started with -St/-SV or from the menu
+        self.process_supervisor = None
+        # uss, pss, fds and threads for the processes that matter, with -DT
+        self.detail_sampler = None
+        if getattr(args, 'Details', False):
+            self.detail_sampler = Detail_Sampler(self.snapshot, top=args.DetailTop, budget=args.DetailBudget / 1000,
+                                                 every=args.DetailEvery, cpu_cap=args.CpuCap)
+        # rollups need threads and fds on every tick, also when the sampler is the one reading
+        self.process_rollup = None
+        if getattr(args, 'Rollup', None):
+            self.process_rollup = Process_Rollup()
+            self.snapshot.dynamic_fields = Process_Rollup.dynamic_fields
+
+    def close(self) -> None:
+        if self.process_supervisor is not None:
+            self.process_supervisor.stop()
+            self.process_supervisor.join(timeout=getattr(self.args, 'KillTimeout', 3.0) + 2)
+        if self.fleet_collector is not None:
+            self.fleet_collector.stop()
+            self.fleet_collector.join(timeout=5)
+        if self.sampling_daemon is not None:
+            self.sampling_daemon.stop()
+            self.sampling_daemon.join(timeout=5)
+        self.snapshot.close()
+        self.disk_probe.close()
+
+    def start_sampling(self, interval=1.0, archive=None, alerts=None, recorder=None) -> None:
+        # from here on the daemon owns the snapshot and everything reads from its store
+        self.sampling_daemon = Sampling_Daemon(Metrics_Store(), self.snapshot, interval=interval, archive=archive,
+                                               alerts=alerts, recorder=recorder, details=self.detail_sampler)
+        self.sampling_daemon.start()
+        self.sampling_daemon.first_tick.wait()
+        logging.info(f'started sampling every {interval}s')
+
+    def start_replay(self, path) -> None:
+        # the player stands in for the sampler, so everything reading the store sees the recording
+        start = None
+        if self.args.ReplayFrom:
+            start = self.args.ReplayFrom
+        self.session_player = Session_Player(path, speed=self.args.Speed, start=start)
+        self.sampling_daemon = self.session_player
+        self.session_player.start()
+        self.session_player.first_tick.wait()
+        logging.info(f'replaying {path} from {time.ctime(self.session_player.position)}')
+
+    def replay_summary(self) -> None:
+        self.emit(self.draw_table(self.session_player.summary(), ['SESSION', 'VALUE']))
+
+    def start_collector(self, address) -> None:
+        self.fleet_collector = Fleet_Collector(address)
+        self.fleet_collector.start()
+        print(f'collecting from agents on {address}')
+        logging.info(f'collector started on {address}')
+        # every connected agent reports once per refresh, so after one all of them are in
+        time.sleep(getattr(self.args, 'Refresh', 2.0))
+
+    def show_fleet(self) -> None:
+        # a table of the connected agents every refresh until ctrl+c
+        headers = ["HOST", "CONNECTED", "PROCESSES", "CPU_PERCENT(%)", "MEMORY(%)", "UPDATED", "MESSAGES", "RECEIVED"]
+        try:
+            while True:
+                self.emit(self.draw_table(self.fleet_collector.summary(), headers))
+                time.sleep(getattr(self.args, 'Refresh', 2.0))
+        except KeyboardInterrupt:
+            print('collector was stopped')
+        logging.info('collector was stopped')
+
+    def wait_for_sampler(self) -> None:
+        print(f'sampling every {self.sampling_daemon.interval}s, press ctrl+c to stop')
+        try:
+            while self.sampling_daemon.is_alive():
+                self.sampling_daemon.join(timeout=1)
+        except KeyboardInterrupt:
+            print('sampling was stopped')
+        self.sampling_daemon.stop()
+        self.sampling_daemon.join()
+        logging.info('sampling was stopped')
+
+    def query_history(self) -> None:
+        # show what was using the most memory at a given time from the on disk archive
+        try:
+            when = Metrics_Archive.parse_time(self.args.Query)
+        except ValueError as e:
+            print(e)
+            return
+        archive = Metrics_Archive(self.args.ArchiveDir)
+        tier, processes = archive.snapshot_at(when)
+        if tier is None:
+            print(f'no samples were archived around {self.args.Query}')
+            return
+        names = archive.names_at(when)
+        system = processes.pop(0, {})
+        print(f'closest {tier} samples to {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when))}')
+        if system:
+            print(f'system cpu:{system.get("system.cpu", 0):.1f}% '
+                  f'memory:{bytes2human(system.get("system.memory", 0))} swap:{bytes2human(system.get("system.swap", 0))}')
+        top = sorted(processes.items(), key=lambda item: item[1].get('process.rss', 0), reverse=True)[:self.args.Top]
+        data = [[pid, names.get(pid, 'N/A'), bytes2human(metrics.get('process.rss', 0)),
+                 round(metrics.get('process.cpu', 0.0), 1)] for pid, metrics in top]
+        self.emit(self.draw_table(data, ["PID", "NAME", "MEMORY USAGE", "CPU_PERCENT(%)"]))
+
+    def current_rows(self, dynamic_fields=None) -> list:
+        if self.fleet_collector is not None:
+            return self.fleet_collector.get_rows()
+        # with the daemon running the latest tick is already in the store
+        if self.sampling_daemon is not None and self.sampling_daemon.is_alive():
+            return self.fill_fields(self.sampling_daemon.store.get_rows(), dynamic_fields)
+        if self.detail_sampler is not None:
+            # the expensive fields come from the detail sampler, not from every process
+            if not dynamic_fields:
+                return self.detail_sampler.sample(self.snapshot.refresh())
+            # a filter or record that names a detail field needs it for every process, not just the budgeted ones
+            complete = any(field in Detail_Sampler.fields for field in dynamic_fields)
+            dynamic_fields = tuple(sorted({field for field in dynamic_fields if field not in Detail_Sampler.fields}
+                                          | {'memory_info'}))
+            if 'cpu_percent' in dynamic_fields:
+                rows = self.cpu_sampler.sample(dynamic_fields=dynamic_fields)
+            else:
+                rows = self.snapshot.refresh(dynamic_fields=dynamic_fields)
+            return self.detail_sampler.sample(rows, complete=complete)
+        if dynamic_fields and 'cpu_percent' in dynamic_fields:
+            return self.cpu_sampler.sample(dynamic_fields=dynamic_fields)
+        return self.snapshot.refresh(dynamic_fields=dynamic_fields)
+
+    @staticmethod
+    def fill_fields(rows, dynamic_fields) -> list:
+        # the daemon's rows only carry what it reads every tick, a filter or record naming anything else
+        # gets it read here for every row instead of matching against a field that isn't there
+        missing = tuple(field for field in dynamic_fields or () if any(field not in row for row in rows))
+        if not missing:
+            return rows
+        now = time.time()
+        filled = []
+        for row in rows:
+            try:
+                proc = psutil.Process(row['pid'])
+                if row.get('create_time') is not None and proc.create_time() != row['create_time']:
+                    # the pid went to a different process since the daemon's tick
+                    continue
+                # the store's rows are shared with the daemon thread, so the values go on a copy
+                row = dict(row, **read_fields(proc, missing)[0])
+            except psutil.NoSuchProcess:
+                continue
+            except psutil.AccessDenied:
+                row = dict(row, **dict.fromkeys(missing))
+            if row.get('detail_time') is not None and any(field in Detail_Sampler.fields for field in missing):
+                # read just now, not when the detail sampler last got to it
+                row['detail_time'] = now
+            filled.append(row)
+        return filled
 
     @staticmethod
     # convert from bytes to readable size such as kb,mb,gb
@@ -97,79 +3571,339 @@ class Monitor:
             if name != 'percent':
                 value = bytes2human(value)
                 print('%-10s : %7s' % (name.capitalize(), value))
+    # output field -> psutil attribute that has to be read for it
+    record_attrs = {'rss': 'memory_info', 'cpu': 'cpu_percent', 'user': 'username', 'age': 'create_time',
+                    'uss': 'memory_full_info', 'pss': 'memory_full_info', 'fds': 'num_fds', 'threads': 'num_threads'}
+
+    def requested_fields(self, default) -> list:
+        fields = getattr(self.args, 'Fields', None)
+        if not fields:
+            return list(default)
+        return [field.strip() for field in fields.split(',') if field.strip()]
+
+    def process_attrs(self, fields, extra=()) -> set:
+        # only what the requested fields (and a filter) need gets read
+        attrs = {'name'} | set(extra)
+        for field in fields:
+            if field in ('pid', 'detail_age'):
+                continue
+            attr = self.record_attrs.get(field, field)
+            if attr not in psutil_attrs:
+                raise ValueError(f'unknown field {field}')
+            attrs.add(attr)
+        return attrs
+
+    @staticmethod
+    def process_record(row) -> dict:
+        record = dict(row)
+        record['rss'] = row['memory_info'].rss if row.get('memory_info') is not None else None
+        record['cpu'] = row.get('cpu_percent')
+        record['user'] = row.get('username')
+        if row.get('create_time') is not None:
+            record['age'] = round(time.time() - row['create_time'], 1)
+        full = row.get('memory_full_info')
+        record['uss'] = getattr(full, 'uss', None)
+        record['pss'] = getattr(full, 'pss', None)
+        record['fds'] = row.get('num_fds')
+        record['threads'] = row.get('num_threads')
+        age = Detail_Sampler.age(row)
+        record['detail_age'] = round(age, 1) if age is not None else None
+        return record
+
+    def stream_rows(self, attrs):
+        # the sampler's rows when it is running, one sampled interval when cpu is asked for,
+        # otherwise a single pass that never holds more than one process
+        if self.fleet_collector is not None:
+            return iter(self.fleet_collector.get_rows())
+        if self.sampling_daemon is not None and self.sampling_daemon.is_alive():
+            return iter(self.sampling_daemon.store.get_rows())
+        if self.detail_sampler is not None:
+            # the detail sampler keeps its values on the cached rows
+            return iter(self.current_rows(dynamic_fields=tuple(attrs - set(self.snapshot.static_fields))))
+        if 'cpu_percent' in attrs:
+            return iter(self.cpu_sampler.sample(dynamic_fields=tuple(attrs)))
+        return self.snapshot.stream(tuple(attrs))
+
+    def write_process_records(self, default_fields, process_filter=None) -> None:
+        fields = self.requested_fields(default_fields)
+        extra = ()
+        if process_filter is not None:
+            extra = process_filter.dynamic_fields + process_filter.static_fields
+        try:
+            attrs = self.process_attrs(fields, extra)
+        except ValueError as e:
+            print(e)
+            return
+        if self.fleet_collector is not None and 'host' not in fields:
+            fields = ['host'] + fields
+        writer = Record_Writer(self.args.Output, fields)
+        for row in self.stream_rows(attrs):
+            if process_filter is not None:
+                with instrumentation.phase('filter'):
+                    matched = process_filter.match(row)
+                if not matched:
+                    continue
+            writer.write(self.process_record(row))
+        writer.close()
+
+    @staticmethod
+    def rss_human(row) -> str:
+        # memory_info can be None when access to the process was denied
+        if row.get('memory_info') is None:
+            return 'N/A'
+        return bytes2human(row['memory_info'].rss)
+
     @staticmethod
     def draw_table(data, headers):  # draws a table to visualize the info being displayed to the user 
-        table = tabulate(data, headers=headers, tablefmt='fancy_grid',
-                         numalign='right')
+        from tabulate import tabulate
+        with instrumentation.phase('format'):
+            table = tabulate(data, headers=headers, tablefmt='fancy_grid',
+                             numalign='right')
         return table
 
+    @staticmethod
+    def emit(text) -> None:
+        with instrumentation.phase('emit'):
+            print(text)
+
+    # search for processes
+    def lookup(self, value, match='name') -> list:
+        # name, user and tree lookups come straight from the index,
+        # cmdline and regex only look at the cached command lines
+        if self.fleet_collector is not None or self.session_player is not None:
+            # the processes only exist in the replayed or collected frame, which gets an index of its own
+            # per host since pids repeat across hosts
+            hosts = {}
+            for row in self.current_rows():
+                rows, index = hosts.setdefault(row.get('host'), ({}, Process_Index()))
+                rows[row['pid']] = row
+                index.add(row)
+            found = []
+            for host in sorted(hosts, key=str):
+                matched = self.match_rows(*hosts[host], value, match)
+                if matched is None:
+                    return []
+                found += matched
+            return found
+        self.current_rows()
+        return self.match_rows(self.snapshot.rows, self.snapshot.index, value, match) or []
+
+    def match_rows(self, rows, index, value, match):
+        # rows is pid -> row and index the Process_Index over them, None when value or match is bad
+        if match == 'name':
+            pids = index.by_name(value)
+        elif match == 'user':
+            pids = index.by_user(value)
+        elif match == 'tree':
+            roots = self.tree_roots(value, index)
+            pids = set()
+            for root in roots:
+                if root in rows:
+                    pids.add(root)
+                pids.update(index.descendants(root))
+        elif match in ('cmdline', 'regex'):
+            try:
+                pattern = re.compile(value if match == 'regex' else re.escape(value))
+            except re.error as e:
+                print(f'bad regex {value}: {e}')
+                return None
+            pids = {pid for pid, row in list(rows.items())
+                    if row.get('cmdline') and pattern.search(' '.join(row['cmdline']))}
+        else:
+            print(f'unknown match type {match}')
+            return None
+        return [rows[pid] for pid in sorted(pids) if pid in rows]
+
+    def tree_roots(self, value, index=None) -> list:
+        # a pid or the name of the processes at the top of the trees
+        index = index if index is not None else self.snapshot.index
+        return [int(value)] if value.isdigit() else sorted(index.by_name(value))
+
+    @staticmethod
+    def still_in_tree(procs, roots) -> tuple:
+        # the parent index can be a tick old and a pid may have been reused since, so before anything
+        # is signalled each process has to still hang off a root through running processes
+        # returns the ones that do and the ones that were left out
+        by_pid = {proc.pid: proc for proc in procs}
+        children = {}
+        for proc in procs:
+            try:
+                if proc.is_running():
+                    children.setdefault(proc.ppid(), []).append(proc.pid)
+            except psutil.Error:
+                pass
+        kept = set()
+        queue = deque()
+        for root in roots:
+            if root == os.getpid() or (root in by_pid and by_pid[root].is_running()):
+                kept.add(root)
+                queue.append(root)
+        while queue:
+            for pid in children.get(queue.popleft(), ()):
+                if pid not in kept:
+                    kept.add(pid)
+                    queue.append(pid)
+        return [proc for proc in procs if proc.pid in kept], [proc for proc in procs if proc.pid not in kept]
+
     # search for processes
     def search_process(self) -> any:
         list_of_processes = []
-        for process in psutil.process_iter():
-            try:
-                if process.name() == self.args.Search:
-                    list_of_processes.append(process)
-                    logging.info(f'{args.Search} successfully found')
-                    print(f'found process {args.Search} with pid: {process.pid}\n'
-                          f'user:{process.username()}'
-                          f'status:{process.status()}')
-            except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
-                print(f'error in searching for process {args.Search} {e}')
-                logging.info(f'error in searching for process {args.Search} {e}')
+        match = getattr(self.args, 'Match', None) or 'name'
+        for row in self.lookup(self.args.Search, match):
+            list_of_processes.append(self.snapshot.get_process(row['pid']))
+            print(f'found process {row["name"]} with pid: {row["pid"]}'
+                  f'{" on " + row["host"] if row.get("host") else ""}\n'
+                  f'user:{row["username"]}'
+                  f'status:{row["status"]}')
+        if list_of_processes:
+            logging.info(f'{self.args.Search} successfully found {len(list_of_processes)} processes')
         return self.args.Search
 
    
     def list_all_processes(self) -> None:
         # list all process and return their pids,name and memory usage
-        while True:
-            data = []
-            headers = ["PID", "NAME", "MEMORY USAGE", "STATUS"]
-            try:
-                for proc in psutil.process_iter(['pid', 'name', 'memory_info', 'status']):
-                    # append all process to the data list
-                    data.append([proc.pid, proc.name(), bytes2human(proc.memory_info().rss), proc.status()])
-                try:
-                    # create a simple tabular display for processes
-                    # clears the terminal every time the table is printed to
-                    # simulate a live menu screen
-                    print("\033c", end='')
-                    table = self.draw_table(data, headers)
-                    print(table)
-                    time.sleep(2)
-                except KeyboardInterrupt:
-                    print(f'monitoring was stopped')
-                    logging.info(f'monitoring was stopped')
-            except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
-                print(f'could not list process {e}')
-                logging.error(f'could not list process {e}')
+        if getattr(self.args, 'Output', None):
+            self.write_process_records(['pid', 'name', 'rss', 'status'])
+            return
+        if not sys.stdout.isatty():
+            # nothing to redraw in a pipe, just print the table once
+            self.process_table()
+            return
+        try:
+            Live_View(self, refresh=getattr(self.args, 'Refresh', 2.0),
+                      sort=getattr(self.args, 'Sort', 'pid')).run()
+        except KeyboardInterrupt:
+            pass
+        print(f'monitoring was stopped')
+        logging.info(f'monitoring was stopped')
 
-    def kill_process(self):
-        # select the process you want to kill
-        for proc in psutil.process_iter():
+    def process_table(self) -> None:
+        # one snapshot of every process, as records when --Output is set
+        if getattr(self.args, 'Output', None):
+            self.write_process_records(['pid', 'name', 'rss', 'status'])
+            return
+        headers = ["PID", "NAME", "MEMORY USAGE", "STATUS"]
+        if self.detail_sampler is not None:
+            headers += ["USS", "PSS", "FDS", "THREADS"]
+        data = []
+        for row in self.current_rows():
+            line = [row['pid'], row['name'], self.rss_human(row), row['status']]
+            if self.detail_sampler is not None:
+                line += [Process_Filter.display(field, row) for field in ('uss', 'pss', 'fds', 'threads')]
+            data.append(line)
+        self.emit(self.draw_table(data, headers))
+
+    @staticmethod
+    def terminate_processes(procs, timeout=3.0) -> tuple:
+        # ask nicely with SIGTERM first, then SIGKILL whatever is still around after the timeout
+        # a pid we aren't allowed to signal is left out and returned in denied, the rest carry on
+        denied = []
+        signalled = []
+        for proc in procs:
             try:
-                if proc.name() == self.args.Kill:
-                    option = input('Are you sure you want to kill this process \n'
-                                   '1 -Yes\n'
-                                   '2-No\n')
-                    if option == '1':
-                        proc.kill()
-                        print(f'killed {self.args.Kill} successfully with the pid {proc.pid}')
-                        return
-                    else:
-                        print('Cancelled by user')
+                proc.terminate()
+                signalled.append(proc)
             except psutil.NoSuchProcess:
-                print(f'could not find process {self.args.Kill} error in terminating')
-                logging.error(f'could not find process {self.args.Kill} error in terminating')
+                signalled.append(proc)
+            except psutil.AccessDenied:
+                denied.append(proc)
+        gone, alive = psutil.wait_procs(signalled, timeout=timeout)
+        for proc in alive:
+            try:
+                proc.kill()
+            except psutil.NoSuchProcess:
+                pass
+            except psutil.AccessDenied:
+                denied.append(proc)
+        alive = [proc for proc in alive if proc not in denied]
+        killed, alive = psutil.wait_procs(alive, timeout=timeout)
+        return gone + killed, alive, denied
+
+    def kill_process(self):
+        # select every process that matches and kill them as one batch
+        if self.fleet_collector is not None or self.session_player is not None:
+            # the pids in a recording or from an agent aren't processes on this host
+            print('-K only kills processes on this host, it can not be used with -RP or -CO')
+            return
+        match = getattr(self.args, 'Match', None) or 'name'
+        rows = [row for row in self.lookup(self.args.Kill, match) if row['pid'] != os.getpid()]
+        if not rows:
+            print(f'could not find process {self.args.Kill} error in terminating')
+            logging.error(f'could not find process {self.args.Kill} error in terminating')
+            return
+        print(self.draw_table([[row['pid'], row['name'], row['username'], row['status']] for row in rows],
+                              ["PID", "NAME", "USER", "STATUS"]))
+        option = input(f'Are you sure you want to kill these {len(rows)} processes \n'
+                       '1 -Yes\n'
+                       '2-No\n')
+        if option != '1':
+            print('Cancelled by user')
+            return
+        procs = [self.snapshot.get_process(row['pid']) for row in rows]
+        procs = [proc for proc in procs if proc is not None]
+        names = {row['pid']: row['name'] for row in rows}
+        if match == 'tree':
+            procs, moved = self.still_in_tree(procs, self.tree_roots(self.args.Kill))
+            for proc in moved:
+                print(f'left out {names[proc.pid]} with the pid {proc.pid}, it is no longer under {self.args.Kill}')
+                logging.info(f'left out pid {proc.pid} while terminating {self.args.Kill}, it is no longer in the tree')
+        gone, alive, denied = self.terminate_processes(procs, timeout=getattr(self.args, 'KillTimeout', 3.0))
+        for proc in gone:
+            print(f'killed {names[proc.pid]} successfully with the pid {proc.pid}')
+        for proc in alive:
+            print(f'could not kill pid {proc.pid}')
+            logging.error(f'could not kill pid {proc.pid} while terminating {self.args.Kill}')
+        for proc in denied:
+            print(f'not allowed to kill {names[proc.pid]} with the pid {proc.pid}')
+            logging.error(f'access denied killing pid {proc.pid} while terminating {self.args.Kill}')
+        logging.info(f'killed {len(gone)} of {len(rows)} processes matching {self.args.Kill}')
 
-    def start_process(self) -> None:
-        # use sub process to create a particular process
+    def start_process(self, spec) -> bool:
+        # hand the program to the supervisor, which reads its output and reaps it
         try:
-            process = subprocess.Popen([self.args.Start], shell=True, stderr=subprocess.PIPE, text=True)
-            print(f'successfully started {self.args.Start} with PID:{process.pid}')
-        except subprocess.SubprocessError as e:
-            print(f'unable to start process {self.args.Start} : {e}')
-            logging.error(f'unable to start process {self.args.Start} : {e}')
+            program = Process_Supervisor.parse_program(spec)
+        except ValueError as e:
+            print(f'unable to start process {spec} : {e}')
+            logging.error(f'unable to start process {spec} : {e}')
+            return False
+        if self.process_supervisor is None:
+            self.process_supervisor = Process_Supervisor(getattr(self.args, 'KillTimeout', 3.0))
+            self.process_supervisor.start()
+        names = self.process_supervisor.add_program(program)
+        print(f'successfully started {", ".join(names)} ({program["cmd"]})')
+        return True
+
+    def supervise(self) -> None:
+        # start every -St/-SV program and show them every refresh until they are all done or ctrl+c
+        specs = ([self.args.Start] if self.args.Start else []) + (self.args.Supervise or [])
+        for spec in specs:
+            if not self.start_process(spec):
+                break
+        if self.process_supervisor is None:
+            return
+        headers = ["NAME", "PID", "STATE", "UPTIME(s)", "RESTARTS", "EXIT", "CPU_PERCENT(%)", "MEMORY USAGE",
+                   "OUTPUT", "LAST LINE"]
+        refresh = getattr(self.args, 'Refresh', 2.0)
+        try:
+            # the first refresh only primes cpu_percent
+            self.current_rows()
+            time.sleep(min(refresh, 0.5))
+            while True:
+                self.emit(self.draw_table(self.process_supervisor.summary(self.current_rows()), headers))
+                if not self.process_supervisor.active() or not self.process_supervisor.is_alive():
+                    break
+                time.sleep(refresh)
+        except KeyboardInterrupt:
+            print('stopping supervised programs')
+        self.process_supervisor.stop()
+        self.process_supervisor.join()
+        for child in self.process_supervisor.children:
+            lines = self.process_supervisor.tail(child['name'])
+            if lines:
+                print(f'last output of {child["name"]}:')
+                for _, stream, text in lines:
+                    print(f'  {stream} {text}')
+        logging.info('supervised programs were stopped')
 
     def check_memory_info(self):
         # print out the memory info in human-readable form
@@ -180,184 +3914,327 @@ class Monitor:
     
     def check_disk_info(self):
         # show all physical disk partitions available
+        # a mount that doesn't answer within --ProbeTimeout is shown as timed out instead of hanging
+        if getattr(self.args, 'Output', None):
+            writer = Record_Writer(self.args.Output, self.requested_fields(
+                ['device', 'mountpoint', 'fstype', 'total', 'used', 'free', 'percent', 'error']))
+            for part, usage, error in self.disk_probe.usage_all():
+                usage = usage._asdict() if usage is not None else {}
+                writer.write(dict(part._asdict(), error=error, **usage))
+            writer.close()
+            return
         data = []
-        headers = ['Device', 'Total Space', 'Used', 'free']
-        for part in psutil.disk_partitions(all=False):
-            usage = psutil.disk_usage(part.mountpoint)
-            data.append([part.device, bytes2human(usage.total),
+        headers = ['Device', 'Mountpoint', 'Total Space', 'Used', 'free']
+        for part, usage, error in self.disk_probe.usage_all():
+            if usage is None:
+                data.append([part.device, part.mountpoint, error, 'N/A', 'N/A'])
+                continue
+            data.append([part.device, part.mountpoint, bytes2human(usage.total),
                          bytes2human(usage.used),
                          bytes2human(usage.free)])
         table = self.draw_table(data, headers)
-        print(table)
+        self.emit(table)
+
+    def check_io(self) -> None:
+        # per disk throughput, iops and busy time and the processes doing the most i/o
+        snapshot = self.snapshot
+        if self.sampling_daemon is not None and self.sampling_daemon.is_alive():
+            # the daemon is refreshing the shared snapshot from its own thread
+            snapshot = Process_Snapshot(static_fields=('name',))
+        devices, processes = Io_Rates(snapshot, self.args.IO).sample()
+        processes = processes[:self.args.Top]
+        if getattr(self.args, 'Output', None):
+            writer = Record_Writer(self.args.Output, self.requested_fields(
+                ['type', 'name', 'pid', 'read_bytes', 'write_bytes', 'read_iops', 'write_iops', 'busy_percent']))
+            for device in devices:
+                writer.write(dict(device, type='device'))
+            for process in processes:
+                writer.write(dict(process, type='process'))
+            writer.close()
+            return
+        print(f'disk i/o over {self.args.IO}s')
+        headers = ['Device', 'Read/s', 'Write/s', 'Read IOPS', 'Write IOPS', 'Busy(%)']
+        data = [[device['name'], bytes2human(device['read_bytes']), bytes2human(device['write_bytes']),
+                 round(device['read_iops'], 1), round(device['write_iops'], 1),
+                 'N/A' if device['busy_percent'] is None else round(device['busy_percent'], 1)]
+                for device in devices]
+        self.emit(self.draw_table(data, headers))
+        headers = ['PID', 'NAME', 'Read/s', 'Write/s', 'Read IOPS', 'Write IOPS']
+        data = [[process['pid'], process['name'], bytes2human(process['read_bytes']),
+                 bytes2human(process['write_bytes']), round(process['read_iops'], 1),
+                 round(process['write_iops'], 1)] for process in processes]
+        self.emit(self.draw_table(data, headers))
+        logging.info(f'checked disk i/o of {len(devices)} devices over {self.args.IO}s')
+
+    def set_up_figure(self):
+        # matplotlib is only loaded the first time a graph is asked for
+        import matplotlib.pyplot as plt
+        if self.fig is None:
+            plt.style.use('Solarize_Light2')
+            self.fig, (self.ax_cpu, self.ax_memory) = plt.subplots(2, 1, figsize=(8, 8))
+            self.set_up_plot_cpu()
+            self.set_up_plot_memory_usage()
+        return plt
+
+    def x_axis(self, length) -> list:
+        # newest sample sits at 0, older samples go back in seconds
+        interval = self.graph_daemon.interval
+        return [(i - length + 1) * interval for i in range(length)]
 
     def set_up_plot_cpu(self) -> None:
         # create label,title and set the y-axis limit
         # crate grid so the graph is easier to look at
+        # the x-axis is fixed to the window so blitting never has to redraw the axes
         self.ax_cpu.set_xlabel('Seconds (s)')
         self.ax_cpu.set_ylabel('CPU Utilization (%)')
         self.ax_cpu.set_title('CPU')
         self.ax_cpu.set_ylim(0, 100)
+        self.ax_cpu.set_xlim(-(self.window - 1) * self.graph_daemon.interval, 0)
         self.ax_cpu.grid(True, linewidth=1)
+        if self.per_core:
+            for core in range(psutil.cpu_count() or 1):
+                line, = self.ax_cpu.plot([], [], linewidth=1, label=f'CPU {core}')
+                self.cpu_lines.append(line)
+        else:
+            line, = self.ax_cpu.plot([], [], color='b', linewidth=1, label='CPU utilization')
+            self.cpu_lines.append(line)
+        # display legend
+        self.ax_cpu.legend(loc='upper left', fontsize='small', ncol=4)
 
     def set_up_plot_memory_usage(self) -> None:
         # create label,title and set the yaxis limit
         self.ax_memory.set_xlabel('Seconds (s)')
         self.ax_memory.set_ylabel('Memory (GB)')
         self.ax_memory.set_title('Memory')
-        self.ax_memory.set_ylim(0, psutil.virtual_memory().total / (1024 * 1024 * 1024))  # max ram limit in gb
+        # max ram or swap limit in gb
+        limit = max(psutil.virtual_memory().total, psutil.swap_memory().total) / (1024 * 1024 * 1024)
+        self.ax_memory.set_ylim(0, limit)
+        self.ax_memory.set_xlim(-(self.window - 1) * self.graph_daemon.interval, 0)
         self.ax_memory.grid(True, linewidth=1)
+        self.memory_line, = self.ax_memory.plot([], [], color='g', linewidth=1, label='Memory Usage')
+        self.swap_line, = self.ax_memory.plot([], [], color='r', linewidth=1, label='Swap Usage')
+        self.ax_memory.legend(loc='upper left', fontsize='small')
 
-    def animate_memory_usage(self, frame) -> list:
-        # set the used memory to be converted from bytes to gb
-        used_mem = psutil.virtual_memory().used / (1024 * 1024 * 1024)  # current ram being used in gb
-        self.y_axis_memory.append(used_mem)
-        self.x_axis_memory.append(next(self.index))  # 1 second increment in the x-axis
-
-        line2 = self.ax_memory.plot(self.x_axis_memory, self.y_axis_memory, color='g', linewidth=1)
-
-        # display legend
-        self.ax_cpu.legend(['CPU utilization'])
-
-        # set_limit_size
-        size_limit = 20
-        self.x_axis_memory = self.x_axis_memory[-size_limit:]
-        self.y_axis_memory = self.y_axis_memory[-size_limit:]
-
-        # line object to be passed to the funcAnimation function
-        return line2
-
-    def animate_cpu(self, frame) -> list:
-
-        cpu_uti = psutil.cpu_percent(interval=1)
-        self.y_axis_cpu.append(cpu_uti)
-        self.x_axis_cpu.append(next(self.index))
-        # plot the line with the given info from cpu_util and the timer(1sec)
-        line = self.ax_cpu.plot(self.x_axis_cpu, self.y_axis_cpu, color='b', linewidth=1)
+    def init_plots(self) -> list:
+        # blank lines for the first blit
+        for line in self.cpu_lines + [self.memory_line, self.swap_line]:
+            line.set_data([], [])
+        return self.cpu_lines + [self.memory_line, self.swap_line]
 
-        self.ax_memory.legend(['Memory Usage'])  # display legend
+    def all_plots(self, frame) -> list:
+        with instrumentation.phase('render'):
+            return self.update_plots()
 
-        # set_limit_size
-        size_limit = 20
-        self.x_axis_cpu = self.x_axis_cpu[-size_limit:]
-        self.y_axis_cpu = self.y_axis_cpu[-size_limit:]
-
-        # line object to be passed to the funcAnimation function
-        return line
-
-    def all_plots(self, frame):
-        # combine both the plots of the cpu and memory so it can be rendered together
-        cpu_use = self.animate_cpu(frame)
-        memory_use = self.animate_memory_usage(frame)
-        return cpu_use + memory_use
+    def update_plots(self) -> list:
+        # update the existing lines in place from the sampler's store,
+        # nothing here touches psutil so the GUI never blocks
+        store = self.graph_daemon.store
+        if self.per_core:
+            for core, line in enumerate(self.cpu_lines):
+                values = store.values(f'system.cpu.{core}', self.window)
+                line.set_data(self.x_axis(len(values)), values)
+        else:
+            values = store.values('system.cpu', self.window)
+            self.cpu_lines[0].set_data(self.x_axis(len(values)), values)
+        # set the used memory to be converted from bytes to gb
+        for line, name in ((self.memory_line, 'system.memory'), (self.swap_line, 'system.swap')):
+            values = [value / (1024 * 1024 * 1024) for value in store.values(name, self.window)]
+            line.set_data(self.x_axis(len(values)), values)
+        # line objects to be passed to the funcAnimation function
+        return self.cpu_lines + [self.memory_line, self.swap_line]
 
     def start_animation_both(self):
         # animate both plots with a single FuncAnimation
         # set rendering interval to 500ms
-        ani = animation.FuncAnimation(self.fig, self.all_plots, interval=500)
+        import matplotlib.animation as animation
+        # share the -D sampler when it is running, otherwise sample just the system metrics
+        own_daemon = self.sampling_daemon is None or not self.sampling_daemon.is_alive()
+        if own_daemon:
+            self.graph_daemon = Sampling_Daemon(Metrics_Store(capacity=max(self.window, 1)),
+                                                interval=0.5, collect_processes=False)
+            self.graph_daemon.start()
+        else:
+            self.graph_daemon = self.sampling_daemon
+        plt = self.set_up_figure()
+        ani = animation.FuncAnimation(self.fig, self.all_plots, init_func=self.init_plots,
+                                      interval=500, blit=True, cache_frame_data=False)
         plt.tight_layout()
-        plt.show()
+        try:
+            plt.show()
+        finally:
+            if own_daemon:
+                self.graph_daemon.stop()
+            # the window is gone once closed, so build a fresh one next time
+            self.fig = None
+            self.cpu_lines = []
 
-    def filter(self):
-        # filter by actively running processes
-        if self.args.Filter == 'Filter Running':
-            running_filter = []
-            headers = ["PID", "NAME", "MEMORY USAGE", "STATUS"]
-            for p in psutil.process_iter(['name', 'status']):
-                if p.status() == psutil.STATUS_RUNNING:
-                    running_filter.append([p.pid, p.name(), p.status()])
-            table = self.draw_table(running_filter, headers)
-            print(table)
-
-        # filter by memory usage
-        elif self.args.Filter == 'Filter Memory Usage':
-            # set threshold
-            threshold = 100 * 1024 * 1024  # 100mb limit
-            mem_filter = []
-            headers = ["PID", "NAME", "MEMORY USAGE", "STATUS"]
-            for p in psutil.process_iter(['pid', 'name', 'memory_info']):
-                if p.memory_info().rss > threshold:
-                    mem_filter.append([p.pid, p.name(), bytes2human(p.memory_info().rss)])
-                    logging.info(
-                        f'pid:{p.pid} name:{p.name()} is using {bytes2human(p.memory_info().rss)} '
-                        f'which is more than the threshold:{bytes2human(threshold)}')
-            table = self.draw_table(mem_filter, headers)
-            print(table)
-
-        elif self.args.Filter == 'Filter Zombie':
-            zombie_filter = []
-            headers = ["PID", "NAME", "MEMORY USAGE", "STATUS"]
-            # filter by actively running processes
-            for p in psutil.process_iter(['pid', 'name', 'status']):
-                try:
-                    if p.status() == psutil.STATUS_ZOMBIE:
-                        zombie_filter.append([p.pid, p.name(), p.status()])
-                except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
-                    logging.error(f'an error occurred {e}')
-            table = self.draw_table(zombie_filter, headers)
-            print(table)
-
-        elif self.args.Filter == 'Filter Sleeping':
-            # filter by actively running processes
-            sleeping_filter = []
-            headers = ["PID", "NAME", "MEMORY USAGE", "STATUS"]
-            for p in psutil.process_iter(['pid', 'name', 'status']):
-                try:
-                    if p.status() == psutil.STATUS_SLEEPING:
-                        sleeping_filter.append([p.pid, p.name(), p.status()])
-                except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
-                    logging.error(f'an error occurred {e}')
+    # the old fixed filters are just named expressions now
+    legacy_filters = {
+        'Filter Running': 'status=running',
+        'Filter Memory Usage': 'rss>100M',  # 100mb limit
+        'Filter Zombie': 'status=zombie',
+        'Filter Sleeping': 'status=sleeping',
+    }
 
-            table = self.draw_table(sleeping_filter, headers)
-            print(table)
+    def filter_rows(self, process_filter) -> list:
+        # one snapshot refresh that only reads what the expression needs,
+        # then one streaming pass over it
+        rows = self.current_rows(dynamic_fields=process_filter.dynamic_fields)
+        with instrumentation.phase('filter'):
+            return list(process_filter.apply(rows))
 
-        elif self.args.Filter == 'Filter Cpu Usage':
-            cpu_filter = []
-            headers = ["PID", "NAME", "CPU_PERCENT(%)"]
+    def filter(self):
+        expression = self.args.Filter
+        if expression == 'Filter Cpu Usage':
+            # generally must process don't consume more than 10% while idle
+            # but under intense load it's a different case
             threshold = int(input('enter the threshold you wish to use: '))
-            for p in psutil.process_iter(['pid', 'name', 'cpu_percent']):
-                try:
-                    # generally must process don't consume more than 10% while idle
-                    # but under intense load it's a different case
-                    if p.cpu_percent() > threshold:
-                        cpu_filter.append([p.pid, p.name(), p.cpu_percent(interval=1)])
-                        logging.info(f'PID:{p.pid} NAME:{p.name()} has high cpu usage {p.cpu_percent(interval=1)}')
-                    else:
-                        # if no process surpasses the threshold the loop is terminated
-                        break
-                except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
-                    logging.error(f'an error occurred{e}')
-            table = self.draw_table(cpu_filter, headers)
-            print(table)
+            expression = f'cpu>{threshold}'
+        expression = self.legacy_filters.get(expression, expression)
+        try:
+            process_filter = Process_Filter(expression)
+        except ValueError as e:
+            print(f'invalid filter {expression}: {e}')
+            logging.error(f'invalid filter {expression}: {e}')
+            return
+        if getattr(self.args, 'Output', None):
+            self.write_process_records(['pid', 'name'] + process_filter.columns, process_filter)
+            return
+
+        headers = ["PID", "NAME"] + [Process_Filter.headers[field] for field in process_filter.columns]
+        fleet = self.fleet_collector is not None
+        if fleet:
+            headers.insert(0, "HOST")
+        data = []
+        for row in self.filter_rows(process_filter):
+            data.append(([row['host']] if fleet else []) + [row['pid'], row['name']] +
+                        [process_filter.display(field, row) for field in process_filter.columns])
+        # one line per call, use -AL for alerts on sustained breaches
+        logging.info(f'{len(data)} processes matched the filter:{expression}')
+        table = self.draw_table(data, headers)
+        self.emit(table)
+
+    def rollup_rows(self, mode, root=None, process_filter=None, rows=None) -> list:
+        # rows that were already read this round (an exporter scrape) are reused instead of walking /proc again
+        if rows is None:
+            dynamic_fields = Process_Rollup.dynamic_fields
+            if process_filter is not None:
+                dynamic_fields = tuple(sorted(set(dynamic_fields) | set(process_filter.dynamic_fields)))
+            rows = self.current_rows(dynamic_fields=dynamic_fields)
+        if self.process_rollup is None:
+            self.process_rollup = Process_Rollup()
+        self.process_rollup.forget(self.snapshot.exited_pids)
+        with instrumentation.phase('rollup'):
+            connections = Process_Rollup.connection_counts() if self.fleet_collector is None else None
+            return self.process_rollup.build(rows, mode, root, connections, process_filter)
+
+    def rollup(self) -> None:
+        # per tree, user or cgroup totals, only over the processes matching -F when it is given
+        mode = self.args.Rollup
+        if self.fleet_collector is not None and mode != 'user':
+            # pids and cgroups only mean something on their own host
+            print(f'only the user rollup works across a fleet, not {mode}')
+            return
+        process_filter = None
+        if self.args.Filter:
+            expression = self.legacy_filters.get(self.args.Filter, self.args.Filter)
+            try:
+                process_filter = Process_Filter(expression)
+            except ValueError as e:
+                print(f'invalid filter {expression}: {e}')
+                logging.error(f'invalid filter {expression}: {e}')
+                return
+        if mode == 'tree' and self.args.RollupRoot is not None and not self.args.RollupRoot.isdigit():
+            print(f'the tree rollup root has to be a pid, got {self.args.RollupRoot}')
+            return
+        groups = self.rollup_rows(mode, self.args.RollupRoot, process_filter)
+        key, reverse = Process_Rollup.sorts[getattr(self.args, 'Sort', None) or 'pid']
+        groups.sort(key=key, reverse=reverse)
+        if getattr(self.args, 'Output', None):
+            writer = Record_Writer(self.args.Output, self.requested_fields(Process_Rollup.fields))
+            for group in groups:
+                writer.write(group)
+            writer.close()
+            return
+        # a user drill down is grouped by process name
+        label = 'NAME' if mode == 'user' and self.args.RollupRoot else Process_Rollup.headers[mode]
+        headers = [label, "PROCS", "CPU_PERCENT(%)", "MEMORY USAGE", "THREADS", "FDS", "CONNS"]
+        data = [[group['group'], group['processes'], group['cpu'], bytes2human(group['rss']),
+                 'N/A' if group['threads'] is None else group['threads'],
+                 'N/A' if group['fds'] is None else group['fds'],
+                 'N/A' if group['connections'] is None else group['connections']] for group in groups]
+        self.emit(self.draw_table(data, headers))
+        logging.info(f'{mode} rollup of {sum(group["processes"] for group in groups)} processes '
+                     f'into {len(groups)} groups')
 
     # display process that have network connection
+    def connection_rows(self, connection_filter=None):
+        # one system wide net_connections() call joined to the cached pid->name/status map
+        # instead of scanning /proc/<pid>/fd once per process
+        if connection_filter is None:
+            connection_filter = Connection_Filter('')
+        rows = self.current_rows(dynamic_fields=('status',))
+        processes = {row['pid']: row for row in rows}
+        try:
+            with instrumentation.phase('enumerate'):
+                connections = psutil.net_connections(kind=connection_filter.kind)
+        except psutil.AccessDenied as e:
+            # some platforms don't allow the system wide call, so fall back to
+            # asking each process and skip the ones we are not allowed to see
+            logging.error(f'system wide connection table denied {e}, falling back to per process')
+            connections = []
+            unreadable = 0
+            for pid in list(self.snapshot.processes):
+                try:
+                    proc = self.snapshot.get_process(pid)
+                    if proc is None:
+                        continue
+                    for connection in proc.net_connections(kind=connection_filter.kind):
+                        connections.append(Connection_Filter.connection(*connection, pid))
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    unreadable += 1
+            if unreadable:
+                logging.error(f'could not read the connections of {unreadable} processes')
+        for connection in connections:
+            if not connection_filter.match(connection):
+                continue
+            process = processes.get(connection.pid, {})
+            yield connection, process
+
     def network(self):
-        # create protocol map to make the protocol being returned by
-        # connection type and connect family to be readable
-        proto_map = {
-            (AF_INET, SOCK_STREAM): 'TCP',
-            (AF_INET, SOCK_DGRAM): 'UDP',
-            (AF_INET6, SOCK_STREAM): 'TCP6',
-            (AF_INET6, SOCK_DGRAM): 'UDP6'
-        }
+        expression = getattr(self.args, 'Network', None) or ''
         try:
-            data = []
-            headers = ["PID", "NAME", "STATUS", "PROTOCOL", "LOCAL ADDRESS", "REMOTE ADDRESS "]
-            for proc in psutil.process_iter(['pid', 'name', 'status']):
-                connections = proc.connections()
-                for connection in connections:
-                    # check to see if the process is connecting to a remote address
-                    # if not return N/A
-                    if connection.raddr:
-                        remote_addr = connection.raddr
-                    else:
-                        remote_addr = 'N/A'
-                    data.append([proc.pid, proc.name(), proc.status(), proto_map[(connection.family, connection.type)],
-                                 connection.laddr, remote_addr])
-                    # show process information pid,name,status
-            table = self.draw_table(data, headers)
-            print(table)
-        except (psutil.AccessDenied, psutil.NoSuchProcess, psutil.Error) as e:
-            logging.error(f'an error occurred {e}')
+            connection_filter = Connection_Filter(expression)
+        except ValueError as e:
+            print(f'invalid connection filter {expression}: {e}')
+            logging.error(f'invalid connection filter {expression}: {e}')
+            return
+        if getattr(self.args, 'Output', None):
+            writer = Record_Writer(self.args.Output, self.requested_fields(
+                ['pid', 'name', 'status', 'proto', 'state', 'laddr', 'raddr']))
+            for connection, process in self.connection_rows(connection_filter):
+                writer.write({'pid': connection.pid, 'name': process.get('name'), 'status': process.get('status'),
+                              'proto': Connection_Filter.protocol(connection), 'state': connection.status,
+                              'fd': connection.fd, 'laddr': connection.laddr or None,
+                              'raddr': connection.raddr or None})
+            writer.close()
+            return
+        data = []
+        headers = ["PID", "NAME", "STATUS", "PROTOCOL", "STATE", "LOCAL ADDRESS", "REMOTE ADDRESS "]
+        for connection, process in self.connection_rows(connection_filter):
+            # check to see if the process is connecting to a remote address
+            # if not return N/A
+            if connection.raddr:
+                remote_addr = connection.raddr
+            else:
+                remote_addr = 'N/A'
+            # show process information pid,name,status
+            # connections we are not allowed to map to a process have no pid
+            data.append([connection.pid or 'N/A', process.get('name', 'N/A'), process.get('status', 'N/A'),
+                         Connection_Filter.protocol(connection), connection.status,
+                         connection.laddr or 'N/A', remote_addr])
+        table = self.draw_table(data, headers)
+        self.emit(table)
 
    
     def show_windows_services(self):
@@ -375,7 +4252,7 @@ class Monitor:
                 print(f'ERROR{e}')
 
         table = self.draw_table(data, headers)
-        print(table)
+        self.emit(table)
 
     
     def search_for_service(self):
@@ -389,7 +4266,7 @@ class Monitor:
                          service_info['status'], service_info['start_type'],
                          service_info['description'][:300]])  # to manage excess spaces on the table
             table = self.draw_table(data, headers)
-            print(table)
+            self.emit(table)
         except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
             print(f'error{e}')
 
@@ -411,7 +4288,8 @@ class Monitor:
                           f'7:Display cpu utilization/Memory usage\n'
                           f'8:Show Process network connections\n'
                           f'9:Show Disk usage\n'
-                          f'10:Exit\n'
+                          f'10:Schedule a task\n'
+                          f'11:Exit\n'
                           )
                     user = input('enter your option: ')
 
@@ -433,12 +4311,16 @@ class Monitor:
                               '2-Filter memory usage\n'
                               '3-Filter Zombie\n'
                               '4-Filter Sleeping\n'
-                              '5-Filter Cpu Usage\n')
+                              '5-Filter Cpu Usage\n'
+                              '6-Filter Expression\n')
 
                         filter_option: str = input('enter a filter option: ')
                         if filter_option in filter_options:
                             self.args.Filter = filter_options[filter_option]
                             self.filter()
+                        elif filter_option == '6':
+                            self.args.Filter = input('enter a filter expression e.g status=running,rss>100M: ')
+                            self.filter()
                         else:
                             print('nothing was selected or user chose an invalid input')
                             logging.info(f'The user did not choose any filter option'
@@ -446,17 +4328,18 @@ class Monitor:
 
                     elif user == '3':
                         Process_name: str = input('enter a Process to Start: ')
-                        self.args.Start = Process_name
-                        self.start_process()
+                        self.start_process(Process_name)
 
                     elif user == '4':
                         Process_name: str = input('enter a Process to Terminate: ')
                         self.args.Kill = Process_name
+                        self.args.Match = input('match by name/cmdline/regex/user/tree (default name): ') or 'name'
                         self.kill_process()
 
                     elif user == '5':
                         Process_name: str = input('enter a Process to search for: ')
                         self.args.Search = Process_name
+                        self.args.Match = input('match by name/cmdline/regex/user/tree (default name): ') or 'name'
                         self.search_process()
 
                     elif user == '6':
@@ -467,6 +4350,8 @@ class Monitor:
 
                     elif user == '8':
                         print('****show connections***')
+                        self.args.Network = input('enter a connection filter e.g proto=tcp,state=LISTEN '
+                                                  '(leave empty for all): ')
                         self.network()
 
                     elif user == '9':
@@ -474,6 +4359,11 @@ class Monitor:
                         self.check_disk_info()
 
                     elif user == '10':
+                        scheduler = Task_Scheduler(self, getattr(self.args, 'JobsFile', None))
+                        scheduler.load()
+                        scheduler.schedule()
+
+                    elif user == '11':
                         print('****Close Program***')
                         sys.exit(1)
 
@@ -484,114 +4374,529 @@ class Monitor:
                     print(f'{e}')
                     logging.info(f'{e}')
 
-#work in progress
-class Task_Scheduler:
-    def __init__(self, args):
-        self.args = args
+# runs monitor jobs (snapshots, filter reports, disk checks, programs and virus updates) on a timer
+# jobs sit in a min heap keyed on their next run and the thread sleeps until the first one is due,
+# adding or removing a job wakes it up so nothing is polled
+# job definitions are saved to a json file so they survive restarts
+class Task_Scheduler(threading.Thread):
+    actions = ('snapshot', 'filter', 'disk', 'memory', 'run_program', 'virus_updates')
+    # anything else in every= is a duration such as 30s, 5m, 2h or 1d
+    calendar = ('daily', 'weekly', 'monthly', 'once')
+    weekdays = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    # what happens to runs that were due while the scheduler wasn't running:
+    # skip them, run once to catch up or run every one that was missed (up to max_catch_up)
+    catch_up_policies = ('skip', 'once', 'all')
+    max_catch_up = 100
+    # wake up at least this often in case the wall clock jumped or the machine was suspended
+    max_sleep = 3600.0
 
-    #work in progress
-    def virus_updates(self):
-        pass
-    #work in o
-    def run_program(self):
-        #script
-        #exe
-        pass
+    def __init__(self, monitor, path=None) -> None:
+        super().__init__(daemon=True)
+        self.monitor = monitor
+        self.path = path or jobs_file
+        self.jobs = {}
+        self.heap = []  # (next run, name), entries that no longer match their job are skipped
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.children = []  # programs started by run_program that haven't been reaped
+        self.runs = 0
+
+    @classmethod
+    def parse_duration(cls, value) -> float:
+        # "30s", "5m", "2h", "1d" or plain seconds
+        match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*', value)
+        if match is None or float(match.group(1)) <= 0:
+            raise ValueError(f'could not read the interval {value}, use e.g 30s, 5m, 2h or 1d')
+        return float(match.group(1)) * cls.units[match.group(2) or 's']
+
+    @classmethod
+    def parse_job(cls, spec) -> dict:
+        # "name=hogs;action=filter;arg=rss>500M,cpu>50;every=5m;catch_up=skip"
+        # terms are separated by ; so filter expressions can keep their commas
+        job = {'description': '', 'arg': '', 'count': 1, 'at': '00:00', 'on': '', 'catch_up': 'once'}
+        for term in spec.split(';'):
+            if not term.strip():
+                continue
+            key, sep, value = term.partition('=')
+            key = key.strip().lower()
+            if not sep or key not in ('name', 'description', 'action', 'arg', 'every', 'count', 'at', 'on', 'catch_up'):
+                raise ValueError(f'{term} should look like key=value with key one of name, description, action, '
+                                 f'arg, every, count, at, on, catch_up')
+            job[key] = value.strip()
+        return cls.check_job(job)
+
+    @classmethod
+    def check_job(cls, job) -> dict:
+        if not job.get('name'):
+            raise ValueError('a job needs a name')
+        if job.get('action') not in cls.actions:
+            raise ValueError(f'unknown action {job.get("action")}, use one of {", ".join(cls.actions)}')
+        if job['action'] in ('filter', 'run_program') and not job['arg']:
+            raise ValueError(f'{job["action"]} needs arg= (a filter expression or a command)')
+        if job['action'] == 'filter':
+            expression = Monitor.legacy_filters.get(job['arg'], job['arg'])
+            Process_Filter(expression)
+        every = job.get('every', '').lower()
+        if not every:
+            raise ValueError('a job needs every= (daily, weekly, monthly, once or an interval like 5m)')
+        job['every'] = every
+        job['count'] = int(job['count'])
+        if job['count'] < 1:
+            raise ValueError('count has to be at least 1')
+        if every == 'once':
+            Metrics_Archive.parse_time(job['at'])
+        elif every in cls.calendar:
+            time.strptime(job['at'], '%H:%M')
+            if every == 'weekly':
+                job['on'] = (job['on'] or 'mon').lower()[:3]
+                if job['on'] not in cls.weekdays:
+                    raise ValueError(f'unknown weekday {job["on"]}, use one of {", ".join(cls.weekdays)}')
+            elif every == 'monthly':
+                job['on'] = str(job['on'] or 1)
+                if not 1 <= int(job['on']) <= 31:
+                    raise ValueError(f'day of month {job["on"]} has to be between 1 and 31')
+        else:
+            cls.parse_duration(every)
+        if job['catch_up'] not in cls.catch_up_policies:
+            raise ValueError(f'unknown catch up policy {job["catch_up"]}, use one of {", ".join(cls.catch_up_policies)}')
+        return job
 
     @staticmethod
-    def schedule():
-        list_of_current_schedules = {}
+    def at_time(day, at) -> float:
+        hour, minute = (int(part) for part in at.split(':'))
+        return datetime.datetime.combine(day, datetime.time(hour, minute)).timestamp()
+
+    @staticmethod
+    def add_months(day, months, on) -> datetime.date:
+        # the 31st runs on the last day of shorter months
+        month = day.month - 1 + months
+        year = day.year + month // 12
+        month = month % 12 + 1
+        return datetime.date(year, month, min(on, calendar.monthrange(year, month)[1]))
+
+    def first_run(self, job, now) -> float:
+        # the first time the job is due at or after now
+        every = job['every']
+        today = datetime.date.fromtimestamp(now)
+        if every == 'once':
+            return Metrics_Archive.parse_time(job['at'])
+        if every == 'daily':
+            when = self.at_time(today, job['at'])
+            return when if when >= now else self.at_time(today + datetime.timedelta(days=1), job['at'])
+        if every == 'weekly':
+            day = today + datetime.timedelta(days=(self.weekdays.index(job['on']) - today.weekday()) % 7)
+            when = self.at_time(day, job['at'])
+            return when if when >= now else self.at_time(day + datetime.timedelta(days=7), job['at'])
+        if every == 'monthly':
+            day = self.add_months(today, 0, int(job['on']))
+            when = self.at_time(day, job['at'])
+            return when if when >= now else self.at_time(self.add_months(today, 1, int(job['on'])), job['at'])
+        return now + self.parse_duration(every)
+
+    def following(self, job, last):
+        # the run after one that was due at last, None once a one time job has run
+        every = job['every']
+        day = datetime.date.fromtimestamp(last)
+        if every == 'once':
+            return None
+        if every == 'daily':
+            return self.at_time(day + datetime.timedelta(days=job['count']), job['at'])
+        if every == 'weekly':
+            return self.at_time(day + datetime.timedelta(weeks=job['count']), job['at'])
+        if every == 'monthly':
+            return self.at_time(self.add_months(day, job['count'], int(job['on'])), job['at'])
+        return last + self.parse_duration(every)
+
+    def missed(self, job, now) -> tuple:
+        # how many runs were due before now and when the next one after now is
+        due = job['next_run']
+        if job['every'] not in self.calendar:
+            # plain intervals can be worked out without stepping through every run
+            interval = self.parse_duration(job['every'])
+            count = int((now - due) // interval) + 1
+            return count, due + count * interval
+        count = 0
+        while due is not None and due <= now:
+            count += 1
+            due = self.following(job, due)
+        return count, due
+
+    def push(self, job) -> None:
+        if job['next_run'] is not None:
+            heapq.heappush(self.heap, (job['next_run'], job['name']))
+
+    def add_job(self, job, save=True) -> None:
+        with self.condition:
+            job.setdefault('last_run', None)
+            if job.get('next_run') is None:
+                job['next_run'] = self.first_run(job, time.time())
+            self.jobs[job['name']] = job
+            self.push(job)
+            if save:
+                self.save()
+            self.condition.notify()
+
+    def remove_job(self, name) -> bool:
+        with self.condition:
+            if self.jobs.pop(name, None) is None:
+                return False
+            # the heap entry is left behind and skipped when it comes up
+            self.save()
+            self.condition.notify()
+            return True
+
+    def load(self) -> None:
+        try:
+            with open(self.path) as saved:
+                jobs = json.load(saved)['jobs']
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f'could not read the scheduled jobs in {self.path}: {e}')
+            return
+        for job in jobs:
+            try:
+                self.add_job(self.check_job(job), save=False)
+            except (ValueError, KeyError) as e:
+                logging.error(f'skipping the scheduled job {job.get("name")}: {e}')
+
+    def save(self) -> None:
+        # written to a temporary file first so a crash never leaves half a file behind
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as saved:
+            json.dump({'jobs': list(self.jobs.values())}, saved, indent=2)
+        os.replace(temporary, self.path)
+
+    def catch_up(self, now) -> list:
+        # jobs that were due while nothing was running, applied once at startup
+        owed = []
+        for job in list(self.jobs.values()):
+            if job['next_run'] is None or job['next_run'] > now:
+                continue
+            count, next_run = self.missed(job, now)
+            if job['catch_up'] == 'once':
+                owed.append(job)
+            elif job['catch_up'] == 'all':
+                owed.extend([job] * min(count, self.max_catch_up))
+            logging.info(f'scheduled job {job["name"]} missed {count} runs, catch up policy {job["catch_up"]}')
+            job['next_run'] = next_run
+            self.push(job)
+        return owed
+
+    def due_jobs(self, now) -> list:
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            when, name = heapq.heappop(self.heap)
+            job = self.jobs.get(name)
+            # removed, replaced or rescheduled since this entry was pushed
+            if job is not None and job['next_run'] == when and all(job is not other for other in due):
+                due.append(job)
+        return due
+
+    def run_snapshot(self, job) -> None:
+        self.monitor.process_table()
+
+    def run_filter(self, job) -> None:
+        self.monitor.args.Filter = job['arg']
+        self.monitor.filter()
+
+    def run_disk(self, job) -> None:
+        self.monitor.check_disk_info()
+
+    def run_memory(self, job) -> None:
+        self.monitor.check_memory_info()
+
+    def run_program(self, job) -> None:
+        # started without a shell and not waited on, finished ones are reaped after every run
+        process = subprocess.Popen(shlex.split(job['arg']))
+        self.children.append(process)
+        print(f'scheduled job {job["name"]} started {job["arg"]} with PID:{process.pid}')
+        logging.info(f'scheduled job {job["name"]} started {job["arg"]} with PID:{process.pid}')
+
+    def virus_updates(self, job) -> None:
+        # the updater is whatever command the job was given, e.g freshclam
+        if not job['arg']:
+            print(f'scheduled job {job["name"]} has no virus update command set, use arg=')
+            logging.info(f'scheduled job {job["name"]} has no virus update command set')
+            return
+        self.run_program(job)
+
+    def execute(self, job) -> None:
+        logging.info(f'running scheduled job {job["name"]} ({job["action"]})')
+        action = getattr(self, job['action'] if job['action'] in ('run_program', 'virus_updates')
+                         else f'run_{job["action"]}')
+        try:
+            action(job)
+        except (psutil.Error, OSError, ValueError, subprocess.SubprocessError) as e:
+            print(f'scheduled job {job["name"]} failed: {e}')
+            logging.error(f'scheduled job {job["name"]} failed: {e}')
+        except Exception as e:
+            # anything else is a bug in one job, it must not take the later jobs down with it
+            print(f'scheduled job {job["name"]} failed: {e}')
+            logging.exception(f'scheduled job {job["name"]} failed')
+        job['last_run'] = time.time()
+        self.runs += 1
+
+    def reschedule(self, job, now) -> None:
+        # the run after the one that was due, skipping any that already went by while it ran
+        if self.jobs.get(job['name']) is not job:
+            return
+        next_run = self.following(job, job['next_run'])
+        if next_run is not None and next_run <= now:
+            next_run = self.missed(dict(job, next_run=next_run), now)[1]
+        job['next_run'] = next_run
+        self.push(job)
+
+    def drop_finished(self) -> None:
+        # one time jobs that have run
+        for name in [name for name, job in self.jobs.items() if job['next_run'] is None]:
+            del self.jobs[name]
+
+    def run(self) -> None:
+        with self.condition:
+            owed = self.catch_up(time.time())
+        for job in owed:
+            self.execute(job)
+        with self.condition:
+            self.drop_finished()
+            self.save()
+        while True:
+            with self.condition:
+                # sleep until the first job is due, add_job/remove_job/stop wake this up early
+                while not self.stopped:
+                    wait = self.max_sleep
+                    if self.heap:
+                        wait = min(wait, self.heap[0][0] - time.time())
+                    if wait <= 0:
+                        break
+                    self.condition.wait(wait)
+                if self.stopped:
+                    break
+                due = self.due_jobs(time.time())
+            for job in due:
+                self.execute(job)
+            self.children = [child for child in self.children if child.poll() is None]
+            with self.condition:
+                now = time.time()
+                for job in due:
+                    self.reschedule(job, now)
+                self.drop_finished()
+                self.save()
+
+    def stop(self) -> None:
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
 
+    def list_jobs(self) -> None:
+        def when(timestamp):
+            return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)) if timestamp else 'N/A'
+        headers = ["NAME", "ACTION", "ARG", "EVERY", "NEXT RUN", "LAST RUN", "CATCH UP", "DESCRIPTION"]
+        data = []
+        for job in sorted(self.jobs.values(), key=lambda job: job['next_run'] or 0):
+            every = job['every']
+            if every in ('daily', 'weekly', 'monthly'):
+                every = f'{every} x{job["count"]} at {job["at"]}' + (f' on {job["on"]}' if job['on'] else '')
+            data.append([job['name'], job['action'], job['arg'], every, when(job['next_run']),
+                         when(job['last_run']), job['catch_up'], job['description']])
+        Monitor.emit(Monitor.draw_table(data, headers))
+
+    def wait(self) -> None:
+        print(f'running {len(self.jobs)} scheduled jobs from {self.path}, press ctrl+c to stop')
+        try:
+            while self.is_alive():
+                self.join(timeout=self.max_sleep)
+        except KeyboardInterrupt:
+            print('scheduler was stopped')
+        self.stop()
+        self.join()
+        logging.info('scheduler was stopped')
+
+    def schedule(self) -> None:
         # get username and description of task
         name: str = input('what do you want to name this task: ')
         description: str = input('what is the description of the task: ')
         # specifying the time and occurrence of when to run the task
         date_map = {
             "1": "daily",
-            "2": "Weekly",
-            "3": "Monthly",
-            "4": "One Time",
+            "2": "weekly",
+            "3": "monthly",
+            "4": "once",
+            "5": "interval",
         }
         print(f'options:\n {list(date_map.items())}')
         options: str = input('Enter an option:')
-        if options in date_map:
-            schedule_time = date_map[options]
-            # yes this is not optimal will change later
-            if schedule_time == 'daily':
-                frequency: int = int(input("Enter the interval frequency you want: "))
-                # TIME must be in 24-hour format
-                TIME: str = input("Enter the time you want to use: ")
-                schedule.every(frequency).day.at(TIME).do()
-                list_of_current_schedules[name]={
-                    'name': name,
-                    'description': description,
-                    'schedule_type': frequency,
-                    'scheduled_time': TIME,
-                }
-            elif schedule_time == 'weekly':
-                # how often you want to run it weekly
-                frequency: int = int(input("Enter the interval frequency you want: "))
-                # TIME must be in 24-hour format
-                TIME: str = input("Enter the time you want to use: ")
-                schedule.every(frequency).weeks.at(TIME).do()
-                list_of_current_schedules[name] = {
-                    'name': name,
-                    'description': description,
-                    'schedule_type': frequency,
-                    'scheduled_time': TIME,
-                }
-            elif schedule_time == 'Monthly':
-                # same as above but you just want to use > 4 for the frequency
-                # alongside multiple of 4 i.e 4=1 month,8=2 month
-                frequency: int = int(input("Enter the interval frequency you want: "))
-                # TIME must be in 24-hour format
-                TIME: str = input("Enter the time you want to use: ")
-                schedule.every(frequency).weeks.at(TIME).do()
-                list_of_current_schedules[name] = {
-                    'name': name,
-                    'description': description,
-                    'schedule_type': frequency,
-                    'scheduled_time': TIME,
-                }
-            elif schedule_time == 'One Time':
-                frequency: int = int(input("Enter the interval frequency you want: "))
-                # TIME must be in 24-hour format
-                TIME: str = input("Enter the time you want to use: ")
-                schedule.every(frequency).day.at(TIME).do()
-                list_of_current_schedules[name] = {
-                    'name': name,
-                    'description': description,
-                    'schedule_type': frequency,
-                    'scheduled_time': TIME,
-                }
-            else:
-                print('Invalid Options')
+        if options not in date_map:
+            print('Invalid Options')
+            return
+        job = {'name': name, 'description': description, 'every': date_map[options]}
+        if job['every'] == 'interval':
+            job['every'] = input('Enter the interval e.g 30s, 5m, 2h: ')
+        elif job['every'] == 'once':
+            job['at'] = input('Enter the date and time e.g 2024-01-31 14:00: ')
+        else:
+            job['count'] = input('Enter the interval frequency you want (default 1): ') or 1
+            # TIME must be in 24-hour format
+            job['at'] = input('Enter the time you want to use e.g 09:30: ')
+            if job['every'] == 'weekly':
+                job['on'] = input('Enter the weekday e.g mon: ')
+            elif job['every'] == 'monthly':
+                job['on'] = input('Enter the day of the month (1-31): ')
 
         # what action should be performed
         action_map = {
-            "1": "Run Program",
-            "2": "Perform Virus check"
+            "1": "snapshot",
+            "2": "filter",
+            "3": "disk",
+            "4": "memory",
+            "5": "run_program",
+            "6": "virus_updates",
         }
-        # path to the program to be executed or run
+        print(f'actions:\n {list(action_map.items())}')
+        job['action'] = action_map.get(input('Enter an action:'))
+        if job['action'] == 'filter':
+            job['arg'] = input('enter a filter expression e.g status=running,rss>100M: ')
+        elif job['action'] in ('run_program', 'virus_updates'):
+            # path to the program to be executed or run
+            job['arg'] = input('enter the command to run: ')
+        job['catch_up'] = input(f'what to do with missed runs {"/".join(self.catch_up_policies)} (default once): ') or 'once'
+        try:
+            job = self.check_job(dict({'arg': '', 'count': 1, 'at': '00:00', 'on': ''}, **job))
+        except ValueError as e:
+            print(f'invalid task {name}: {e}')
+            logging.error(f'invalid task {name}: {e}')
+            return
         # save the info to a file to keep track
+        self.add_job(job)
+        print(f'task {name} was scheduled, next run {time.ctime(job["next_run"])}')
+        logging.info(f'task {name} was scheduled')
+
+
+def stop_on_signal(signum, frame):
+    raise SystemExit(128 + signum)
 
 
 def main():
+    args = build_parser().parse_args()
+    try:
+        setup_logging(args.LogFormat, Process_Filter.parse_number('rss', args.LogSize),
+                      Task_Scheduler.parse_duration(args.LogRotate), args.LogBackups)
+    except ValueError as e:
+        print(f'invalid log size {args.LogSize} or rotation {args.LogRotate}: {e}')
+        return
+    if args.Stats:
+        instrumentation.enable()
+    profiler = None
+    if args.Profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
     monitor = Monitor(args)
+    # kill and systemctl stop send SIGTERM and a closed terminal SIGHUP, both unwind through the finally
+    # below like an error would so supervised children, the daemon and the pools are stopped, not orphaned
+    for name in ('SIGTERM', 'SIGHUP'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), stop_on_signal)
+    try:
+        run_command(monitor, args)
+    except BrokenPipeError:
+        # the reader (head, jq ...) went away, stop quietly like other unix tools
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        # worker pools have to go before the interpreter starts shutting down
+        monitor.close()
+        # stats go to stderr so they never end up in --output streams
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.Profile)
+            print(f'profile written to {args.Profile}', file=sys.stderr)
+        if args.Stats:
+            print(instrumentation.summary(), file=sys.stderr)
+
+
+def run_command(monitor, args):
+    # the first option given names the command in --stats
+    instrumentation.command = next((name.lower() for name in (
+        'Agent', 'Collector', 'Replay', 'Record', 'Monitor', 'Rollup', 'List', 'Filter', 'Network', 'Memory', 'Disk', 'IO', 'Start', 'Supervise', 'Search', 'Graph', 'Kill',
+        'Query', 'Exporter', 'Schedule', 'AddJob', 'RemoveJob', 'Jobs', 'Alert', 'Daemon', 'Archive') if getattr(args, name) not in (None, False)), 'none')
+    if args.Agent:
+        try:
+            agent = Fleet_Agent(monitor, args.Agent, args.AgentName, args.Refresh)
+        except ValueError as e:
+            print(e)
+            return
+        agent.run()
+        return
+    if args.Collector:
+        try:
+            monitor.start_collector(args.Collector)
+        except (ValueError, OSError) as e:
+            print(f'could not start the collector on {args.Collector}: {e}')
+            logging.error(f'could not start the collector on {args.Collector}: {e}')
+            return
+    if args.Replay:
+        try:
+            if args.ReplayFrom and args.ReplayFrom.startswith('+'):
+                with open(f'{args.Replay}.idx', 'rb') as index:
+                    first = Session_Recorder.index_record.unpack(index.read(Session_Recorder.index_record.size))[0]
+                args.ReplayFrom = first + Task_Scheduler.parse_duration(args.ReplayFrom[1:])
+            elif args.ReplayFrom:
+                args.ReplayFrom = Metrics_Archive.parse_time(args.ReplayFrom)
+            monitor.start_replay(args.Replay)
+        except (OSError, ValueError, struct.error) as e:
+            print(f'could not replay {args.Replay}: {e}')
+            logging.error(f'could not replay {args.Replay}: {e}')
+            return
+    elif args.Daemon or args.Archive or args.Alert or args.Record:
+        archive = None
+        alerts = None
+        recorder = None
+        if args.Archive:
+            try:
+                archive = Metrics_Archive(args.ArchiveDir, Metrics_Archive.parse_retention(args.Retention))
+            except ValueError as e:
+                print(f'invalid retention {args.Retention}: {e}')
+                return
+        if args.Alert:
+            try:
+                alerts = Alert_Engine(args.Alert, args.AlertOutput, args.ProbeTimeout)
+            except ValueError as e:
+                print(f'invalid alert: {e}')
+                logging.error(f'invalid alert: {e}')
+                return
+        if args.Record:
+            recorder = Session_Recorder(args.Record, args.Daemon or 1.0)
+        monitor.start_sampling(args.Daemon or 1.0, archive, alerts, recorder)
 
     # if no args are provided aside from -MON
     if args.Monitor:
         monitor.loop()
     # other arguments
     else:
-        if args.Filter:
+        if args.Rollup and not args.Exporter:
+            monitor.rollup()
+
+        elif args.List:
+            monitor.list_all_processes()
+
+        elif args.Filter:
             monitor.filter()
 
+        elif args.Network is not None:
+            monitor.network()
+
         elif args.Memory:
             monitor.check_memory_info()
 
-        elif args.Start:
-            monitor.start_process()
+        elif args.Disk:
+            monitor.check_disk_info()
+
+        elif args.IO:
+            monitor.check_io()
+
+        elif args.Start or args.Supervise:
+            monitor.supervise()
 
         elif args.Search:
             monitor.search_process()
@@ -602,11 +4907,56 @@ def main():
         elif args.Kill:
             monitor.kill_process()
 
+        elif args.Query:
+            monitor.query_history()
+
+        elif args.Exporter:
+            Metrics_Exporter(monitor, max_age=args.MaxAge, top=args.Top,
+                             top_by=args.TopBy).serve(args.ExporterAddress, args.Exporter)
+
+        elif args.Schedule or args.AddJob or args.RemoveJob or args.Jobs:
+            run_scheduler(monitor, args)
+
+        elif args.Replay:
+            monitor.replay_summary()
+
+        elif args.Daemon or args.Archive or args.Alert or args.Record:
+            monitor.wait_for_sampler()
+
+        elif args.Collector:
+            monitor.show_fleet()
+
         else:
             print('no arguments were passed please select an argument\n'
                   'please use the -h for more assistance')
 
 
+def run_scheduler(monitor, args):
+    scheduler = Task_Scheduler(monitor, args.JobsFile)
+    scheduler.load()
+    if args.AddJob:
+        try:
+            job = scheduler.parse_job(args.AddJob)
+        except ValueError as e:
+            print(f'invalid job {args.AddJob}: {e}')
+            logging.error(f'invalid job {args.AddJob}: {e}')
+            return
+        scheduler.add_job(job)
+        print(f'job {job["name"]} was scheduled, next run {time.ctime(job["next_run"])}')
+        logging.info(f'job {job["name"]} was scheduled')
+    elif args.RemoveJob:
+        if scheduler.remove_job(args.RemoveJob):
+            print(f'job {args.RemoveJob} was removed')
+            logging.info(f'job {args.RemoveJob} was removed')
+        else:
+            print(f'there is no scheduled job called {args.RemoveJob}')
+    elif args.Jobs:
+        scheduler.list_jobs()
+    else:
+        scheduler.start()
+        scheduler.wait()
+
+
 if __name__ == '__main__':
     main()
 '''
@@ -0,0 +1,294 @@
+import os
+import sys
+import io
+import json
+import time
+import signal
+import socket
+import argparse
+import resource
+import statistics
+import subprocess
+import contextlib
+import multiprocessing
+import Process
+
+# spawns a fleet of dummy processes and times every Monitor command against it
+# results are saved as json so two runs can be compared for regressions
+# linux only, the fleet is made with fork()
+
+process_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Process.py')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parse = argparse.ArgumentParser(description='benchmark the process monitor against a fleet of dummy processes')
+    parse.add_argument('-N', '--Sizes', type=str, default='100,1000,10000',
+                       help='comma separated fleet sizes to run, e.g "100,1000,10000"')
+    parse.add_argument('-R', '--Repeat', type=int, default=5, help='how many times each command is timed')
+    parse.add_argument('-B', '--Burners', type=int, default=os.cpu_count() or 1,
+                       help='most cpu burning dummies in a fleet, so the box stays usable')
+    parse.add_argument('-C', '--Commands', type=str,
+                       help='comma separated subset of commands to run, default all')
+    parse.add_argument('-O', '--Output', type=str, default='benchmark_results.json',
+                       help='file the results are written to')
+    parse.add_argument('-CMP', '--Compare', type=str, help='earlier results to compare against')
+    parse.add_argument('-TH', '--Threshold', type=float, default=1.2,
+                       help='p50 ratio over the earlier results that counts as a regression')
+    return parse
+
+
+def run_dummy(kind) -> None:
+    # runs in the forked child and never returns
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if kind == 'burner':
+            while True:
+                pass
+        elif kind == 'socket':
+            # a listening tcp socket and a connected unix pair
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.bind(('127.0.0.1', 0))
+            listener.listen()
+            # unpacked so both ends stay referenced and open
+            left, right = socket.socketpair()
+            while True:
+                time.sleep(3600)
+        elif kind == 'zombie_parent':
+            # children exit straight away and are never waited on, so they stay zombies
+            # until this process is told to stop
+            def reap(signum, frame):
+                with contextlib.suppress(ChildProcessError):
+                    while os.waitpid(-1, 0):
+                        pass
+                os._exit(0)
+            signal.signal(signal.SIGTERM, reap)
+            for _ in range(int(os.environ.get('BENCH_ZOMBIES', '0'))):
+                if os.fork() == 0:
+                    os._exit(0)
+            while True:
+                time.sleep(3600)
+        else:
+            while True:
+                time.sleep(3600)
+    finally:
+        os._exit(0)
+
+
+def spawn_fleet(size, burners) -> dict:
+    # roughly 70% sleepers, 10% socket holders, 10% zombies and up to 10% cpu burners
+    zombies = size // 10
+    sockets = size // 10
+    burn = min(burners, size // 10)
+    sleepers = max(0, size - zombies - sockets - burn - 1)
+    fleet = {'sleeper': [], 'burner': [], 'socket': [], 'zombie_parent': []}
+    os.environ['BENCH_ZOMBIES'] = str(zombies)
+    for kind, count in (('sleeper', sleepers), ('burner', burn), ('socket', sockets), ('zombie_parent', 1)):
+        for _ in range(count):
+            pid = os.fork()
+            if pid == 0:
+                run_dummy(kind)
+            fleet[kind].append(pid)
+    # give the zombie parent a moment to fork its children
+    time.sleep(0.5 + size / 5000)
+    return fleet
+
+
+def stop_fleet(fleet) -> None:
+    # the zombie parent reaps its children on SIGTERM, everything else just gets killed
+    for pid in fleet['zombie_parent']:
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGTERM)
+    for kind, pids in fleet.items():
+        if kind == 'zombie_parent':
+            continue
+        for pid in pids:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGKILL)
+    for pids in fleet.values():
+        for pid in pids:
+            with contextlib.suppress(ChildProcessError):
+                os.waitpid(pid, 0)
+
+
+def rw_syscall_count():
+    # read and write family syscalls made so far (syscr + syscw), None where /proc/self/io isn't there
+    # open, stat and getdents don't show up here, for those run the benchmark under strace -c -f
+    try:
+        with open('/proc/self/io') as stats:
+            counters = dict(line.split(': ') for line in stats.read().splitlines())
+        return int(counters['syscr']) + int(counters['syscw'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def set_filter(expression):
+    def run(monitor):
+        monitor.args.Filter = expression
+        monitor.filter()
+    return run
+
+
+def set_search(name):
+    def run(monitor):
+        monitor.args.Search = name
+        monitor.search_process()
+    return run
+
+
+def snapshot_tick(monitor):
+    # a warm tick, the first refresh filled the cache outside of the timing
+    monitor.snapshot.refresh()
+
+
+# name -> (call to time, setup run on the monitor before timing)
+commands = {
+    'list': (lambda monitor: monitor.list_all_processes(), None),
+    'snapshot_tick': (snapshot_tick, lambda monitor: monitor.snapshot.refresh()),
+    'filter_running': (set_filter('Filter Running'), None),
+    'filter_memory': (set_filter('Filter Memory Usage'), None),
+    'filter_zombie': (set_filter('Filter Zombie'), None),
+    'filter_sleeping': (set_filter('Filter Sleeping'), None),
+    'filter_cpu': (set_filter('cpu>50'), None),
+    'network': (lambda monitor: monitor.network(), None),
+    'search': (set_search('python'), None),
+    'disk': (lambda monitor: monitor.check_disk_info(), None),
+}
+
+
+def time_command(name, repeat, results) -> None:
+    # runs in its own process so peak rss belongs to this command alone
+    call, setup = commands[name]
+    args = Process.build_parser().parse_args([])
+    timings = []
+    rw_syscalls = []
+    for _ in range(repeat):
+        # a fresh monitor per run, the same as a fresh cli call
+        monitor = Process.Monitor(args)
+        if setup is not None:
+            setup(monitor)
+        before = rw_syscall_count()
+        start = time.perf_counter()
+        # table output goes to a buffer so formatting is counted but the terminal isn't
+        with contextlib.redirect_stdout(io.StringIO()):
+            call(monitor)
+        timings.append(time.perf_counter() - start)
+        after = rw_syscall_count()
+        if before is not None and after is not None:
+            rw_syscalls.append(after - before)
+        monitor.close()
+    results.put({'timings': timings, 'rw_syscalls': rw_syscalls,
+                 'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024})
+
+
+def time_startup(repeat) -> dict:
+    # cold start of a one shot command in a new interpreter
+    timings = []
+    peak = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        child = subprocess.Popen([sys.executable, process_script, '-M'], stdout=subprocess.DEVNULL)
+        _, _, usage = os.wait4(child.pid, 0)
+        timings.append(time.perf_counter() - start)
+        peak = max(peak, usage.ru_maxrss * 1024)
+    return {'timings': timings, 'rw_syscalls': [], 'peak_rss': peak}
+
+
+def summarize(measurement) -> dict:
+    timings = sorted(measurement['timings'])
+    if len(timings) > 1:
+        cuts = statistics.quantiles(timings, n=100, method='inclusive')
+        p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+    else:
+        p50 = p90 = p99 = timings[0]
+    return {
+        'p50': p50, 'p90': p90, 'p99': p99,
+        'mean': statistics.fmean(timings), 'max': timings[-1],
+        'rw_syscalls': statistics.median(measurement['rw_syscalls']) if measurement['rw_syscalls'] else None,
+        'peak_rss': measurement['peak_rss'],
+        'runs': len(timings),
+    }
+
+
+def run_size(size, names, repeat, burners) -> dict:
+    fleet = spawn_fleet(size, burners)
+    results = {}
+    try:
+        context = multiprocessing.get_context('fork')
+        for name in names:
+            if name == 'startup':
+                results[name] = summarize(time_startup(repeat))
+            else:
+                queue = context.Queue()
+                worker = context.Process(target=time_command, args=(name, repeat, queue))
+                worker.start()
+                measurement = queue.get()
+                worker.join()
+                results[name] = summarize(measurement)
+            print(f'N={size} {name}: p50 {results[name]["p50"] * 1000:.1f}ms '
+                  f'p99 {results[name]["p99"] * 1000:.1f}ms', flush=True)
+    finally:
+        stop_fleet(fleet)
+    return results
+
+
+def compare(current, baseline, threshold) -> list:
+    # (size, command, old p50, new p50) for everything that got slower than the threshold
+    regressions = []
+    for size, results in current['results'].items():
+        for name, summary in results.items():
+            old = baseline.get('results', {}).get(size, {}).get(name)
+            if old and old['p50'] > 0 and summary['p50'] / old['p50'] > threshold:
+                regressions.append((size, name, old['p50'], summary['p50']))
+    return regressions
+
+
+def main():
+    args = build_parser().parse_args()
+    if not hasattr(os, 'fork'):
+        print('the benchmark needs fork(), run it on linux')
+        return 1
+    Process.setup_logging()
+    names = list(commands) + ['startup']
+    if args.Commands:
+        names = [name.strip() for name in args.Commands.split(',')]
+        unknown = [name for name in names if name not in commands and name != 'startup']
+        if unknown:
+            print(f'unknown commands {", ".join(unknown)}, use {", ".join(list(commands) + ["startup"])}')
+            return 1
+    sizes = [int(size) for size in args.Sizes.split(',')]
+
+    report = {
+        'created': time.time(),
+        'python': sys.version.split()[0],
+        'psutil': Process.psutil.__version__,
+        'cpu_count': os.cpu_count(),
+        'repeat': args.Repeat,
+        'results': {},
+    }
+    for size in sizes:
+        report['results'][str(size)] = run_size(size, names, args.Repeat, args.Burners)
+    with open(args.Output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(f'results written to {args.Output}')
+
+    rows = []
+    for size, results in report['results'].items():
+        for name, summary in results.items():
+            rows.append([size, name, f'{summary["p50"] * 1000:.1f}', f'{summary["p90"] * 1000:.1f}',
+                         f'{summary["p99"] * 1000:.1f}', summary['rw_syscalls'] if summary['rw_syscalls'] is not None else 'N/A',
+                         Process.bytes2human(summary['peak_rss'])])
+    print(Process.Monitor.draw_table(rows, ['N', 'COMMAND', 'P50 (ms)', 'P90 (ms)', 'P99 (ms)', 'R/W SYSCALLS', 'PEAK RSS']))
+
+    if args.Compare:
+        with open(args.Compare) as earlier:
+            regressions = compare(report, json.load(earlier), args.Threshold)
+        for size, name, old, new in regressions:
+            print(f'regression N={size} {name}: p50 {old * 1000:.1f}ms -> {new * 1000:.1f}ms')
+        if regressions:
+            return 1
+        print(f'no regressions over {args.Threshold}x against {args.Compare}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+import unittest
+
+from Process import Alert_Rule
+
+
+class Alert_Rule_Test(unittest.TestCase):
+    def test_fires_once_sustained(self):
+        rule = Alert_Rule('cpu>50;for=10s')
+        self.assertEqual(rule.observe(1, 0, 60.0), (None, 60.0))
+        self.assertEqual(rule.observe(1, 5, 60.0)[0], None)
+        self.assertEqual(rule.observe(1, 10, 60.0)[0], 'firing')
+        # still breached, nothing new to say
+        self.assertEqual(rule.observe(1, 11, 70.0)[0], None)
+
+    def test_a_dip_starts_the_wait_over(self):
+        rule = Alert_Rule('cpu>50;for=10s')
+        rule.observe(1, 0, 60.0)
+        rule.observe(1, 5, 40.0)
+        self.assertEqual(rule.observe(1, 10, 60.0)[0], None)
+        self.assertEqual(rule.observe(1, 20, 60.0)[0], 'firing')
+
+    def test_default_hysteresis(self):
+        rule = Alert_Rule('cpu>50')
+        self.assertEqual(rule.clear, 45.0)
+        self.assertEqual(rule.observe(1, 0, 60.0)[0], 'firing')
+        # under the threshold but not back under clear yet
+        self.assertEqual(rule.observe(1, 1, 48.0)[0], None)
+        self.assertEqual(rule.observe(1, 2, 44.0)[0], 'resolved')
+
+    def test_explicit_clear_and_below_rules(self):
+        rule = Alert_Rule('memory<10;clear=20')
+        self.assertEqual(rule.observe('system', 0, 5.0)[0], 'firing')
+        self.assertEqual(rule.observe('system', 1, 15.0)[0], None)
+        self.assertEqual(rule.observe('system', 2, 25.0)[0], 'resolved')
+
+    def test_moving_average(self):
+        rule = Alert_Rule('cpu>50;avg=10s')
+        self.assertEqual(rule.observe(1, 0, 100.0)[0], 'firing')
+        rule = Alert_Rule('cpu>50;avg=10s')
+        rule.observe(1, 0, 0.0)
+        # the mean of 0 and 90 is 45
+        self.assertEqual(rule.observe(1, 1, 90.0), (None, 45.0))
+        self.assertEqual(rule.observe(1, 12, 90.0), ('firing', 90.0))
+
+    def test_rate_limit(self):
+        rule = Alert_Rule('rss>1M;rate=1')
+        self.assertEqual(rule.observe(1, 0, 2 * 1024 ** 2)[0], 'firing')
+        # over the limit, firing but not reported and so never reported as resolved either
+        self.assertEqual(rule.observe(2, 0, 2 * 1024 ** 2)[0], None)
+        self.assertEqual(rule.suppressed, 1)
+        self.assertEqual(rule.observe(2, 1, 0)[0], None)
+        self.assertEqual(rule.observe(1, 1, 0)[0], 'resolved')
+
+    def test_forget(self):
+        rule = Alert_Rule('cpu>50')
+        rule.observe(1, 0, 60.0)
+        self.assertTrue(rule.forget(1))
+        self.assertFalse(rule.forget(1))
+
+    def test_bad_rules(self):
+        for spec in ('', 'cpu', 'load>5', 'cpu=5', 'cpu>fast', 'cpu>5;every=1m', 'memory>5;match=name=x',
+                     'zombies>0', 'cpu>50;rate=0', 'cpu>50;rate=many'):
+            with self.subTest(spec=spec):
+                with self.assertRaises(ValueError):
+                    Alert_Rule(spec)
+        self.assertEqual(Alert_Rule('zombies>0;clear=0').clear, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
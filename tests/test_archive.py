@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from Process import Fleet_Protocol, Metrics_Archive
+
+# a whole utc hour so the 1m and 1h buckets line up with the ticks
+start = 1_700_002_800
+cpu, memory, swap = (Metrics_Archive.metrics[name] for name in ('system.cpu', 'system.memory', 'system.swap'))
+rss, process_cpu = Metrics_Archive.metrics['process.rss'], Metrics_Archive.metrics['process.cpu']
+
+
+class Metrics_Archive_Test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def record(self, archive, first, last):
+        # one tick a second, cpu goes up by one and rss by two every tick so every mean is whole
+        for second in range(first, last):
+            now = start + second
+            archive.append_tick(now, {'system.cpu': float(second % 60), 'system.memory': 4096, 'system.swap': 0},
+                                [{'pid': 42, 'name': 'worker', 'memory_info': Fleet_Protocol.memory(1000 + 2 * second),
+                                  'cpu_percent': 12.34}])
+
+    def test_raw_query_is_a_time_range(self):
+        archive = Metrics_Archive(self.directory)
+        self.record(archive, 0, 120)
+        archive.close()
+        records = list(archive.query('raw', start + 10, start + 19))
+        system = [record for record in records if record[1] == 0]
+        self.assertEqual(len(system), 30)
+        self.assertTrue(all(start + 10 <= when <= start + 19 for when, _, _, _ in records))
+        self.assertEqual([when for when, _, _, _ in records], sorted(when for when, _, _, _ in records))
+        self.assertEqual({(when, value) for when, pid, code, value in system if code == cpu},
+                         {(start + second, float(second)) for second in range(10, 20)})
+
+    def test_processes_are_kept_raw_as_means(self):
+        archive = Metrics_Archive(self.directory)
+        self.record(archive, 0, 30)
+        archive.close()
+        processes = [record for record in archive.query('raw', start, start + 60) if record[1] == 42]
+        # one mean per process_every seconds, stamped with the last tick in it
+        self.assertEqual(sorted((when, value) for when, _, code, value in processes if code == rss),
+                         [(start + 9, 1009), (start + 19, 1029), (start + 29, 1049)])
+        self.assertTrue(all(value == 12.34 for _, _, code, value in processes if code == process_cpu))
+
+    def test_downsampled_tiers(self):
+        archive = Metrics_Archive(self.directory)
+        self.record(archive, 0, 150)
+        archive.close()
+        minutes = [(when, value) for when, pid, code, value in archive.query('1m', start, start + 3600)
+                   if pid == 0 and code == cpu]
+        # 0..59 twice and then 0..29
+        self.assertEqual(minutes, [(start, 29.5), (start + 60, 29.5), (start + 120, 14.5)])
+        hours = [value for _, pid, code, value in archive.query('1h', start, start + 3600) if pid == 42 and code == rss]
+        self.assertEqual(hours, [1149])
+
+    def test_query_outside_of_the_data(self):
+        archive = Metrics_Archive(self.directory)
+        self.record(archive, 0, 5)
+        archive.close()
+        self.assertEqual(list(archive.query('raw', start + 100, start + 200)), [])
+        self.assertEqual(list(archive.query('1h', start - 86400 * 3, start - 86400)), [])
+
+    def test_open_buckets_survive_a_crash(self):
+        crashed = Metrics_Archive(self.directory)
+        self.record(crashed, 0, 30)
+        crashed.checkpoint(start + 29)
+        # no close(), the next run picks the checkpoint up
+        for _, handle in crashed.files.values():
+            handle.close()
+        archive = Metrics_Archive(self.directory)
+        self.record(archive, 30, 60)
+        archive.close()
+        self.assertFalse(os.path.exists(archive.pending_path))
+        minutes = [value for _, pid, code, value in archive.query('1m', start, start + 60) if pid == 0 and code == cpu]
+        self.assertEqual(minutes, [29.5])
+
+    def test_snapshot_at_and_names(self):
+        archive = Metrics_Archive(self.directory)
+        self.record(archive, 0, 30)
+        archive.close()
+        tier, processes = archive.snapshot_at(start + 15)
+        self.assertEqual(tier, 'raw')
+        self.assertEqual(processes[0]['system.cpu'], 15.0)
+        self.assertEqual(processes[42]['process.rss'], 1029)
+        self.assertEqual(archive.names_at(start + 15), {42: 'worker'})
+
+    def test_parse_retention(self):
+        self.assertEqual(Metrics_Archive.parse_retention('raw=2, 1h=30'), {'raw': 2.0, '1h': 30.0})
+        with self.assertRaises(ValueError):
+            Metrics_Archive.parse_retention('5m=1')
+
+
+if __name__ == '__main__':
+    unittest.main()
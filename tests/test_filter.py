@@ -0,0 +1,64 @@
+import time
+import unittest
+
+from Process import Fleet_Protocol, Process_Filter
+
+
+def make_row(**fields):
+    row = {'pid': 100, 'name': 'python', 'username': 'root', 'status': 'running',
+           'memory_info': Fleet_Protocol.memory(600 * 1024 ** 2), 'cpu_percent': 55.0,
+           'create_time': time.time() - 120, 'num_threads': 4, 'num_fds': 12}
+    row.update(fields)
+    return row
+
+
+class Process_Filter_Test(unittest.TestCase):
+    def test_terms_are_all_required(self):
+        process_filter = Process_Filter('rss>500M,cpu>50')
+        self.assertTrue(process_filter.match(make_row()))
+        self.assertFalse(process_filter.match(make_row(cpu_percent=10.0)))
+        self.assertFalse(process_filter.match(make_row(memory_info=Fleet_Protocol.memory(100))))
+
+    def test_units(self):
+        self.assertTrue(Process_Filter('rss>=600M').match(make_row()))
+        self.assertTrue(Process_Filter('rss<1G').match(make_row()))
+        self.assertTrue(Process_Filter('age>1m').match(make_row()))
+        self.assertFalse(Process_Filter('age>1h').match(make_row()))
+
+    def test_text_fields(self):
+        self.assertTrue(Process_Filter('name~^py').match(make_row()))
+        self.assertFalse(Process_Filter('name~^java').match(make_row()))
+        self.assertTrue(Process_Filter('user!=nobody').match(make_row()))
+        self.assertTrue(Process_Filter('status=running').match(make_row()))
+
+    def test_operators_are_not_read_as_their_prefix(self):
+        self.assertEqual(Process_Filter('threads>=4').split_term('threads>=4'), ('threads', '>=', '4'))
+        self.assertTrue(Process_Filter('threads>=4').match(make_row()))
+        self.assertFalse(Process_Filter('threads>4').match(make_row()))
+
+    def test_unreadable_values_never_match(self):
+        row = make_row(memory_info=None, num_fds=None)
+        self.assertFalse(Process_Filter('rss>0').match(row))
+        self.assertFalse(Process_Filter('fds<100').match(row))
+
+    def test_fields_to_read(self):
+        process_filter = Process_Filter('rss>1M,threads>2,user=root')
+        self.assertEqual(process_filter.dynamic_fields, ('memory_info', 'num_threads'))
+        self.assertEqual(process_filter.static_fields, ('username',))
+        self.assertEqual(process_filter.columns, ['rss', 'threads', 'user'])
+        # status is read so a filter on static fields still refreshes something
+        self.assertEqual(Process_Filter('name=python').dynamic_fields, ('status',))
+
+    def test_apply_streams_the_matches(self):
+        rows = [make_row(pid=1), make_row(pid=2, cpu_percent=1.0), make_row(pid=3)]
+        self.assertEqual([row['pid'] for row in Process_Filter('cpu>50').apply(rows)], [1, 3])
+
+    def test_bad_expressions(self):
+        for expression in ('', 'bogus>1', 'cpu>fast', 'cpu~5', 'name>python', 'name~(', 'rss'):
+            with self.subTest(expression=expression):
+                with self.assertRaises(ValueError):
+                    Process_Filter(expression)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from socket import AF_UNIX, SOCK_STREAM, socket
+
+from Process import Fleet_Agent, Fleet_Collector, Fleet_Protocol
+
+
+def make_row(pid, name='worker', rss=1000, cpu=0.0, ppid=1):
+    return {'pid': pid, 'name': name, 'username': 'root', 'ppid': ppid, 'create_time': 1_700_000_000.0 + pid,
+            'status': 'sleeping', 'memory_info': Fleet_Protocol.memory(rss), 'cpu_percent': cpu}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class Fleet_Protocol_Test(unittest.TestCase):
+    def test_frames_round_trip(self):
+        small = {'type': 'delta', 'changed': {'1': {'cpu': 1.5}}, 'exited': [2]}
+        large = {'type': 'full', 'processes': {str(pid): {'name': 'x' * 20} for pid in range(200)}}
+        self.assertEqual(Fleet_Protocol.encode(small)[4], 0)
+        # big messages go out compressed
+        self.assertEqual(Fleet_Protocol.encode(large)[4], 1)
+        buffer = bytearray(Fleet_Protocol.encode(small) + Fleet_Protocol.encode(large))
+        self.assertEqual(Fleet_Protocol.decode_frames(buffer), [small, large])
+        self.assertEqual(buffer, bytearray())
+
+    def test_partial_frames_wait_for_the_rest(self):
+        message = {'type': 'hello', 'host': 'node-1', 'interval': 1.0}
+        frame = Fleet_Protocol.encode(message)
+        buffer = bytearray()
+        decoded = []
+        for byte in frame + frame[:3]:
+            buffer.append(byte)
+            decoded += Fleet_Protocol.decode_frames(buffer)
+        self.assertEqual(decoded, [message])
+        # the start of the next frame is left for the next read
+        self.assertEqual(bytes(buffer), frame[:3])
+
+    def test_diff_only_carries_what_changed(self):
+        before = {1: Fleet_Protocol.encode_row(make_row(1)), 2: Fleet_Protocol.encode_row(make_row(2))}
+        current = {2: Fleet_Protocol.encode_row(make_row(2, rss=2000)), 3: Fleet_Protocol.encode_row(make_row(3))}
+        changed, exited = Fleet_Protocol.diff(before, current)
+        self.assertEqual(changed, {'2': {'rss': 2000}, '3': current[3]})
+        self.assertEqual(exited, [1])
+        self.assertEqual(Fleet_Protocol.diff(current, current), ({}, []))
+
+    def test_apply_fields_rebuilds_snapshot_rows(self):
+        row = Fleet_Protocol.apply_fields({'pid': 7}, Fleet_Protocol.encode_row(make_row(7, rss=4096, cpu=12.345)))
+        self.assertEqual(row['memory_info'].rss, 4096)
+        self.assertEqual(row['cpu_percent'], 12.3)
+        self.assertEqual(row['name'], 'worker')
+        Fleet_Protocol.apply_fields(row, {'rss': None, 'status': 'zombie'})
+        self.assertIsNone(row['memory_info'])
+        self.assertEqual(row['status'], 'zombie')
+
+    def test_parse_address(self):
+        self.assertEqual(Fleet_Protocol.parse_address('unix:/tmp/a.sock'), (AF_UNIX, '/tmp/a.sock'))
+        self.assertEqual(Fleet_Protocol.parse_address('tcp:127.0.0.1:9120')[1], ('127.0.0.1', 9120))
+        self.assertEqual(Fleet_Protocol.parse_address(':9120')[1], ('0.0.0.0', 9120))
+        with self.assertRaises(ValueError):
+            Fleet_Protocol.parse_address('localhost')
+
+
+class Stop(Exception):
+    pass
+
+
+# stands in for the Monitor an agent reads its rows from
+class Fake_Monitor:
+    def __init__(self, rows) -> None:
+        self.rows = rows
+        self.stopped = False
+
+    def current_rows(self) -> list:
+        if self.stopped:
+            raise Stop()
+        return [dict(row) for row in self.rows]
+
+
+class Fleet_Collector_Test(unittest.TestCase):
+    agents = 3
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.address = f'unix:{os.path.join(directory, "collector.sock")}'
+        self.collector = Fleet_Collector(self.address)
+        self.collector.start()
+        self.addCleanup(self.collector.join, 5)
+        self.addCleanup(self.collector.stop)
+        self.monitors = {}
+        self.connections = {}
+        for number in range(1, self.agents + 1):
+            name = f'node-{number}'
+            rows = [make_row(pid, rss=pid * 1000) for pid in range(1, 6)]
+            self.start_agent(name, rows)
+
+    def start_agent(self, name, rows):
+        monitor = self.monitors[name] = Fake_Monitor(rows)
+        agent = Fleet_Agent(monitor, self.address, name, interval=0.05)
+        connection = self.connections[name] = socket(AF_UNIX, SOCK_STREAM)
+        connection.connect(self.collector.address)
+
+        def stream():
+            with contextlib.suppress(Stop, OSError):
+                agent.stream(connection)
+            connection.close()
+        thread = threading.Thread(target=stream, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(setattr, monitor, 'stopped', True)
+        return agent
+
+    def rows(self):
+        return {(row['host'], row['pid']): row for row in self.collector.get_rows()}
+
+    def test_agents_are_merged(self):
+        self.assertTrue(wait_for(lambda: len(self.rows()) == 15))
+        rows = self.rows()
+        self.assertEqual({host for host, _ in rows}, {'node-1', 'node-2', 'node-3'})
+        self.assertEqual(rows[('node-2', 3)]['memory_info'].rss, 3000)
+        self.assertEqual(rows[('node-2', 3)]['name'], 'worker')
+
+    def test_deltas_follow_each_agent(self):
+        self.assertTrue(wait_for(lambda: len(self.rows()) == 15))
+        monitor = self.monitors['node-1']
+        monitor.rows = [make_row(1, rss=9000, cpu=50.0)] + monitor.rows[2:] + [make_row(40, name='new')]
+        self.assertTrue(wait_for(lambda: ('node-1', 40) in self.rows() and ('node-1', 2) not in self.rows()))
+        rows = self.rows()
+        self.assertEqual(rows[('node-1', 1)]['memory_info'].rss, 9000)
+        self.assertEqual(rows[('node-1', 1)]['cpu_percent'], 50.0)
+        self.assertEqual(rows[('node-1', 40)]['name'], 'new')
+        # the other hosts' pids are left alone
+        self.assertEqual(rows[('node-2', 1)]['memory_info'].rss, 1000)
+        self.assertIn(('node-3', 2), rows)
+        entry = self.collector.hosts['node-1']
+        self.assertGreater(entry['messages'], 1)
+
+    def test_a_disconnected_agent_drops_out(self):
+        self.assertTrue(wait_for(lambda: len(self.rows()) == 15))
+        self.monitors['node-3'].stopped = True
+        self.assertTrue(wait_for(lambda: not self.collector.hosts['node-3']['connected']))
+        self.assertEqual({host for host, _ in self.rows()}, {'node-1', 'node-2'})
+
+    def test_a_reconnecting_agent_takes_over(self):
+        self.assertTrue(wait_for(lambda: len(self.rows()) == 15))
+        self.start_agent('node-1', [make_row(99)])
+        self.assertTrue(wait_for(lambda: [pid for host, pid in self.rows() if host == 'node-1'] == [99]))
+
+
+if __name__ == '__main__':
+    unittest.main()
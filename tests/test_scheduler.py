@@ -0,0 +1,88 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from Process import Task_Scheduler
+
+
+def at(year, month, day, hour=0, minute=0):
+    return datetime.datetime(year, month, day, hour, minute).timestamp()
+
+
+class Task_Scheduler_Test(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.scheduler = Task_Scheduler(None, os.path.join(directory, 'jobs.json'))
+        # a sunday morning
+        self.now = at(2026, 10, 18, 10, 0)
+
+    def job(self, spec):
+        return Task_Scheduler.parse_job(f'name=test;action=disk;{spec}')
+
+    def test_parse_duration(self):
+        self.assertEqual(Task_Scheduler.parse_duration('90'), 90)
+        self.assertEqual(Task_Scheduler.parse_duration('5m'), 300)
+        self.assertEqual(Task_Scheduler.parse_duration('1.5h'), 5400)
+        for value in ('0s', '-5m', '5w', 'soon'):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    Task_Scheduler.parse_duration(value)
+
+    def test_first_run_of_an_interval(self):
+        self.assertEqual(self.scheduler.first_run(self.job('every=5m'), self.now), self.now + 300)
+
+    def test_first_run_of_a_daily_job(self):
+        self.assertEqual(self.scheduler.first_run(self.job('every=daily;at=11:30'), self.now), at(2026, 10, 18, 11, 30))
+        # already gone by today, so tomorrow
+        self.assertEqual(self.scheduler.first_run(self.job('every=daily;at=09:00'), self.now), at(2026, 10, 19, 9, 0))
+
+    def test_first_run_of_a_weekly_job(self):
+        self.assertEqual(self.scheduler.first_run(self.job('every=weekly;on=monday;at=08:00'), self.now),
+                         at(2026, 10, 19, 8, 0))
+        self.assertEqual(self.scheduler.first_run(self.job('every=weekly;on=sun;at=09:00'), self.now),
+                         at(2026, 10, 25, 9, 0))
+
+    def test_first_run_of_a_monthly_job(self):
+        self.assertEqual(self.scheduler.first_run(self.job('every=monthly;on=1;at=00:00'), self.now),
+                         at(2026, 11, 1))
+        # the 31st of a 30 day month is its last day
+        self.assertEqual(self.scheduler.first_run(self.job('every=monthly;on=31;at=12:00'), at(2026, 11, 2)),
+                         at(2026, 11, 30, 12, 0))
+
+    def test_following_runs(self):
+        daily = self.job('every=daily;count=2;at=09:00')
+        self.assertEqual(self.scheduler.following(daily, at(2026, 10, 18, 9, 0)), at(2026, 10, 20, 9, 0))
+        monthly = self.job('every=monthly;on=31;at=09:00')
+        self.assertEqual(self.scheduler.following(monthly, at(2026, 1, 31, 9, 0)), at(2026, 2, 28, 9, 0))
+        once = self.job('every=once;at=2026-10-18 12:00')
+        self.assertIsNone(self.scheduler.following(once, at(2026, 10, 18, 12, 0)))
+
+    def test_missed_runs(self):
+        interval = dict(self.job('every=1m'), next_run=self.now - 125)
+        self.assertEqual(self.scheduler.missed(interval, self.now), (3, self.now + 55))
+        daily = dict(self.job('every=daily;at=09:00'), next_run=at(2026, 10, 15, 9, 0))
+        self.assertEqual(self.scheduler.missed(daily, self.now), (4, at(2026, 10, 19, 9, 0)))
+
+    def test_catch_up_policies(self):
+        for policy, owed in (('skip', 0), ('once', 1), ('all', 3)):
+            with self.subTest(policy=policy):
+                job = self.job(f'every=1m;catch_up={policy}')
+                job['next_run'] = self.now - 125
+                self.scheduler.jobs = {job['name']: job}
+                self.assertEqual(len(self.scheduler.catch_up(self.now)), owed)
+                self.assertEqual(job['next_run'], self.now + 55)
+
+    def test_bad_jobs(self):
+        for spec in ('name=x;action=nope;every=5m', 'action=disk;every=5m', 'name=x;action=disk',
+                     'name=x;action=filter;every=5m', 'name=x;action=disk;every=weekly;on=someday',
+                     'name=x;action=disk;every=monthly;on=32', 'name=x;action=disk;every=5m;catch_up=maybe'):
+            with self.subTest(spec=spec):
+                with self.assertRaises(ValueError):
+                    Task_Scheduler.parse_job(spec)
+
+
+if __name__ == '__main__':
+    unittest.main()
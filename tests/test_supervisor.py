@@ -0,0 +1,74 @@
+import os
+import unittest
+
+from Process import Process_Supervisor
+
+
+class Process_Supervisor_Test(unittest.TestCase):
+    def setUp(self):
+        # never started, the children are driven by hand
+        self.supervisor = Process_Supervisor()
+        self.addCleanup(os.close, self.supervisor.wake_write)
+        self.addCleanup(os.close, self.supervisor.wake_read)
+
+    def add(self, spec):
+        program = Process_Supervisor.parse_program(spec)
+        self.supervisor.add_program(program)
+        return self.supervisor.children[-1]
+
+    def test_parse_program(self):
+        program = Process_Supervisor.parse_program('name=web;cmd=python -m http.server;count=2;restart=always')
+        self.assertEqual(program['argv'], ['python', '-m', 'http.server'])
+        self.assertEqual((program['name'], program['count'], program['restart']), ('web', 2, 'always'))
+        self.assertEqual(program['backoff'], 1.0)
+        # a plain command keeps its = and ;
+        program = Process_Supervisor.parse_program('app --port=8000;')
+        self.assertEqual((program['cmd'], program['name']), ('app --port=8000;', 'app'))
+        program = Process_Supervisor.parse_program("name=sh;cmd=sh -c 'a; b'")
+        self.assertEqual(program['argv'], ['sh', '-c', 'a; b'])
+
+    def test_bad_programs(self):
+        for spec in ('name=x', 'cmd=a;restart=sometimes', 'cmd=a;count=0', 'cmd=a;colour=red', "cmd=sh -c 'a"):
+            with self.subTest(spec=spec):
+                with self.assertRaises(ValueError):
+                    Process_Supervisor.parse_program(spec)
+
+    def test_copies_are_numbered(self):
+        self.supervisor.add_program(Process_Supervisor.parse_program('name=w;cmd=sleep 1;count=3'))
+        self.assertEqual([child['name'] for child in self.supervisor.children], ['w.0', 'w.1', 'w.2'])
+
+    def test_backoff_doubles_up_to_the_cap(self):
+        child = self.add('name=w;cmd=false;restart=on-failure;backoff=1s;max_backoff=4s')
+        delays = []
+        now = 100.0
+        for _ in range(4):
+            child['started'] = now
+            now += 1
+            self.supervisor.exited(child, 1, now)
+            self.assertEqual(child['state'], 'backoff')
+            delays.append(child['next_start'] - now)
+        self.assertEqual(delays, [1, 2, 4, 4])
+        # a child that stayed up long enough starts over from the first delay
+        child['started'] = now
+        now += Process_Supervisor.stable_after
+        self.supervisor.exited(child, 1, now)
+        self.assertEqual(child['next_start'] - now, 1)
+
+    def test_restart_policies(self):
+        for restart, code, state in (('on-failure', 0, 'exited'), ('never', 1, 'failed'), ('always', 0, 'backoff')):
+            with self.subTest(restart=restart, code=code):
+                child = self.add(f'name=w;cmd=true;restart={restart}')
+                child['started'] = 0.0
+                self.supervisor.exited(child, code, 1.0)
+                self.assertEqual(child['state'], state)
+
+    def test_nothing_restarts_while_stopping(self):
+        child = self.add('name=w;cmd=false;restart=always')
+        child['started'] = 0.0
+        self.supervisor.stop()
+        self.supervisor.exited(child, 1, 1.0)
+        self.assertEqual(child['state'], 'failed')
+
+
+if __name__ == '__main__':
+    unittest.main()